@@ -0,0 +1,86 @@
+"""Measures offline breach-audit throughput against a synthetic corpus.
+
+Writes a HIBP-style "SHA1HEX:COUNT" dump of random digests (plus the
+digests of some vault passwords, so there are hits), converts it with and
+without a Bloom filter, and runs `audit breaches` over a synthetic vault.
+
+Usage:
+    python benchmarks/breach_benchmark.py [--corpus 2000000] [--entries 10000]
+        [--history-depth 3] [--output results.json]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_manager import PasswordManager
+from src.audit.breaches import BreachCorpus, audit_breaches, convert_corpus
+from vault_generator import DEFAULT_MASTER_PASSWORD, generate_vault, working_directory
+
+
+def write_dump(path, size, known_passwords, rng):
+    """Writes size random digests plus known_passwords, unordered"""
+    with open(path, 'w') as f:
+        for index in range(size):
+            f.write(f"{rng.getrandbits(160):040X}:{rng.randint(1, 1000)}\n")
+            if index % 1000 == 0 and known_passwords:
+                password = known_passwords.pop()
+                f.write(f"{hashlib.sha1(password.encode()).hexdigest().upper()}:42\n")
+
+
+def lookups_per_sec(corpus, digests):
+    start = time.perf_counter()
+    for digest in digests:
+        corpus.lookup(digest)
+    return len(digests) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', type=int, default=2000000)
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--history-depth', type=int, default=3)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    results = {'corpus': args.corpus, 'entries': args.entries, 'history_depth': args.history_depth}
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_vault(directory, args.entries, args.history_depth)
+        with working_directory(directory):
+            pm = PasswordManager(DEFAULT_MASTER_PASSWORD)
+            known = [entry.password for entry in pm.db_manager.iter_passwords(decrypt=True)][::50]
+
+            dump = os.path.join(directory, 'dump.txt')
+            write_dump(dump, args.corpus, known, rng)
+            corpus_path = os.path.join(directory, 'corpus.bin')
+            bloom_path = os.path.join(directory, 'corpus.bloom')
+            start = time.perf_counter()
+            convert_corpus(dump, corpus_path, bloom_path)
+            results['convert_seconds'] = time.perf_counter() - start
+
+            misses = [rng.getrandbits(160).to_bytes(20, 'big') for _ in range(args.lookups)]
+            for label, bloom in (('mmap', None), ('mmap_bloom', bloom_path)):
+                with BreachCorpus(corpus_path, bloom) as corpus:
+                    results[f'{label}_miss_lookups_per_sec'] = lookups_per_sec(corpus, misses)
+                    audit = audit_breaches(pm.db_manager, corpus)
+                    results[f'{label}_audit_checks_per_sec'] = audit['checks_per_sec']
+                    results['audit_checked'] = audit['checked']
+                    results['audit_breached'] = audit['breached']
+            pm.close()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
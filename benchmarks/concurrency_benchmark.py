@@ -0,0 +1,160 @@
+"""Multi-process write stress test: checks for lost updates and measures throughput.
+
+Several processes, each with several threads, hammer a small set of hot
+accounts with update_password. Every update moves the previous password to
+history, so once all writers finish, each account's history plus its
+current password must hold exactly its initial password and every value
+written to it. A value missing means an update was lost; a value seen
+twice means two updates read the same "current" password.
+
+Each configuration runs with direct writes (one transaction per update)
+and with a WriteQueue per process (group commit).
+
+Usage:
+    python benchmarks/concurrency_benchmark.py [--processes 4] [--threads 4]
+        [--ops 500] [--accounts 16] [--output results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_manager import PasswordManager
+from src.database.write_queue import WriteQueue
+from vault_generator import DEFAULT_MASTER_PASSWORD, account_key, generate_vault, working_directory
+
+
+def worker(directory, worker_id, threads, ops, accounts, queued, barrier, results):
+    """Runs ops updates per thread; reports the values written and counters"""
+    with working_directory(directory):
+        pm = PasswordManager(DEFAULT_MASTER_PASSWORD)
+    db = pm.db_manager
+    writes = WriteQueue(db) if queued else None
+    written = []
+    errors = []
+
+    def run(thread_id):
+        rng = random.Random(worker_id * 1000 + thread_id)
+        for i in range(ops):
+            site, username = account_key(rng.randrange(accounts))
+            value = f"w{worker_id}-t{thread_id}-{i}"
+            try:
+                if writes is not None:
+                    writes.call('update_password', site, username, value)
+                else:
+                    db.update_password(site, username, value)
+                written.append((site, username, value))
+            except Exception as e:
+                errors.append(str(e))
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    barrier.wait()  # unlocking is slow on purpose; start every writer together
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    transactions = len(written)
+    if writes is not None:
+        writes.close()
+        transactions = writes.transactions
+    results.put({'written': written, 'errors': errors, 'seconds': elapsed,
+                 'busy_retries': db.busy_retries, 'transactions': transactions})
+    pm.close()
+
+
+def verify(directory, accounts, initial, written):
+    """Returns (lost, duplicated) counts over every hot account"""
+    expected = {account_key(i): Counter([initial[account_key(i)]]) for i in range(accounts)}
+    for site, username, value in written:
+        expected[(site, username)][value] += 1
+    lost = duplicated = 0
+    with working_directory(directory):
+        pm = PasswordManager(DEFAULT_MASTER_PASSWORD)
+        try:
+            for (site, username), values in expected.items():
+                seen = Counter(password for password, _ in
+                               pm.db_manager.get_password_history(site, username))
+                seen[pm.db_manager.get_password(site, username)] += 1
+                lost += sum((values - seen).values())
+                duplicated += sum((seen - values).values())
+        finally:
+            pm.close()
+    return lost, duplicated
+
+
+def run(processes, threads, ops, accounts, queued):
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        generate_vault(directory, accounts)
+        with working_directory(directory):
+            pm = PasswordManager(DEFAULT_MASTER_PASSWORD)
+            initial = {account_key(i): pm.db_manager.get_password(*account_key(i))
+                       for i in range(accounts)}
+            pm.close()
+
+        barrier = context.Barrier(processes)
+        results = context.Queue()
+        pool = [context.Process(target=worker, args=(directory, w, threads, ops, accounts,
+                                                     queued, barrier, results))
+                for w in range(processes)]
+        for process in pool:
+            process.start()
+        reports = [results.get() for _ in pool]
+        for process in pool:
+            process.join()
+
+        written = [item for report in reports for item in report['written']]
+        lost, duplicated = verify(directory, accounts, initial, written)
+    seconds = max(report['seconds'] for report in reports)
+    return {
+        'mode': 'queued' if queued else 'direct',
+        'writes': len(written),
+        'errors': sum(len(report['errors']) for report in reports),
+        'seconds': seconds,
+        'writes_per_sec': len(written) / seconds if seconds else None,
+        'transactions': sum(report['transactions'] for report in reports),
+        'busy_retries': sum(report['busy_retries'] for report in reports),
+        'lost_updates': lost,
+        'duplicated_updates': duplicated,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=500, help="updates per thread")
+    parser.add_argument('--accounts', type=int, default=16, help="hot accounts to update")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {'processes': args.processes, 'threads': args.threads,
+               'ops_per_thread': args.ops, 'accounts': args.accounts, 'runs': []}
+    for queued in (False, True):
+        run_result = run(args.processes, args.threads, args.ops, args.accounts, queued)
+        results['runs'].append(run_result)
+        print(f"{run_result['mode']:>6}: {run_result['writes']} writes in "
+              f"{run_result['seconds']:.2f}s ({run_result['writes_per_sec']:.0f}/s, "
+              f"{run_result['transactions']} transactions, {run_result['busy_retries']} busy retries), "
+              f"{run_result['lost_updates']} lost, {run_result['duplicated_updates']} duplicated, "
+              f"{run_result['errors']} errors")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if any(r['lost_updates'] or r['duplicated_updates'] for r in results['runs']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Compares connect-per-call database access with the persistent connection.
+
+Usage:
+    python benchmarks/connection_benchmark.py [--entries 50000] [--ops 2000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database.database_manager import DatabaseManager
+from src.encryption import Encryption
+
+
+class ConnectPerCallManager:
+    """Reproduces the original access pattern: one connection per operation"""
+
+    def __init__(self, cipher_suite, db_name):
+        self.db_name = db_name
+        self.cipher_suite = cipher_suite
+
+    def get_password_history(self, site, username):
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute("""SELECT old_password, changed_date
+                    FROM password_history
+                    WHERE site=? AND username=?
+                    ORDER BY changed_date DESC""", (site, username))
+        history = c.fetchall()
+        conn.close()
+        return [(self.cipher_suite.decrypt(p).decode(), d) for p, d in history]
+
+    def update_description(self, site, username, new_description):
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute("UPDATE passwords SET description=? WHERE site=? AND username=?",
+                  (new_description, site, username))
+        rows_affected = c.rowcount
+        conn.commit()
+        conn.close()
+        return rows_affected > 0
+
+    def update_password(self, site, username, new_password):
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute("SELECT password FROM passwords WHERE site=? AND username=?",
+                  (site, username))
+        result = c.fetchone()
+        if not result:
+            conn.close()
+            return False
+        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        c.execute("""INSERT INTO password_history
+                    (site, username, old_password, changed_date)
+                    VALUES (?, ?, ?, ?)""", (site, username, result[0], current_date))
+        c.execute("UPDATE passwords SET password=? WHERE site=? AND username=?",
+                  (self.cipher_suite.encrypt(new_password.encode()), site, username))
+        conn.commit()
+        conn.close()
+        return True
+
+
+def populate(db_manager, entries):
+    """Fills the vault with synthetic accounts in a single transaction"""
+    token = db_manager.cipher_suite.encrypt(b'benchmark-password')
+    rows = ((f"site{i}.example", f"user{i}", token, '') for i in range(entries))
+    with db_manager._transaction() as c:
+        c.executemany("""INSERT INTO passwords (site, username, password, description)
+                        VALUES (?, ?, ?, ?)""", rows)
+
+
+def run_ops(manager, keys, ops):
+    """Runs a fixed mix of reads and writes and returns operations per second"""
+    start = time.perf_counter()
+    for i in range(ops):
+        site, username = keys[i % len(keys)]
+        kind = i % 3
+        if kind == 0:
+            manager.get_password_history(site, username)
+        elif kind == 1:
+            manager.update_description(site, username, f"note {i}")
+        else:
+            manager.update_password(site, username, f"password-{i}")
+    return ops / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    cipher_suite = Encryption.get_cipher_suite(Encryption.generate_key())
+    rng = random.Random(args.seed)
+    keys = [(f"site{i}.example", f"user{i}")
+            for i in rng.sample(range(args.entries), min(args.ops, args.entries))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        with DatabaseManager(cipher_suite, db_name) as db_manager:
+            populate(db_manager, args.entries)
+
+        legacy = run_ops(ConnectPerCallManager(cipher_suite, db_name), keys, args.ops)
+        with DatabaseManager(cipher_suite, db_name) as db_manager:
+            persistent = run_ops(db_manager, keys, args.ops)
+
+    print(f"Vault size:          {args.entries} entries")
+    print(f"Connect-per-call:    {legacy:10.1f} ops/sec")
+    print(f"Persistent:          {persistent:10.1f} ops/sec")
+    print(f"Speedup:             {persistent / legacy:10.2f}x")
+
+
+if __name__ == '__main__':
+    main()
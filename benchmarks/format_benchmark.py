@@ -0,0 +1,95 @@
+"""Compares the Fernet and compact AES-GCM storage formats.
+
+Builds one synthetic vault, converts it to each format in turn with
+migrate_format, and measures the conversion rate, the database size after
+a full VACUUM, and decrypt throughput for single-value reads, full-vault
+scans and the raw cipher.
+
+Usage:
+    python benchmarks/format_benchmark.py [--entries 20000] [--history-depth 3]
+        [--reads 2000] [--output results.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_manager import PasswordManager
+from vault_generator import DEFAULT_MASTER_PASSWORD, account_key, generate_vault, working_directory
+
+
+def per_sec(count, function):
+    start = time.perf_counter()
+    function()
+    return count / (time.perf_counter() - start)
+
+
+def measure(db, entries, reads, rng):
+    accounts = [account_key(rng.randrange(entries)) for _ in range(reads)]
+    rows = db._fetchall("SELECT password, site, username FROM passwords LIMIT ?", (reads,))
+    compaction = db.compact(full=True)
+    start = time.perf_counter()
+    history = sum(1 for _ in db.iter_history())
+    history_seconds = time.perf_counter() - start
+    return {
+        'database_bytes': compaction['bytes_after'],
+        'stored_bytes': sum(f['bytes'] for f in db.storage_stats()['formats'].values()),
+        'get_password_per_sec': per_sec(reads, lambda: [db.get_password(*a) for a in accounts]),
+        'cipher_decrypt_per_sec': per_sec(
+            len(rows), lambda: [db.cipher.decrypt(token, (site, username))
+                                for token, site, username in rows]),
+        'scan_passwords_per_sec': per_sec(
+            entries, lambda: sum(1 for _ in db.iter_passwords(decrypt=True))),
+        'scan_history_per_sec': history / history_seconds if history else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=20000)
+    parser.add_argument('--history-depth', type=int, default=3)
+    parser.add_argument('--reads', type=int, default=2000)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    results = {'entries': args.entries, 'history_depth': args.history_depth}
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_vault(directory, args.entries, args.history_depth)
+        with working_directory(directory):
+            pm = PasswordManager(DEFAULT_MASTER_PASSWORD)
+            db = pm.db_manager
+            # Cache off, so every read decrypts
+            db.cache = None
+            try:
+                for storage_format in ('fernet', 'aead'):
+                    start = time.perf_counter()
+                    converted = db.migrate_format(storage_format)
+                    elapsed = time.perf_counter() - start
+                    metrics = measure(db, args.entries, args.reads, rng)
+                    metrics['migrate_rows_per_sec'] = converted / elapsed if elapsed else None
+                    results[storage_format] = metrics
+            finally:
+                pm.close()
+
+    fernet, aead = results['fernet'], results['aead']
+    results['aead_vs_fernet'] = {
+        'database_size': aead['database_bytes'] / fernet['database_bytes'],
+        'stored_bytes': aead['stored_bytes'] / fernet['stored_bytes'],
+        'cipher_decrypt_speedup': aead['cipher_decrypt_per_sec'] / fernet['cipher_decrypt_per_sec'],
+        'scan_speedup': aead['scan_passwords_per_sec'] / fernet['scan_passwords_per_sec'],
+        'get_password_speedup': aead['get_password_per_sec'] / fernet['get_password_per_sec'],
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
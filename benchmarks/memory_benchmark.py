@@ -0,0 +1,84 @@
+"""Compares lookup and write latency of file-backed and in-memory vaults.
+
+Opens one synthetic vault three ways: on the file, in memory with every
+write going through to disk as it commits, and in memory with writes
+flushed on an interval. The entry cache is off, so every lookup reaches
+SQLite.
+
+Usage:
+    python benchmarks/memory_benchmark.py [--entries 20000] [--ops 2000]
+        [--flush-interval 1.0] [--output results.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_manager import PasswordManager
+from run_benchmarks import timed
+from vault_generator import DEFAULT_MASTER_PASSWORD, account_key, generate_vault, working_directory
+
+
+def run_mode(entries, ops, in_memory, flush_interval, seed):
+    rng = random.Random(seed)
+    keys = [account_key(rng.randrange(entries)) for _ in range(ops)]
+    start = time.perf_counter()
+    pm = PasswordManager(DEFAULT_MASTER_PASSWORD, cache_size=0,
+                         in_memory=in_memory, flush_interval=flush_interval)
+    metrics = {'open_seconds': time.perf_counter() - start}
+    db = pm.db_manager
+    try:
+        metrics['get_password'] = timed(db.get_password, keys)
+        metrics['search_prefix'] = timed(
+            db.search_passwords, [(f"site{rng.randrange(entries):07d}"[:9], 'prefix')
+                                  for _ in range(ops // 10)])
+        metrics['list_page'] = timed(db.get_passwords_page, [(20, key) for key in keys[:ops // 10]])
+        metrics['update_password'] = timed(
+            db.update_password, [(site, username, f"updated-{i}")
+                                 for i, (site, username) in enumerate(keys[:ops // 4])])
+        start = time.perf_counter()
+        db.flush()
+        metrics['final_flush_seconds'] = time.perf_counter() - start
+    finally:
+        pm.close()
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=20000)
+    parser.add_argument('--history-depth', type=int, default=1)
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--flush-interval', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    modes = (('file', False, 0), ('memory_sync', True, 0),
+             ('memory_interval', True, args.flush_interval))
+    results = {'entries': args.entries, 'ops': args.ops, 'flush_interval': args.flush_interval}
+    with tempfile.TemporaryDirectory() as directory:
+        generate_vault(directory, args.entries, args.history_depth)
+        with working_directory(directory):
+            for name, in_memory, flush_interval in modes:
+                results[name] = run_mode(args.entries, args.ops, in_memory, flush_interval, args.seed)
+
+    print(f"{'mode':<17}{'open s':>8}{'get p50 ms':>12}{'get p95 ms':>12}"
+          f"{'search p50':>12}{'update p50':>12}")
+    for name, _, _ in modes:
+        m = results[name]
+        print(f"{name:<17}{m['open_seconds']:>8.2f}{m['get_password']['p50_ms']:>12.3f}"
+              f"{m['get_password']['p95_ms']:>12.3f}{m['search_prefix']['p50_ms']:>12.3f}"
+              f"{m['update_password']['p50_ms']:>12.3f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Runs the vault benchmark suite and writes the results as JSON.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--sizes 1000,10000] [--history-depth 3]
+        [--ops 200] [--output results.json] [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_manager import PasswordManager
+from src.config import DATABASE_FILE
+from vault_generator import (
+    DEFAULT_MASTER_PASSWORD, account_key, generate_vault, random_password,
+    synthetic_entries, working_directory
+)
+
+
+def summarize(samples):
+    """Turns per-operation durations in seconds into a metrics dict"""
+    total = sum(samples)
+    ordered = sorted(samples)
+    return {
+        'ops': len(samples),
+        'seconds': total,
+        'ops_per_sec': len(samples) / total if total else None,
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+    }
+
+
+def timed(operation, args_list):
+    """Calls operation once per argument tuple and summarizes the latencies"""
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        operation(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def file_size(path):
+    """Size of the database including any WAL not yet checkpointed"""
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+def run_size(entries, history_depth, ops, seed, master_password):
+    """Generates one vault and measures every operation against it"""
+    rng = random.Random(seed)
+    metrics = {}
+    with tempfile.TemporaryDirectory() as directory:
+        generated = generate_vault(directory, entries, history_depth, master_password, seed)
+        metrics['bulk_add'] = {
+            'ops': entries,
+            'seconds': generated['bulk_add_seconds'],
+            'ops_per_sec': entries / generated['bulk_add_seconds'],
+        }
+
+        with working_directory(directory):
+            metrics['startup_unlock'] = timed(
+                lambda: PasswordManager(master_password).close(), [()] * 3
+            )
+
+            pm = PasswordManager(master_password)
+            db = pm.db_manager
+            try:
+                keys = [account_key(i) for i in rng.sample(range(entries), min(ops, entries))]
+                new_entries = list(synthetic_entries(ops, rng, start=entries))
+
+                metrics['add'] = timed(db.add_password, new_entries)
+                metrics['get_all'] = timed(db.get_passwords, [()])
+                metrics['get_all']['rows_per_sec'] = (entries + ops) / metrics['get_all']['seconds']
+                metrics['lookup'] = timed(db.get_password, keys)
+                metrics['history_read'] = timed(db.get_password_history, keys)
+                metrics['update'] = timed(
+                    db.update_password, [(site, user, random_password(rng)) for site, user in keys]
+                )
+                metrics['rename'] = timed(
+                    db.update_username, [(site, user, f"renamed-{user}") for site, user in keys]
+                )
+
+                db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                metrics['file_size_bytes'] = file_size(DATABASE_FILE)
+            finally:
+                pm.close()
+
+    return {'entries': entries, 'history_depth': history_depth, 'metrics': metrics}
+
+
+def metadata(args):
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ops': args.ops,
+        'seed': args.seed,
+    }
+
+
+def compare(current, previous):
+    """Prints throughput ratios against an earlier results file"""
+    baseline = {(r['entries'], r['history_depth']): r['metrics'] for r in previous['results']}
+    for result in current['results']:
+        old = baseline.get((result['entries'], result['history_depth']))
+        if not old:
+            continue
+        print(f"\n{result['entries']} entries vs baseline:")
+        for name, metric in result['metrics'].items():
+            before = old.get(name)
+            if isinstance(metric, dict) and isinstance(before, dict) and before.get('ops_per_sec'):
+                print(f"  {name:16} {metric['ops_per_sec'] / before['ops_per_sec']:6.2f}x")
+            elif name == 'file_size_bytes' and before:
+                print(f"  {name:16} {metric / before:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000',
+                        help="comma separated vault sizes, e.g. 1000,100000,1000000")
+    parser.add_argument('--history-depth', type=int, default=3)
+    parser.add_argument('--ops', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--master-password', default=DEFAULT_MASTER_PASSWORD)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = {'metadata': metadata(args), 'results': []}
+    for size in (int(s) for s in args.sizes.split(',')):
+        print(f"Benchmarking {size} entries...")
+        result = run_size(size, args.history_depth, args.ops, args.seed, args.master_password)
+        results['results'].append(result)
+        for name, metric in result['metrics'].items():
+            if isinstance(metric, dict):
+                print(f"  {name:16} {metric['ops_per_sec']:12.1f} ops/sec")
+            else:
+                print(f"  {name:16} {metric:12}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Measures cold-start-to-first-result time of the one-shot CLI.
+
+Runs `password_manager.py get` in fresh interpreters against a synthetic
+vault and fails (exit status 1) when the median exceeds the target.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--entries 10000] [--runs 10] [--target-ms 250]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vault_generator import DEFAULT_MASTER_PASSWORD, account_key, generate_vault
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'password_manager.py')
+
+# Budget for interpreter start, KDF verify at the default cost, key load,
+# opening the database and one lookup on a typical laptop
+STARTUP_TARGET_MS = 250
+
+
+def time_command(command, directory, stdin=None, runs=10):
+    """Runs command repeatedly and returns wall-clock times in milliseconds"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=directory, input=stdin, check=True,
+                       stdout=subprocess.DEVNULL, text=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--target-ms', type=float, default=STARTUP_TARGET_MS)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_vault(directory, args.entries)
+        site, username = account_key(args.entries // 2)
+
+        interpreter = time_command([sys.executable, '-c', 'pass'], directory, runs=args.runs)
+        lookup = time_command(
+            [sys.executable, SCRIPT, '--password-stdin', 'get', site, username],
+            directory, stdin=DEFAULT_MASTER_PASSWORD + '\n', runs=args.runs
+        )
+
+    results = {
+        'entries': args.entries,
+        'runs': args.runs,
+        'target_ms': args.target_ms,
+        'interpreter_median_ms': statistics.median(interpreter),
+        'get_median_ms': statistics.median(lookup),
+        'get_min_ms': min(lookup),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if results['get_median_ms'] > args.target_ms:
+        print(f"FAIL: median {results['get_median_ms']:.0f} ms exceeds {args.target_ms:.0f} ms")
+        sys.exit(1)
+    print(f"OK: median {results['get_median_ms']:.0f} ms within {args.target_ms:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
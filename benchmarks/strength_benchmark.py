@@ -0,0 +1,86 @@
+"""Measures strength-audit throughput, cold and with cached scores.
+
+Builds a synthetic vault, gives a share of its accounts human-style
+passwords (words with digits, keyboard walks, dates), then runs `audit
+strength` three times: with an empty cache, with every score cached, and
+after changing a few passwords, where only those are scored again.
+
+Usage:
+    python benchmarks/strength_benchmark.py [--entries 10000] [--weak-share 0.3]
+        [--changes 100] [--output results.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_manager import PasswordManager
+from src.audit.strength import StrengthEstimator, audit_strength
+from vault_generator import DEFAULT_MASTER_PASSWORD, account_key, generate_vault, working_directory
+
+PATTERNS = ('qwerty', 'asdfgh', '1qaz2wsx', 'zxcvbnm', '123456', 'abc123')
+
+
+def human_password(rng, words):
+    kind = rng.randrange(4)
+    if kind == 0:
+        return rng.choice(words).capitalize() + str(rng.randint(0, 9999))
+    if kind == 1:
+        return rng.choice(PATTERNS) + rng.choice(('', '!', '!!', '2024'))
+    if kind == 2:
+        return f"{rng.choice(words)}{rng.randint(1, 28):02d}{rng.randint(1, 12):02d}{rng.randint(1950, 2020)}"
+    return ''.join(rng.choice(words) for _ in range(rng.randint(2, 4)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--weak-share', type=float, default=0.3)
+    parser.add_argument('--changes', type=int, default=100)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    estimator = StrengthEstimator()
+    words = sorted(estimator.ranks)
+    results = {'entries': args.entries, 'weak_share': args.weak_share}
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_vault(directory, args.entries)
+        with working_directory(directory):
+            pm = PasswordManager(DEFAULT_MASTER_PASSWORD)
+        try:
+            db = pm.db_manager
+            for index in rng.sample(range(args.entries), int(args.entries * args.weak_share)):
+                db.update_password(*account_key(index), human_password(rng, words))
+
+            for label in ('cold', 'cached'):
+                start = time.perf_counter()
+                audit = audit_strength(db, estimator=estimator)
+                results[f'{label}_seconds'] = time.perf_counter() - start
+                results[f'{label}_checks_per_sec'] = audit['checks_per_sec']
+                results[f'{label}_scored'] = audit['scored']
+            results['weak'] = audit['weak']
+            results['scores'] = audit['scores']
+
+            for index in rng.sample(range(args.entries), args.changes):
+                db.update_password(*account_key(index), human_password(rng, words))
+            start = time.perf_counter()
+            audit = audit_strength(db, estimator=estimator)
+            results['incremental_seconds'] = time.perf_counter() - start
+            results['incremental_scored'] = audit['scored']
+        finally:
+            pm.close()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
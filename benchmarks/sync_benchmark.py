@@ -0,0 +1,123 @@
+"""Shows that delta sync costs grow with the changes, not the vault size.
+
+For each vault size and change count, copies one synthetic vault to two
+replicas, makes the changes on the first (updates, new accounts and
+deletions), then times exporting the delta and applying it to the second.
+A full export of the vault is timed alongside for comparison. Every
+delta file pays the same fixed scrypt cost for its key; the rest is
+per record.
+
+Usage:
+    python benchmarks/sync_benchmark.py [--sizes 1000,10000,50000]
+        [--changes 10,100,1000] [--output results.json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_manager import PasswordManager
+from src.sync import export_delta, apply_delta, sync_status
+from vault_generator import DEFAULT_MASTER_PASSWORD, account_key, generate_vault, working_directory
+
+
+def make_changes(db, entries, changes, rng):
+    """Updates, adds and deletes accounts in a 3:1:1 mix"""
+    for i in range(changes):
+        kind = i % 5
+        if kind == 3:
+            db.add_password(f"new{i}.example", "sync@example.com", f"added-{i}")
+        elif kind == 4:
+            db.delete_password(*account_key(rng.randrange(entries)))
+        else:
+            db.update_password(*account_key(rng.randrange(entries)), f"changed-{i}")
+
+
+def run(directory, entries, changes, seed):
+    source, replica = os.path.join(directory, 'work'), os.path.join(directory, 'replica')
+    shutil.copytree(os.path.join(directory, 'source'), source)
+    shutil.copytree(os.path.join(directory, 'source'), replica)
+    delta = os.path.join(directory, 'changes.delta')
+    result = {'entries': entries, 'changes': changes}
+    try:
+        with working_directory(source):
+            pm = PasswordManager(DEFAULT_MASTER_PASSWORD)
+        try:
+            checkpoint = sync_status(pm.db_manager)['change_seq']
+            make_changes(pm.db_manager, entries, changes, random.Random(seed))
+            start = time.perf_counter()
+            header = export_delta(pm.db_manager, delta, DEFAULT_MASTER_PASSWORD, since=checkpoint)
+            result['export_seconds'] = time.perf_counter() - start
+            result['delta_bytes'] = os.path.getsize(delta)
+            result['records'] = header['entries'] + header['history'] + header['tombstones']
+        finally:
+            pm.close()
+
+        with working_directory(replica):
+            pm = PasswordManager(DEFAULT_MASTER_PASSWORD)
+        try:
+            start = time.perf_counter()
+            counts = apply_delta(pm.db_manager, delta, DEFAULT_MASTER_PASSWORD)
+            result['apply_seconds'] = time.perf_counter() - start
+            result['applied'] = counts['applied'] + counts['deleted']
+        finally:
+            pm.close()
+    finally:
+        shutil.rmtree(source)
+        shutil.rmtree(replica)
+    return result
+
+
+def full_export(directory):
+    with working_directory(os.path.join(directory, 'source')):
+        pm = PasswordManager(DEFAULT_MASTER_PASSWORD)
+    path = os.path.join(directory, 'full.delta')
+    try:
+        start = time.perf_counter()
+        export_delta(pm.db_manager, path, DEFAULT_MASTER_PASSWORD, since=0)
+        return {'seconds': time.perf_counter() - start, 'bytes': os.path.getsize(path)}
+    finally:
+        pm.close()
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    parser.add_argument('--changes', default='10,100,1000')
+    parser.add_argument('--history-depth', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    change_counts = [int(count) for count in args.changes.split(',')]
+
+    results = {'runs': [], 'full_export': {}}
+    print(f"{'entries':>8}{'changes':>9}{'records':>9}{'export ms':>11}{'apply ms':>10}"
+          f"{'delta KB':>10}")
+    for entries in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            generate_vault(os.path.join(directory, 'source'), entries, args.history_depth)
+            results['full_export'][entries] = full_export(directory)
+            for changes in change_counts:
+                r = run(directory, entries, changes, args.seed)
+                results['runs'].append(r)
+                print(f"{entries:>8}{changes:>9}{r['records']:>9}{r['export_seconds'] * 1000:>11.1f}"
+                      f"{r['apply_seconds'] * 1000:>10.1f}{r['delta_bytes'] / 1024:>10.1f}")
+        full = results['full_export'][entries]
+        print(f"{entries:>8}{'full':>9}{'':>9}{full['seconds'] * 1000:>11.1f}{'':>10}"
+              f"{full['bytes'] / 1024:>10.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
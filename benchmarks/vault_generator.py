@@ -0,0 +1,118 @@
+"""Builds synthetic vaults for benchmarking with the real storage stack.
+
+Usage:
+    python benchmarks/vault_generator.py DIRECTORY [--entries 10000] [--history-depth 3]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_manager import PasswordManager
+from src.database.database_manager import new_row_id
+
+DEFAULT_MASTER_PASSWORD = 'benchmark-master-password'
+_ALPHABET = string.ascii_letters + string.digits + string.punctuation
+_DESCRIPTIONS = ['', '', '', 'personal', 'work account', 'shared with team', 'recovery codes in safe']
+
+
+@contextmanager
+def working_directory(path):
+    """Temporarily switches into path, where the vault files live"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def account_key(index):
+    """Returns the (site, username) of the index-th synthetic account"""
+    return f"site{index:07d}.example", f"user{index}@example.com"
+
+
+def random_password(rng, length=16):
+    return ''.join(rng.choice(_ALPHABET) for _ in range(length))
+
+
+def synthetic_entries(count, rng, start=0):
+    """Yields (site, username, password, description) tuples"""
+    for index in range(start, start + count):
+        site, username = account_key(index)
+        yield site, username, random_password(rng), rng.choice(_DESCRIPTIONS)
+
+
+def add_history(db_manager, entries, depth, rng, batch_size=5000):
+    """Writes depth old passwords per account straight into password_history"""
+    now = datetime.now()
+    for start in range(0, entries, batch_size):
+        accounts = [account_key(i) for i in range(start, min(start + batch_size, entries))]
+        plaintexts = [random_password(rng).encode() for _ in range(len(accounts) * depth)]
+        owners = [account for account in accounts for _ in range(depth)]
+        tokens = iter(db_manager.batch_cipher.encrypt_many(plaintexts, owners))
+        rows = [
+            (site, username, next(tokens),
+             (now - timedelta(days=30 * (age + 1))).strftime("%Y-%m-%d %H:%M:%S"),
+             new_row_id())
+            for site, username in accounts
+            for age in range(depth)
+        ]
+        with db_manager._transaction() as c:
+            c.executemany("""INSERT INTO password_history
+                            (site, username, old_password, changed_date, uuid)
+                            VALUES (?, ?, ?, ?, ?)""", rows)
+
+
+def generate_vault(directory, entries, history_depth=0,
+                   master_password=DEFAULT_MASTER_PASSWORD, seed=0, batch_size=5000):
+    """Creates a vault with synthetic accounts in directory
+
+    Returns a dict with the time spent on the bulk insert and on history.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    with working_directory(directory):
+        pm = PasswordManager(master_password)
+        try:
+            start = time.perf_counter()
+            pm.db_manager.add_passwords_bulk(synthetic_entries(entries, rng), batch_size=batch_size)
+            bulk_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if history_depth:
+                add_history(pm.db_manager, entries, history_depth, rng, batch_size)
+            history_seconds = time.perf_counter() - start
+        finally:
+            pm.close()
+    return {
+        'entries': entries,
+        'history_depth': history_depth,
+        'bulk_add_seconds': bulk_seconds,
+        'history_seconds': history_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--history-depth', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--master-password', default=DEFAULT_MASTER_PASSWORD)
+    args = parser.parse_args()
+
+    stats = generate_vault(args.directory, args.entries, args.history_depth,
+                           args.master_password, args.seed)
+    print(f"Generated {stats['entries']} entries with history depth {stats['history_depth']} "
+          f"in {stats['bulk_add_seconds'] + stats['history_seconds']:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Compares one large vault with the same accounts split across named vaults.
+
+For each vault count, spreads --entries synthetic accounts evenly over
+that many named vaults and times unlocking one vault and all of them,
+a full backup of one vault, and cross-vault list and search.
+
+Usage:
+    python benchmarks/vaults_benchmark.py [--entries 50000] [--vaults 1,4,16]
+        [--output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_manager import PasswordManager, unlock_vaults
+from src.config import VAULT_DIR
+from vault_generator import DEFAULT_MASTER_PASSWORD, account_key, generate_vault, working_directory
+
+
+def run(directory, entries, count):
+    names = [f"team{index:02d}" for index in range(count)]
+    for index, name in enumerate(names):
+        generate_vault(os.path.join(directory, VAULT_DIR, name), entries // count, seed=index)
+    result = {'vaults': count, 'entries_per_vault': entries // count}
+    # Every vault holds accounts 0..entries_per_vault-1, so this site is in each of them
+    query, _ = account_key(entries // count // 2)
+    with working_directory(directory):
+        start = time.perf_counter()
+        pm = PasswordManager(DEFAULT_MASTER_PASSWORD, vault=names[0])
+        result['open_one_seconds'] = time.perf_counter() - start
+        try:
+            result['vault_bytes'] = os.path.getsize(pm.db_file)
+            start = time.perf_counter()
+            pm.backup(os.path.join(directory, 'one.pmbackup'), DEFAULT_MASTER_PASSWORD)
+            result['backup_one_seconds'] = time.perf_counter() - start
+        finally:
+            pm.close()
+
+        start = time.perf_counter()
+        with unlock_vaults({name: DEFAULT_MASTER_PASSWORD for name in names}) as vaults:
+            result['open_all_seconds'] = time.perf_counter() - start
+            start = time.perf_counter()
+            first = next(vaults.iter_entries())
+            result['list_first_ms'] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            listed = sum(1 for _ in vaults.iter_entries())
+            result['list_all_seconds'] = time.perf_counter() - start
+            start = time.perf_counter()
+            found = len(list(vaults.search(query, limit=50)))
+            result['search_ms'] = (time.perf_counter() - start) * 1000
+        assert first and listed == entries // count * count and found == count
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--vaults', default='1,4,16')
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'vaults':>7}{'open one ms':>13}{'backup one ms':>15}{'open all ms':>13}"
+          f"{'first ms':>10}{'list all ms':>13}{'search ms':>11}")
+    for count in (int(count) for count in args.vaults.split(',')):
+        with tempfile.TemporaryDirectory() as directory:
+            r = run(directory, args.entries, count)
+        results.append(r)
+        print(f"{count:>7}{r['open_one_seconds'] * 1000:>13.1f}{r['backup_one_seconds'] * 1000:>15.1f}"
+              f"{r['open_all_seconds'] * 1000:>13.1f}{r['list_first_ms']:>10.1f}"
+              f"{r['list_all_seconds'] * 1000:>13.1f}{r['search_ms']:>11.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
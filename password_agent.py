@@ -0,0 +1,98 @@
+"""Unlock-once agent for scripted password lookups.
+
+    python password_agent.py start [--idle-timeout SECONDS] [--in-memory [--flush-interval S]]
+    python password_agent.py get SITE USERNAME
+    python password_agent.py add SITE USERNAME [--description TEXT]
+    python password_agent.py update SITE USERNAME
+    python password_agent.py search QUERY [--mode substring|prefix|fuzzy]
+    python password_agent.py status | stop
+
+`start` prompts for the master password once and serves requests in the
+foreground until stopped or idle for too long. The other commands only
+talk to the socket, so they skip the KDF and crypto setup entirely.
+New passwords are read from stdin when it is not a terminal.
+"""
+import argparse
+import json
+import sys
+from src.agent_client import AgentClient
+from src.exceptions import PasswordManagerError
+from src.config import AGENT_IDLE_TIMEOUT, AGENT_CACHE_SIZE, MEMORY_FLUSH_INTERVAL
+from password_cli import read_secret
+
+def start(args):
+    # Only the server needs the vault and crypto stack
+    from password_manager import PasswordManager
+    from src.agent import PasswordAgent
+
+    pm = PasswordManager(cache_size=AGENT_CACHE_SIZE, in_memory=args.in_memory,
+                         flush_interval=args.flush_interval)
+    agent = PasswordAgent(pm, args.socket, args.idle_timeout)
+    print(f"Agent listening on {agent.socket_path} (locks after {args.idle_timeout}s idle)")
+    try:
+        agent.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.lock()
+    print("Agent locked.")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Password manager agent")
+    parser.add_argument('--socket', help="agent socket path")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    start_parser = commands.add_parser('start', help="unlock the vault and serve requests")
+    start_parser.add_argument('--idle-timeout', type=float, default=AGENT_IDLE_TIMEOUT)
+    start_parser.add_argument('--in-memory', action='store_true',
+                              help="serve from an in-memory copy, writing changes through to disk")
+    start_parser.add_argument('--flush-interval', type=float, default=MEMORY_FLUSH_INTERVAL,
+                              help="with --in-memory, batch disk writes this often in seconds")
+
+    for name in ('get', 'add', 'update'):
+        command = commands.add_parser(name)
+        command.add_argument('site')
+        command.add_argument('username')
+        if name == 'add':
+            command.add_argument('--description', default='')
+
+    search_parser = commands.add_parser('search')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--mode', default='substring',
+                               choices=('substring', 'prefix', 'fuzzy'))
+
+    commands.add_parser('status', help="check that the agent is running")
+    commands.add_parser('stop', help="lock the vault and stop the agent")
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    if args.command == 'start':
+        start(args)
+        return
+
+    try:
+        with AgentClient(args.socket) as client:
+            if args.command == 'get':
+                print(client.request('get', site=args.site, username=args.username))
+            elif args.command == 'add':
+                client.request('add', site=args.site, username=args.username,
+                               password=read_secret("Enter password: "),
+                               description=args.description)
+            elif args.command == 'update':
+                client.request('update', site=args.site, username=args.username,
+                               password=read_secret("Enter new password: "))
+            elif args.command == 'search':
+                print(json.dumps(client.request('search', query=args.query, mode=args.mode)))
+            elif args.command == 'status':
+                client.request('ping')
+                print("Agent is running")
+            elif args.command == 'stop':
+                client.request('lock')
+                print("Agent locked")
+    except PasswordManagerError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
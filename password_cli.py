@@ -0,0 +1,475 @@
+"""Scriptable subcommands for password_manager.py.
+
+Results are written to stdout as JSON (``get`` prints the bare password
+unless --json is given); errors go to stderr with exit status 1. The
+master password is prompted for unless --password-stdin, --password-fd or
+the PM_PASSWORD_FD environment variable supplies it. With --agent, get,
+list and search are answered by a running password_agent.py instead.
+With --vault NAME the command runs on a named vault (see src.vaults);
+naming several vaults, or --all-vaults, runs list, search and audit
+strength/reuse across all of them, reading one master password per vault
+in order.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from getpass import getpass
+from src.exceptions import PasswordManagerError, ValidationError, FileOperationError
+from src.config import (
+    SEARCH_LIMIT, KDF_ALGORITHM, KDF_TARGET_MS, MASTER_KEY_FILE, ROTATION_BATCH_SIZE,
+    FORMAT_BATCH_SIZE, SLOW_OPERATION_MS, SLOW_OPERATION_LOG, BLOOM_BITS_PER_ENTRY,
+    MEMORY_FLUSH_INTERVAL, VAULT_DIR, KDF_SETTINGS_FILE
+)
+from src.encryption import STORAGE_FORMATS
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='password_manager.py',
+        description="Password manager. Run without a command for the interactive menu."
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--password-stdin', action='store_true',
+                        help="read the master password from the first line of stdin")
+    source.add_argument('--password-fd', type=int, metavar='FD',
+                        help="read the master password from file descriptor FD")
+    parser.add_argument('--agent', action='store_true',
+                        help="answer get/list/search through a running agent")
+    parser.add_argument('--profile', action='store_true',
+                        help="print a timing breakdown to stderr on exit")
+    parser.add_argument('--slow-ms', type=float, metavar='MS',
+                        help="log operations slower than MS to the slow-operation log")
+    parser.add_argument('--slow-log', default=SLOW_OPERATION_LOG, metavar='PATH',
+                        help=f"slow-operation log file (default: {SLOW_OPERATION_LOG})")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="load the vault into memory and write changes through to disk")
+    parser.add_argument('--flush-interval', type=float, default=MEMORY_FLUSH_INTERVAL,
+                        metavar='SECONDS',
+                        help="with --in-memory, batch disk writes this often (0: on every commit)")
+    parser.add_argument('--vault', action='append', dest='vaults', metavar='NAME',
+                        help="use the named vault; repeat to query several at once")
+    parser.add_argument('--all-vaults', action='store_true',
+                        help="query every named vault at once")
+    parser.add_argument('--vault-dir', default=VAULT_DIR, metavar='DIR',
+                        help="directory holding the named vaults")
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('vaults', help="list the named vaults and their sizes")
+
+    get_parser = commands.add_parser('get', help="print one password")
+    get_parser.add_argument('site')
+    get_parser.add_argument('username')
+    get_parser.add_argument('--json', action='store_true', help="print a JSON object")
+
+    add_parser = commands.add_parser('add', help="store a new account")
+    add_parser.add_argument('site')
+    add_parser.add_argument('username')
+    add_parser.add_argument('--description', default='')
+
+    list_parser = commands.add_parser('list', help="list accounts as JSON")
+    list_parser.add_argument('--limit', type=int)
+    list_parser.add_argument('--show-passwords', action='store_true')
+
+    search_parser = commands.add_parser('search', help="search site, username and description")
+    search_parser.add_argument('query')
+    search_parser.add_argument('--mode', default='substring',
+                               choices=('substring', 'prefix', 'fuzzy'))
+    search_parser.add_argument('--limit', type=int, default=SEARCH_LIMIT)
+    search_parser.add_argument('--show-passwords', action='store_true')
+
+    history_parser = commands.add_parser('history', help="show password history")
+    history_parser.add_argument('site')
+    history_parser.add_argument('username')
+    history_parser.add_argument('--limit', type=int, help="show only the newest entries")
+
+    retention_parser = commands.add_parser(
+        'retention', help="show or set the history retention policy")
+    retention_parser.add_argument('site', nargs='?', help="set an account policy instead of the vault's")
+    retention_parser.add_argument('username', nargs='?')
+    retention_parser.add_argument('--keep-last', type=int, metavar='N')
+    retention_parser.add_argument('--max-age-days', type=int, metavar='DAYS')
+    retention_parser.add_argument('--clear', action='store_true', help="remove the policy")
+
+    compact_parser = commands.add_parser('compact', help="prune history and shrink the database")
+    compact_parser.add_argument('--full', action='store_true', help="always run a full VACUUM")
+
+    import_parser = commands.add_parser('import', help="import a CSV or JSON export")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', default='auto')
+    import_parser.add_argument('--merge', action='store_true',
+                               help="update existing accounts instead of skipping them")
+
+    export_parser = commands.add_parser('export', help="write all accounts to a file")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--format', default='csv', choices=('csv', 'json'))
+
+    backup_parser = commands.add_parser('backup', help="write an encrypted backup archive")
+    backup_parser.add_argument('path')
+    backup_parser.add_argument('--incremental', action='store_true',
+                               help="only include changes since the previous backup")
+
+    restore_parser = commands.add_parser('restore', help="restore a backup archive")
+    restore_parser.add_argument('path')
+    restore_parser.add_argument('--target', help="directory to restore the vault into "
+                                "(default: the --vault directory, else the current one)")
+    restore_parser.add_argument('--force', action='store_true',
+                                help="replace an existing vault in the target directory")
+
+    rotate_parser = commands.add_parser('rotate-key', help="re-encrypt the vault under a new key")
+    rotate_parser.add_argument('--batch-size', type=int, default=ROTATION_BATCH_SIZE)
+
+    format_parser = commands.add_parser(
+        'migrate-format', help="convert stored passwords to another storage format")
+    format_parser.add_argument('--format', default='aead', choices=STORAGE_FORMATS,
+                               help="aead: compact AES-GCM records (default); fernet: Fernet tokens")
+    format_parser.add_argument('--batch-size', type=int, default=FORMAT_BATCH_SIZE)
+    format_parser.add_argument('--status', action='store_true',
+                               help="only show how many values use each format")
+
+    sync_parser = commands.add_parser('sync', help="exchange changes with another replica")
+    sync_commands = sync_parser.add_subparsers(dest='sync_command', required=True)
+    export_delta_parser = sync_commands.add_parser(
+        'export-delta', help="write the changes since a checkpoint to an encrypted file")
+    export_delta_parser.add_argument('path')
+    checkpoint = export_delta_parser.add_mutually_exclusive_group()
+    checkpoint.add_argument('--since', type=int, metavar='SEQ',
+                            help="change_seq of the previous delta (default: everything)")
+    checkpoint.add_argument('--peer', metavar='NAME',
+                            help="continue from the last delta exported to NAME")
+    apply_delta_parser = sync_commands.add_parser(
+        'apply-delta', help="merge a delta exported by another replica")
+    apply_delta_parser.add_argument('path')
+    apply_delta_parser.add_argument('--peer', metavar='NAME',
+                                    help="check the delta follows the last one from NAME")
+    sync_commands.add_parser('status', help="show this replica's id and peer checkpoints")
+    sync_commands.add_parser('new-replica',
+                             help="give a copied vault its own replica id and forget its peers")
+
+    audit_parser = commands.add_parser('audit', help="check stored passwords offline")
+    audit_commands = audit_parser.add_subparsers(dest='audit_command', required=True)
+    breaches_parser = audit_commands.add_parser(
+        'breaches', help="look up every password in a converted breach corpus")
+    breaches_parser.add_argument('corpus')
+    breaches_parser.add_argument('--bloom', metavar='PATH', help="Bloom filter built with the corpus")
+    breaches_parser.add_argument('--no-history', action='store_true',
+                                 help="check current passwords only")
+    audit_commands.add_parser('reuse', help="list accounts that share a password")
+    strength_parser = audit_commands.add_parser(
+        'strength', help="estimate how hard every password is to guess")
+    strength_parser.add_argument('--max-score', type=int, choices=range(5), default=2,
+                                 help="report entries scoring this or lower (0-4)")
+    strength_parser.add_argument('--rescore', action='store_true',
+                                 help="ignore cached scores and score every password again")
+    convert_parser = audit_commands.add_parser(
+        'convert-corpus', help="convert a SHA1:COUNT text dump for 'audit breaches'")
+    convert_parser.add_argument('source')
+    convert_parser.add_argument('output')
+    convert_parser.add_argument('--bloom', metavar='PATH', help="also build a Bloom filter")
+    convert_parser.add_argument('--bloom-bits', type=int, default=BLOOM_BITS_PER_ENTRY,
+                                help="filter bits per corpus entry")
+
+    calibrate_parser = commands.add_parser('calibrate', help="tune the master password KDF")
+    calibrate_parser.add_argument('--algorithm', default=KDF_ALGORITHM,
+                                  choices=('pbkdf2-sha256', 'scrypt'))
+    calibrate_parser.add_argument('--target-ms', type=int, default=KDF_TARGET_MS)
+    return parser
+
+def emit(data):
+    json.dump(data, sys.stdout)
+    sys.stdout.write('\n')
+
+def emit_stream(items):
+    """Writes a JSON array one element at a time"""
+    sys.stdout.write('[')
+    for index, item in enumerate(items):
+        sys.stdout.write(',\n' if index else '\n')
+        json.dump(item, sys.stdout)
+    sys.stdout.write('\n]\n')
+
+def start_profiling(args):
+    """Turns on instrumentation when --profile or --slow-ms is given"""
+    if not args.profile and args.slow_ms is None:
+        return
+    import atexit
+    from src import instrumentation
+    from password_operations import PasswordOperations
+    profiler = instrumentation.enable(args.slow_ms if args.slow_ms is not None else SLOW_OPERATION_MS,
+                                      args.slow_log)
+    # Terminal output is its own phase; database and decryption work done
+    # while streaming results is charged to those phases instead
+    instrumentation.instrument(sys.modules[__name__], ('emit', 'emit_stream'), 'output', 'cli')
+    instrumentation.instrument(PasswordOperations, ('_print_entries', '_show_entry'), 'output', 'menu')
+    if args.profile:
+        atexit.register(profiler.report, sys.stderr)
+
+def read_master_passwords(args, count=1):
+    """Returns count master passwords, one per line, from the requested source
+
+    Returns None when no source was given, so the caller prompts instead.
+    """
+    fd = args.password_fd
+    if fd is None and os.environ.get('PM_PASSWORD_FD'):
+        fd = int(os.environ['PM_PASSWORD_FD'])
+    if fd is not None:
+        with os.fdopen(fd, 'r', closefd=False) as f:
+            return [f.readline().rstrip('\n') for _ in range(count)]
+    if args.password_stdin:
+        return [sys.stdin.readline().rstrip('\n') for _ in range(count)]
+    return None
+
+def read_master_password(args):
+    """Returns the master password from the requested source, or None to prompt"""
+    passwords = read_master_passwords(args)
+    return None if passwords is None else passwords[0]
+
+def selected_vaults(args):
+    """Returns the vault names the command runs on; [] means the working directory's vault"""
+    if args.all_vaults:
+        from src.vaults import list_vaults
+        names = list_vaults(args.vault_dir)
+        if not names:
+            raise ValidationError(f"There are no vaults in {args.vault_dir}")
+        return names
+    return list(dict.fromkeys(args.vaults or []))
+
+def read_secret(prompt):
+    """Reads an account password from the terminal or the next stdin line"""
+    if sys.stdin.isatty():
+        return getpass(prompt)
+    return sys.stdin.readline().rstrip('\n')
+
+def entry_json(entry, show_password=False):
+    data = {'site': entry.site, 'username': entry.username, 'description': entry.description}
+    if show_password:
+        data['password'] = entry.password
+    return data
+
+def run_agent_command(args):
+    """Serves get, list and search from the agent without unlocking locally"""
+    from src.agent_client import AgentClient
+    with AgentClient() as client:
+        if args.command == 'get':
+            password = client.request('get', site=args.site, username=args.username)
+            if args.json:
+                emit({'site': args.site, 'username': args.username, 'password': password})
+            else:
+                print(password)
+        elif args.command == 'list':
+            emit(client.request('list', limit=args.limit or 100))
+        elif args.command == 'search':
+            emit(client.request('search', query=args.query, mode=args.mode))
+        else:
+            raise ValidationError(f"The agent does not support '{args.command}'")
+
+def run_vault_command(args, pm):
+    """Runs a subcommand against an unlocked vault"""
+    from src.utils import validate_input
+    db = pm.db_manager
+
+    if args.command == 'get':
+        password = db.get_password(args.site, args.username)
+        if password is None:
+            raise ValidationError("Site and username not found")
+        if args.json:
+            emit({'site': args.site, 'username': args.username, 'password': password})
+        else:
+            print(password)
+
+    elif args.command == 'add':
+        password = read_secret("Enter password: ")
+        validate_input(args.site, args.username, password, args.description)
+        reused_by = db.find_reuse(password)
+        db.add_password(args.site, args.username, password, args.description)
+        emit({'added': True,
+              'reused_by': [{'site': site, 'username': username} for site, username in reused_by]})
+
+    elif args.command == 'list':
+        entries = db.iter_passwords(decrypt=args.show_passwords)
+        if args.limit is not None:
+            entries = (entry for _, entry in zip(range(args.limit), entries))
+        emit_stream(entry_json(entry, args.show_passwords) for entry in entries)
+
+    elif args.command == 'search':
+        entries = db.search_passwords(args.query, args.mode, args.limit)
+        emit([entry_json(entry, args.show_passwords) for entry in entries])
+
+    elif args.command == 'history':
+        emit([{'password': password, 'changed_date': date}
+              for password, date in db.get_password_history(args.site, args.username, args.limit)])
+
+    elif args.command == 'retention':
+        if (args.site is None) != (args.username is None):
+            raise ValidationError("Give both site and username for an account policy")
+        if args.clear or args.keep_last is not None or args.max_age_days is not None:
+            db.set_history_policy(args.keep_last, args.max_age_days, args.site, args.username)
+        emit(db.get_history_policy(args.site, args.username))
+
+    elif args.command == 'compact':
+        emit(db.compact(full=args.full))
+
+    elif args.command == 'import':
+        emit(pm.import_file(args.path, args.format, 'merge' if args.merge else 'skip'))
+
+    elif args.command == 'backup':
+        manifest = pm.backup(args.path, args.master_password, args.incremental)
+        emit({'backup': manifest['id'], 'type': manifest['type']})
+
+    elif args.command == 'rotate-key':
+        if args.batch_size < 1:
+            raise ValidationError("--batch-size must be at least 1")
+        emit(pm.rotate_key(args.batch_size))
+
+    elif args.command == 'migrate-format':
+        if args.batch_size < 1:
+            raise ValidationError("--batch-size must be at least 1")
+        if args.status:
+            emit(db.storage_stats())
+        else:
+            start = time.perf_counter()
+            rows = db.migrate_format(args.format, args.batch_size)
+            elapsed = time.perf_counter() - start
+            emit({'converted': rows, 'seconds': round(elapsed, 3), **db.storage_stats()})
+
+    elif args.command == 'sync' and args.sync_command == 'export-delta':
+        if args.since is not None and args.since < 0:
+            raise ValidationError("--since cannot be negative")
+        emit(pm.export_delta(args.path, args.master_password, args.since, args.peer))
+
+    elif args.command == 'sync' and args.sync_command == 'apply-delta':
+        emit(pm.apply_delta(args.path, args.master_password, args.peer))
+
+    elif args.command == 'sync' and args.sync_command == 'status':
+        from src.sync import sync_status
+        emit(sync_status(db))
+
+    elif args.command == 'sync' and args.sync_command == 'new-replica':
+        from src.sync import new_replica
+        emit(new_replica(db))
+
+    elif args.command == 'audit' and args.audit_command == 'reuse':
+        emit([[{'site': site, 'username': username} for site, username in group]
+              for group in db.find_reused_passwords()])
+
+    elif args.command == 'audit' and args.audit_command == 'strength':
+        from src.audit.strength import audit_strength
+        emit(audit_strength(db, args.max_score, rescore=args.rescore))
+
+    elif args.command == 'audit' and args.audit_command == 'breaches':
+        from src.audit.breaches import BreachCorpus, audit_breaches
+        with BreachCorpus(args.corpus, args.bloom) as corpus:
+            emit(audit_breaches(db, corpus, not args.no_history))
+
+    elif args.command == 'export':
+        from src.exporters import write_export
+        emit({'exported': write_export(db.iter_passwords(decrypt=True), args.path, args.format)})
+
+# Commands that can run across several vaults at once
+MULTI_VAULT_COMMANDS = ('list', 'search', 'audit strength', 'audit reuse')
+
+def run_multi_vault_command(args, names):
+    """Runs list, search or audit on several vaults, merging their results"""
+    command = args.command if args.command != 'audit' else f"audit {args.audit_command}"
+    if command not in MULTI_VAULT_COMMANDS:
+        raise ValidationError(f"'{command}' runs on one vault at a time; "
+                              f"across vaults use {', '.join(MULTI_VAULT_COMMANDS)}")
+    passwords = read_master_passwords(args, len(names))
+    if passwords is None:
+        passwords = [getpass(f"Master password for {name}: ") for name in names]
+
+    from password_manager import unlock_vaults
+    with unlock_vaults(dict(zip(names, passwords)), args.vault_dir, in_memory=args.in_memory,
+                       flush_interval=args.flush_interval) as vaults:
+        if command == 'list':
+            entries = vaults.iter_entries(decrypt=args.show_passwords)
+            if args.limit is not None:
+                entries = (item for _, item in zip(range(args.limit), entries))
+            emit_stream({'vault': name, **entry_json(entry, args.show_passwords)}
+                        for name, entry in entries)
+        elif command == 'search':
+            emit_stream({'vault': name, **entry_json(entry, args.show_passwords)}
+                        for name, entry in vaults.search(args.query, args.mode, args.limit))
+        elif command == 'audit strength':
+            from src.audit.strength import StrengthEstimator, audit_strength
+            estimator = StrengthEstimator()
+            emit_stream({'vault': name, **result} for name, result in vaults.run(
+                lambda db: audit_strength(db, args.max_score, estimator, args.rescore)))
+        else:
+            emit_stream({'vault': name,
+                         'groups': [[{'site': site, 'username': username} for site, username in group]
+                                    for group in groups]}
+                        for name, groups in vaults.run(lambda db: db.find_reused_passwords()))
+
+def run_command(args):
+    """Runs one subcommand and returns the process exit status"""
+    try:
+        if args.command == 'calibrate':
+            from src import kdf
+            params = kdf.calibrate(args.algorithm, args.target_ms)
+            # Each vault keeps its own settings next to its database
+            directories = ['.']
+            if args.vaults or args.all_vaults:
+                from src.vaults import vault_path
+                directories = [vault_path(name, args.vault_dir) for name in selected_vaults(args)]
+            for directory in directories:
+                try:
+                    os.makedirs(directory, mode=0o700, exist_ok=True)
+                except OSError as e:
+                    raise FileOperationError(f"Failed to create vault directory {directory}: {e}")
+                kdf.save_settings(args.algorithm, params, os.path.join(directory, KDF_SETTINGS_FILE))
+            emit({'algorithm': args.algorithm, 'params': params})
+            return 0
+
+        if args.command == 'audit' and args.audit_command == 'convert-corpus':
+            from src.audit.breaches import convert_corpus
+            emit({'digests': convert_corpus(args.source, args.output, args.bloom, args.bloom_bits)})
+            return 0
+
+        if args.command == 'vaults':
+            from src.vaults import vault_stats
+            emit(vault_stats(args.vault_dir))
+            return 0
+
+        if args.agent:
+            run_agent_command(args)
+            return 0
+
+        names = selected_vaults(args)
+        if len(names) > 1 or args.all_vaults:
+            run_multi_vault_command(args, names)
+            return 0
+        vault = names[0] if names else None
+        directory = '.'
+        if vault is not None:
+            from src.vaults import vault_path
+            directory = vault_path(vault, args.vault_dir)
+
+        master_password = read_master_password(args)
+        if args.command in ('backup', 'restore') or (
+                args.command == 'sync' and args.sync_command not in ('status', 'new-replica')):
+            # Archives and deltas are encrypted with the master password, so it is needed as text
+            if master_password is None:
+                master_password = getpass("Enter master password: ")
+            if args.command == 'restore':
+                from src.backup import restore_backup
+                manifest = restore_backup(args.path, master_password, args.target or directory,
+                                          args.force)
+                emit({'restored': manifest['id'], 'type': manifest['type']})
+                return 0
+            if not os.path.exists(os.path.join(directory, MASTER_KEY_FILE)):
+                raise ValidationError("There is no vault to back up" if args.command == 'backup'
+                                      else "There is no vault to sync")
+            args.master_password = master_password
+
+        from password_manager import PasswordManager
+        pm = PasswordManager(master_password, in_memory=args.in_memory,
+                             flush_interval=args.flush_interval,
+                             vault=vault, vault_dir=args.vault_dir)
+        try:
+            run_vault_command(args, pm)
+        finally:
+            pm.close()
+        return 0
+    except PasswordManagerError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
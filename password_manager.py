@@ -1,8 +1,7 @@
-from cryptography.fernet import Fernet
 from getpass import getpass
 import sys
 import os
-import platform
+import time
 from src.exceptions import (
     PasswordManagerError, AuthenticationError, 
     ValidationError, FileOperationError, DatabaseError
@@ -10,28 +9,53 @@ from src.exceptions import (
 from src.config import (
     MASTER_KEY_FILE, ENCRYPTION_KEY_FILE, 
     MAX_LOGIN_ATTEMPTS, HASH_ITERATIONS,
-    MIN_PASSWORD_LENGTH
+    MIN_PASSWORD_LENGTH, KDF_ALGORITHM, KDF_TARGET_MS, KDF_SETTINGS_FILE,
+    ENTRY_CACHE_SIZE, ROTATION_BATCH_SIZE, MEMORY_FLUSH_INTERVAL, DATABASE_FILE, VAULT_DIR
 )
 from src.utils import validate_input, make_file_hidden, get_hidden_path
-from src.database.database_manager import DatabaseManager
-from password_operations import PasswordOperations
 from src.encryption import PasswordHasher, Encryption
+from src import kdf
 
 class PasswordManager:
-    def __init__(self):
+    def __init__(self, master_password=None, cache_size=ENTRY_CACHE_SIZE,
+                 in_memory=False, flush_interval=MEMORY_FLUSH_INTERVAL,
+                 vault=None, vault_dir=VAULT_DIR):
+        # A master password passed in skips the prompts, for scripted use
+        self._master_password = master_password
+        # A named vault keeps its files in its own directory (see src.vaults)
+        self.vault = vault
+        self._vault_dir = vault_dir
+        self._cache_size = cache_size
+        self._in_memory = in_memory
+        self._flush_interval = flush_interval
         try:
             self._initialize_manager()
         except PasswordManagerError as e:
+            if master_password is not None:
+                raise
             print(f"Initialization failed: {e}")
             sys.exit(1)
+        finally:
+            self._master_password = None
 
     def _initialize_manager(self):
         """Initializes the password manager"""
-        self.master_password_file = get_hidden_path(MASTER_KEY_FILE)
-        self.key_file = get_hidden_path(ENCRYPTION_KEY_FILE)
-        self.password_hasher = PasswordHasher()
+        directory = ''
+        if self.vault is not None:
+            from src.vaults import vault_path
+            directory = vault_path(self.vault, self._vault_dir)
+        self.master_password_file = get_hidden_path(os.path.join(directory, MASTER_KEY_FILE))
+        self.key_file = get_hidden_path(os.path.join(directory, ENCRYPTION_KEY_FILE))
+        self.db_file = get_hidden_path(os.path.join(directory, DATABASE_FILE))
+        self.kdf_settings_file = get_hidden_path(os.path.join(directory, KDF_SETTINGS_FILE))
+        self.password_hasher = PasswordHasher(settings_path=self.kdf_settings_file)
         
         if not self._check_master_password_exists():
+            if directory:
+                try:
+                    os.makedirs(directory, mode=0o700, exist_ok=True)
+                except OSError as e:
+                    raise FileOperationError(f"Failed to create vault {self.vault}: {e}")
             self._create_master_password()
         
         if not self._verify_master_password():
@@ -39,7 +63,12 @@ class PasswordManager:
             
         self.key = self._load_or_generate_key()
         self.cipher_suite = Encryption.get_cipher_suite(self.key)
-        self.db_manager = DatabaseManager(self.cipher_suite)
+        # Imported here so commands that never open the vault start faster
+        from src.database.database_manager import DatabaseManager
+        self.db_manager = DatabaseManager(self.cipher_suite, self.db_file, key=self.key,
+                                          cache_size=self._cache_size,
+                                          in_memory=self._in_memory,
+                                          flush_interval=self._flush_interval)
 
     def _check_master_password_exists(self):
         """Checks if master password file exists"""
@@ -47,6 +76,12 @@ class PasswordManager:
 
     def _create_master_password(self):
         """Creates a new master password"""
+        if self._master_password is not None:
+            if len(self._master_password) < MIN_PASSWORD_LENGTH:
+                raise ValidationError(f"Master password must be at least {MIN_PASSWORD_LENGTH} characters long")
+            self._store_master_password(self._master_password)
+            return
+
         while True:
             try:
                 master_pass = getpass("Create new master password: ")
@@ -58,19 +93,39 @@ class PasswordManager:
                     continue
                 
                 if master_pass == confirm_pass:
-                    hashed_password = self.password_hasher.hash_password(master_pass)
-                    with open(self.master_password_file, 'wb') as f:
-                        f.write(hashed_password)
-                    make_file_hidden(self.master_password_file)
+                    self._store_master_password(master_pass)
                     print("Master password created successfully!")
                     break
                 else:
                     print("Passwords don't match! Try again.")
+            except FileOperationError:
+                raise
             except Exception as e:
                 raise FileOperationError(f"Failed to create master password: {e}")
 
+    def _store_master_password(self, master_pass):
+        """Writes the salted hash of the master password"""
+        try:
+            hashed_password = self.password_hasher.hash_password(master_pass)
+            with open(self.master_password_file, 'wb') as f:
+                f.write(hashed_password)
+            make_file_hidden(self.master_password_file)
+        except OSError as e:
+            raise FileOperationError(f"Failed to create master password: {e}")
+
     def _verify_master_password(self):
         """Verifies the master password"""
+        if self._master_password is not None:
+            try:
+                with open(self.master_password_file, 'rb') as f:
+                    stored_password = f.read()
+            except OSError as e:
+                raise FileOperationError(f"Failed to verify master password: {e}")
+            if not self.password_hasher.verify_password(stored_password, self._master_password):
+                return False
+            self._rehash_if_needed(stored_password, self._master_password)
+            return True
+
         attempts = 3
         while attempts > 0:
             try:
@@ -80,6 +135,7 @@ class PasswordManager:
                     stored_password = f.read()
 
                 if self.password_hasher.verify_password(stored_password, master_pass):
+                    self._rehash_if_needed(stored_password, master_pass)
                     return True
                 
                 attempts -= 1
@@ -89,11 +145,23 @@ class PasswordManager:
         
         return False
 
+    def _rehash_if_needed(self, stored_password, master_pass):
+        """Re-hashes the master password when the KDF settings have changed"""
+        if self.password_hasher.needs_rehash(stored_password):
+            temp_file = self.master_password_file + '.tmp'
+            try:
+                with open(temp_file, 'wb') as f:
+                    f.write(self.password_hasher.hash_password(master_pass))
+                os.replace(temp_file, self.master_password_file)
+                make_file_hidden(self.master_password_file)
+            except OSError as e:
+                raise FileOperationError(f"Failed to update master password hash: {e}")
+
     def _load_or_generate_key(self):
         """Loads existing encryption key or generates a new one"""
         try:
             with open(self.key_file, 'rb') as key_file:
-                return key_file.read()
+                return key_file.read().strip()
         except FileNotFoundError:
             try:
                 key = Encryption.generate_key()
@@ -104,15 +172,69 @@ class PasswordManager:
             except Exception as e:
                 raise FileOperationError(f"Failed to generate or save encryption key: {e}")
 
+    def _write_key_file(self, keys):
+        """Atomically replaces the key file with one key per line"""
+        temp_file = self.key_file + '.tmp'
+        try:
+            fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b'\n'.join(keys) + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.key_file)
+            make_file_hidden(self.key_file)
+        except OSError as e:
+            raise FileOperationError(f"Failed to write encryption key: {e}")
+
+    def _use_key(self, key):
+        """Switches the vault to the cipher for key"""
+        self.key = key
+        self.cipher_suite = Encryption.get_cipher_suite(key)
+        self.db_manager.set_cipher(self.cipher_suite, key)
+
+    def rotate_key(self, batch_size=ROTATION_BATCH_SIZE, progress=None):
+        """Re-encrypts the vault under a newly generated encryption key
+
+        The new key is saved in front of the old one first, so every row
+        stays readable while batches are converted. If the key file still
+        holds two keys, an earlier rotation was interrupted and this one
+        resumes it. Raises on failure; returns row count and throughput.
+        """
+        keys = self.key.split()
+        resumed = len(keys) > 1
+        if not resumed:
+            keys = [Encryption.generate_key()] + keys
+            self._write_key_file(keys)
+            self._use_key(b'\n'.join(keys))
+
+        start = time.perf_counter()
+        rows = self.db_manager.reencrypt_all(batch_size, progress)
+        elapsed = time.perf_counter() - start
+
+        self._write_key_file(keys[:1])
+        self._use_key(keys[0])
+        return {'rows': rows, 'seconds': round(elapsed, 3),
+                'rows_per_sec': round(rows / elapsed) if elapsed else rows,
+                'resumed': resumed}
+
     def add_password(self, site, username, password, description=''):
         """Adds a new password with validation"""
         try:
             validate_input(site, username, password, description)
+            reused_by = self.db_manager.find_reuse(password)
             self.db_manager.add_password(site, username, password, description)
             print("Password added successfully!")
+            self._warn_reuse(reused_by)
         except (ValidationError, DatabaseError) as e:
             print(f"Error: {e}")
 
+    def _warn_reuse(self, accounts):
+        """Tells the user which other accounts already use the same password"""
+        if accounts:
+            print(f"Warning: this password is also used by {len(accounts)} other account(s):")
+            for site, username in accounts[:10]:
+                print(f"  {site} - {username}")
+
     def get_passwords(self):
         """Retrieves all passwords"""
         try:
@@ -121,6 +243,30 @@ class PasswordManager:
             print(f"Error retrieving passwords: {e}")
             return []
 
+    def get_password(self, site, username):
+        """Retrieves the password for a single account"""
+        try:
+            return self.db_manager.get_password(site, username)
+        except DatabaseError as e:
+            print(f"Error retrieving password: {e}")
+            return None
+
+    def get_passwords_page(self, limit, after=None):
+        """Retrieves one page of entries without decrypting their passwords"""
+        try:
+            return self.db_manager.get_passwords_page(limit, after)
+        except DatabaseError as e:
+            print(f"Error retrieving passwords: {e}")
+            return []
+
+    def search_passwords(self, query, mode='substring'):
+        """Searches accounts by site, username or description"""
+        try:
+            return self.db_manager.search_passwords(query, mode)
+        except (ValidationError, DatabaseError) as e:
+            print(f"Error searching passwords: {e}")
+            return []
+
     def delete_password(self, site, username):
         """Deletes a password"""
         try:
@@ -135,17 +281,20 @@ class PasswordManager:
         """Updates an existing password"""
         try:
             validate_input(site, username, new_password)
+            reused_by = [account for account in self.db_manager.find_reuse(new_password)
+                         if account != (site, username)]
             if self.db_manager.update_password(site, username, new_password):
                 print("Password updated successfully!")
+                self._warn_reuse(reused_by)
             else:
                 print("Site and username not found!")
         except (ValidationError, DatabaseError) as e:
             print(f"Error updating password: {e}")
 
-    def get_password_history(self, site, username):
-        """Retrieves password history"""
+    def get_password_history(self, site, username, limit=None):
+        """Retrieves password history, newest first"""
         try:
-            return self.db_manager.get_password_history(site, username)
+            return self.db_manager.get_password_history(site, username, limit)
         except DatabaseError as e:
             print(f"Error retrieving password history: {e}")
             return []
@@ -172,9 +321,121 @@ class PasswordManager:
         except (ValidationError, DatabaseError) as e:
             print(f"Error updating description: {e}")
 
-def main():
+    def import_file(self, path, fmt='auto', on_duplicate='skip'):
+        """Imports an export file and returns counts plus per-row errors
+
+        Unlike import_passwords this raises on failure and prints nothing.
+        """
+        from src.importers import iter_import_rows
+        errors = []
+
+        def valid_rows():
+            for row in iter_import_rows(path, fmt):
+                if isinstance(row, ValidationError):
+                    errors.append(str(row))
+                    continue
+                try:
+                    validate_input(row.site, row.username, row.password, row.description)
+                except ValidationError as e:
+                    errors.append(f"Record {row.line}: {e}")
+                    continue
+                yield row.site, row.username, row.password, row.description
+
+        counts = self.db_manager.add_passwords_bulk(valid_rows(), on_duplicate)
+        counts['errors'] = errors
+        return counts
+
+    def import_passwords(self, path, fmt='auto', on_duplicate='skip'):
+        """Imports credentials from a browser or password manager export"""
+        try:
+            counts = self.import_file(path, fmt, on_duplicate)
+        except (ValidationError, FileOperationError, DatabaseError) as e:
+            print(f"Error importing passwords: {e}")
+            return None
+
+        errors = counts['errors']
+        print(f"Imported {counts['added']} new, updated {counts['updated']}, "
+              f"skipped {counts['skipped']} duplicates, {len(errors)} errors")
+        for error in errors[:20]:
+            print(f"  {error}")
+        if len(errors) > 20:
+            print(f"  ... and {len(errors) - 20} more")
+        return counts
+
+    def backup(self, path, passphrase, incremental=False):
+        """Writes an encrypted archive of the database and key files
+
+        Raises on failure; see src.backup for the archive format.
+        """
+        from src.backup import create_backup
+        return create_backup(self.db_manager, path, passphrase, incremental,
+                             [self.master_password_file, self.key_file, self.kdf_settings_file])
+
+    def export_delta(self, path, passphrase, since=None, peer=None):
+        """Writes the changes since a checkpoint to an encrypted delta file
+
+        See src.sync for the format and how checkpoints are kept.
+        """
+        from src.sync import export_delta
+        return export_delta(self.db_manager, path, passphrase, since, peer)
+
+    def apply_delta(self, path, passphrase, peer=None):
+        """Merges a delta file exported by another replica of this vault"""
+        from src.sync import apply_delta
+        return apply_delta(self.db_manager, path, passphrase, peer)
+
+    def calibrate_kdf(self, algorithm=KDF_ALGORITHM, target_ms=KDF_TARGET_MS):
+        """Tunes the master password KDF cost to the target unlock time"""
+        try:
+            params = kdf.calibrate(algorithm, target_ms)
+            kdf.save_settings(algorithm, params, self.kdf_settings_file)
+        except (ValidationError, FileOperationError) as e:
+            print(f"Error calibrating KDF: {e}")
+            return None
+        print(f"Using {algorithm} with {params}; applied at the next unlock")
+        return params
+
+    def close(self):
+        """Releases the database connection"""
+        db_manager = getattr(self, 'db_manager', None)
+        if db_manager is not None:
+            db_manager.close()
+
+def unlock_vaults(master_passwords, vault_dir=VAULT_DIR, **options):
+    """Unlocks existing named vaults in parallel and returns a VaultSet
+
+    master_passwords maps each vault name to its master password; options
+    are passed on to PasswordManager.
+    """
+    from functools import partial
+    from src.vaults import VaultSet, list_vaults
+    existing = set(list_vaults(vault_dir))
+    for name in master_passwords:
+        if name not in existing:
+            raise ValidationError(f"No vault named {name!r} in {vault_dir}")
+    return VaultSet.open({name: partial(PasswordManager, password, vault=name,
+                                        vault_dir=vault_dir, **options)
+                          for name, password in master_passwords.items()})
+
+def main(argv=None):
+    from password_cli import build_parser, run_command, start_profiling
+    args = build_parser().parse_args(argv)
+    try:
+        start_profiling(args)
+    except PasswordManagerError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.command:
+        sys.exit(run_command(args))
+
+    from password_operations import PasswordOperations
+    pm = None
     try:
-        pm = PasswordManager()
+        if args.all_vaults or len(args.vaults or []) > 1:
+            raise ValidationError("The interactive menu works on one vault at a time")
+        pm = PasswordManager(in_memory=args.in_memory, flush_interval=args.flush_interval,
+                             vault=args.vaults[0] if args.vaults else None,
+                             vault_dir=args.vault_dir)
         operations = PasswordOperations(pm)
         
         while True:
@@ -189,6 +450,9 @@ def main():
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         sys.exit(1)
+    finally:
+        if pm is not None:
+            pm.close()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -1,6 +1,7 @@
 from getpass import getpass
 from src.exceptions import ValidationError
 from src.utils import validate_input
+from src.config import PAGE_SIZE
 import sys
 
 class PasswordOperations:
@@ -17,18 +18,77 @@ class PasswordOperations:
         self.pm.add_password(site, username, password, description)
 
     def view_passwords(self):
-        """Displays all stored passwords"""
-        passwords = self.pm.get_passwords()
-        if not passwords:
-            print("No passwords found!")
-        else:
-            print("\nStored Passwords:")
-            for site, username, password, description in passwords:
-                print(f"\nSite: {site}")
-                print(f"Username: {username}")
-                print(f"Password: {password}")
-                if description:
-                    print(f"Description: {description}")
+        """Displays stored accounts one page at a time"""
+        cursors = [None]
+        while True:
+            page = self.pm.get_passwords_page(PAGE_SIZE, cursors[-1])
+            if not page:
+                print("No passwords found!" if len(cursors) == 1 else "No more passwords.")
+                if len(cursors) == 1:
+                    return
+                cursors.pop()
+                continue
+
+            print(f"\nStored Passwords (page {len(cursors)}):")
+            self._print_entries(page)
+
+            choice = input("\nNumber to show password, n=next, p=previous, q=quit: ").strip().lower()
+            if choice == 'n':
+                if len(page) == PAGE_SIZE:
+                    cursors.append(page[-1].key)
+                else:
+                    print("This is the last page.")
+            elif choice == 'p':
+                if len(cursors) > 1:
+                    cursors.pop()
+            elif choice.isdigit() and 1 <= int(choice) <= len(page):
+                self._show_entry(page[int(choice) - 1])
+            elif choice in ('q', ''):
+                return
+            else:
+                print("Invalid choice!")
+
+    def search_passwords(self):
+        """Searches accounts and reveals only the selected password"""
+        query = input("Search for (site, username or description): ")
+        mode = input("Match [substring/prefix/fuzzy] (press Enter for substring): ") or 'substring'
+        results = self.pm.search_passwords(query, mode)
+        if not results:
+            print("No matching accounts found!")
+            return
+
+        print(f"\nFound {len(results)} matching accounts:")
+        self._print_entries(results)
+        choice = input("\nNumber to show password (press Enter to skip): ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(results):
+            self._show_entry(results[int(choice) - 1])
+
+    def calibrate_kdf(self):
+        """Handles master password KDF calibration"""
+        algorithm = input("KDF [pbkdf2-sha256/scrypt] (press Enter for pbkdf2-sha256): ") or 'pbkdf2-sha256'
+        target = input("Target unlock time in ms (press Enter for 250): ") or '250'
+        if not target.isdigit():
+            print("Target must be a whole number of milliseconds!")
+            return
+        print("Calibrating...")
+        self.pm.calibrate_kdf(algorithm, int(target))
+
+    def _print_entries(self, entries):
+        """Prints numbered account metadata without decrypting passwords"""
+        for number, entry in enumerate(entries, 1):
+            line = f"{number:3}. {entry.site} - {entry.username}"
+            if entry.description:
+                line += f" ({entry.description})"
+            print(line)
+
+    def _show_entry(self, entry):
+        """Decrypts and prints a single account"""
+        print(f"\nSite: {entry.site}")
+        print(f"Username: {entry.username}")
+        print(f"Password: {entry.password}")
+        if entry.description:
+            print(f"Description: {entry.description}")
+        input("\nPress Enter to continue...")
 
     def delete_password(self):
         """Handles password deletion"""
@@ -83,6 +143,13 @@ class PasswordOperations:
         new_description = input("Enter new description (press Enter to clear): ")
         self.pm.update_description(site, username, new_description)
 
+    def import_passwords(self):
+        """Handles importing an export file"""
+        path = input("Enter path to export file (CSV or JSON): ")
+        fmt = input("Format [auto/chrome/firefox/bitwarden-csv/bitwarden-json] (press Enter for auto): ") or 'auto'
+        merge = input("Update existing accounts with imported passwords? (y/N): ")
+        self.pm.import_passwords(path, fmt, 'merge' if merge.lower() == 'y' else 'skip')
+
     def show_menu(self):
         """Displays the main menu"""
         print("\n=== Password Manager ===")
@@ -93,8 +160,11 @@ class PasswordOperations:
         print("5. Update Username")
         print("6. Update Description")
         print("7. View Password History")
-        print("8. Exit")
-        return input("Choose an option (1-8): ")
+        print("8. Import Passwords")
+        print("9. Search Passwords")
+        print("10. Calibrate Unlock Time")
+        print("11. Exit")
+        return input("Choose an option (1-11): ")
 
     def handle_choice(self, choice):
         """Handles menu choices"""
@@ -113,6 +183,12 @@ class PasswordOperations:
         elif choice == '7':
             self.view_password_history()
         elif choice == '8':
+            self.import_passwords()
+        elif choice == '9':
+            self.search_passwords()
+        elif choice == '10':
+            self.calibrate_kdf()
+        elif choice == '11':
             print("Exiting...")
             sys.exit()
         else:
@@ -0,0 +1,175 @@
+import os
+import socket
+import socketserver
+import threading
+import time
+from .exceptions import PasswordManagerError, AgentError, ValidationError
+from .config import AGENT_IDLE_TIMEOUT
+from .utils import validate_input
+from .agent_client import default_socket_path, check_socket_dir, peer_uid, send_frame, recv_frame
+from .database.write_queue import WriteQueue
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """Serves framed requests from one client connection until it disconnects"""
+
+    def handle(self):
+        agent = self.server.agent
+        if not agent.is_peer_allowed(self.request):
+            send_frame(self.request, {'ok': False, 'type': 'AgentError',
+                                      'error': "Permission denied"})
+            return
+        while True:
+            try:
+                message = recv_frame(self.request)
+            except (OSError, ValueError, AgentError):
+                return
+            if message is None:
+                return
+            send_frame(self.request, agent.dispatch(message))
+
+class _AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class PasswordAgent:
+    """Keeps an unlocked PasswordManager in memory and answers socket requests
+
+    The socket lives in a 0700 directory and is itself 0600; on Linux the
+    peer uid is also checked. After idle_timeout seconds without requests
+    the agent closes the vault, wiping its cache, and stops serving.
+    Writes from concurrent clients are group-committed through a WriteQueue.
+    """
+
+    def __init__(self, password_manager, socket_path=None, idle_timeout=AGENT_IDLE_TIMEOUT):
+        self.pm = password_manager
+        self.socket_path = socket_path or default_socket_path()
+        self.idle_timeout = idle_timeout
+        self.last_activity = time.monotonic()
+        self._server = None
+        self._locked = threading.Event()
+        self._writes = WriteQueue(password_manager.db_manager)
+        self._operations = {
+            'ping': self._ping,
+            'get': self._get,
+            'add': self._add,
+            'update': self._update,
+            'search': self._search,
+            'list': self._list,
+            'lock': self._lock_request,
+        }
+
+    def _bind(self):
+        check_socket_dir(os.path.dirname(self.socket_path), create=True)
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise AgentError(f"An agent is already running at {self.socket_path}")
+            except OSError:
+                os.unlink(self.socket_path)
+            finally:
+                probe.close()
+        previous_umask = os.umask(0o177)
+        try:
+            server = _AgentServer(self.socket_path, _RequestHandler)
+        finally:
+            os.umask(previous_umask)
+        server.agent = self
+        return server
+
+    def is_peer_allowed(self, sock):
+        """Only accepts connections from processes of the same user"""
+        uid = peer_uid(sock)
+        return uid is None or uid == os.getuid()
+
+    def serve_forever(self):
+        """Serves requests until the agent is locked"""
+        self._server = self._bind()
+        watchdog = threading.Thread(target=self._watch_idle, daemon=True)
+        watchdog.start()
+        try:
+            self._server.serve_forever(poll_interval=0.5)
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.lock()
+
+    def _watch_idle(self):
+        interval = max(0.05, min(1.0, self.idle_timeout / 10))
+        while not self._locked.wait(interval):
+            if time.monotonic() - self.last_activity >= self.idle_timeout:
+                self.lock()
+
+    def lock(self):
+        """Closes the vault and stops the server"""
+        if self._locked.is_set():
+            return
+        self._locked.set()
+        self._writes.close()
+        self.pm.close()
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+    def dispatch(self, message):
+        """Runs one request and returns the response message"""
+        self.last_activity = time.monotonic()
+        if self._locked.is_set():
+            return {'ok': False, 'type': 'AgentError', 'error': "Agent is locked"}
+        operation = self._operations.get(message.get('op'))
+        if operation is None:
+            return {'ok': False, 'type': 'AgentError',
+                    'error': f"Unknown operation: {message.get('op')}"}
+        try:
+            return {'ok': True, 'result': operation(message)}
+        except PasswordManagerError as e:
+            return {'ok': False, 'type': type(e).__name__, 'error': str(e)}
+        except (KeyError, TypeError) as e:
+            return {'ok': False, 'type': 'ValidationError', 'error': f"Malformed request: {e}"}
+        except Exception as e:
+            # Anything else (InvalidToken, sqlite3.Error, ...) must not drop the
+            # connection; only the type is sent, since messages may name data
+            return {'ok': False, 'type': 'AgentError',
+                    'error': f"Request failed with {type(e).__name__}"}
+
+    def _ping(self, message):
+        return 'pong'
+
+    def _get(self, message):
+        password = self.pm.db_manager.get_password(message['site'], message['username'])
+        if password is None:
+            raise ValidationError("Site and username not found")
+        return password
+
+    def _add(self, message):
+        description = message.get('description', '')
+        validate_input(message['site'], message['username'], message['password'], description)
+        return self._writes.call(
+            'add_password', message['site'], message['username'], message['password'], description
+        )
+
+    def _update(self, message):
+        validate_input(message['site'], message['username'], message['password'])
+        if not self._writes.call(
+                'update_password', message['site'], message['username'], message['password']):
+            raise ValidationError("Site and username not found")
+        return True
+
+    def _search(self, message):
+        entries = self.pm.db_manager.search_passwords(
+            message['query'], message.get('mode', 'substring')
+        )
+        return [_metadata(entry) for entry in entries]
+
+    def _list(self, message):
+        after = message.get('after')
+        entries = self.pm.db_manager.get_passwords_page(
+            message.get('limit', 100), tuple(after) if after else None
+        )
+        return [_metadata(entry) for entry in entries]
+
+    def _lock_request(self, message):
+        threading.Thread(target=self.lock, daemon=True).start()
+        return True
+
+def _metadata(entry):
+    return {'site': entry.site, 'username': entry.username, 'description': entry.description}
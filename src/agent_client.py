@@ -0,0 +1,143 @@
+"""Client side of the agent protocol.
+
+Kept free of cryptography and sqlite imports so one-shot lookups start fast.
+Each frame is a 4-byte big-endian length followed by a UTF-8 JSON object.
+"""
+import json
+import os
+import socket
+import stat
+import struct
+import tempfile
+from . import exceptions
+from .exceptions import AgentError
+from .config import AGENT_SOCKET, AGENT_MAX_FRAME
+
+_HEADER = struct.Struct('>I')
+
+def default_socket_path():
+    """Returns the agent socket path inside a per-user runtime directory"""
+    if AGENT_SOCKET:
+        return AGENT_SOCKET
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir, f"password-manager-{os.getuid()}", 'agent.sock')
+
+def check_socket_dir(directory, create=False):
+    """Refuses a socket directory another user could have planted or can enter
+
+    Without XDG_RUNTIME_DIR the directory sits at a predictable path in
+    the shared temp directory, so it must be a real directory (not a
+    symlink) owned by this user with mode 0700. With create, a missing
+    directory is made that way.
+    """
+    try:
+        try:
+            info = os.lstat(directory)
+        except FileNotFoundError:
+            if not create:
+                raise AgentError(f"Agent is not running: {directory} does not exist")
+            try:
+                os.makedirs(directory, 0o700)
+            except FileExistsError:
+                pass
+            info = os.lstat(directory)
+    except OSError as e:
+        raise AgentError(f"Cannot use agent directory {directory}: {e}")
+    if not stat.S_ISDIR(info.st_mode):
+        raise AgentError(f"Agent directory {directory} is not a directory")
+    if info.st_uid != os.getuid():
+        raise AgentError(f"Agent directory {directory} is owned by another user")
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        raise AgentError(f"Agent directory {directory} must have mode 0700, "
+                         f"not {stat.S_IMODE(info.st_mode):04o}")
+
+def peer_uid(sock):
+    """Returns the uid of the process at the other end, or None where unsupported"""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', credentials)
+    return uid
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+def send_frame(sock, message):
+    """Sends one JSON message"""
+    payload = json.dumps(message, separators=(',', ':')).encode()
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+def recv_frame(sock):
+    """Receives one JSON message, or None when the peer closed the connection"""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    (length,) = _HEADER.unpack(header)
+    if length > AGENT_MAX_FRAME:
+        raise AgentError(f"Frame of {length} bytes exceeds the {AGENT_MAX_FRAME} byte limit")
+    payload = _recv_exact(sock, length)
+    if payload is None:
+        return None
+    return json.loads(payload)
+
+class AgentClient:
+    """Sends requests to a running agent over its Unix socket"""
+
+    def __init__(self, socket_path=None, timeout=10):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        self._sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self):
+        if self._sock is None:
+            check_socket_dir(os.path.dirname(self.socket_path))
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+                uid = peer_uid(sock)
+            except OSError as e:
+                sock.close()
+                raise AgentError(f"Agent is not running at {self.socket_path}: {e}")
+            if uid is not None and uid != os.getuid():
+                sock.close()
+                raise AgentError(f"The agent at {self.socket_path} belongs to another user")
+            self._sock = sock
+        return self._sock
+
+    def request(self, op, **params):
+        """Sends one request and returns its result, raising on agent errors"""
+        sock = self._connect()
+        try:
+            send_frame(sock, {'op': op, **params})
+            response = recv_frame(sock)
+        except (OSError, ValueError) as e:
+            self.close()
+            raise AgentError(f"Agent connection failed: {e}")
+        if response is None:
+            self.close()
+            raise AgentError("Agent closed the connection")
+        if not response.get('ok'):
+            # Re-raise as the same exception type the agent hit, when known
+            error_class = getattr(exceptions, response.get('type', ''), None)
+            if not (isinstance(error_class, type) and issubclass(error_class, exceptions.PasswordManagerError)):
+                error_class = AgentError
+            raise error_class(response.get('error', 'Unknown agent error'))
+        return response.get('result')
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
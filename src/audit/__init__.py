@@ -0,0 +1 @@
+# This file makes the audit directory a Python package
@@ -0,0 +1,303 @@
+"""Offline breached-password checks against a local SHA-1 corpus.
+
+convert_corpus turns a Have I Been Pwned style dump (one "SHA1HEX:COUNT"
+line per password) into a sorted binary file:
+
+    header   magic, record count
+    index    65537 big-endian offsets; records whose hash starts with the
+             two bytes p are records[index[p]:index[p + 1]]
+    records  20-byte SHA-1 digest, 4-byte breach count, sorted by digest
+
+BreachCorpus memory-maps that file, so a lookup touches one index entry
+and a binary search over the few thousand records sharing its prefix,
+however large the corpus is. An optional Bloom filter, also memory-mapped,
+answers most misses without touching the corpus at all.
+"""
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from ..exceptions import ValidationError, FileOperationError
+from ..config import BLOOM_BITS_PER_ENTRY, CORPUS_SORT_CHUNK
+
+CORPUS_MAGIC = b'PMSHA1C1'
+BLOOM_MAGIC = b'PMBLOOM1'
+HEADER = struct.Struct('>8sQ')  # magic, record count
+BLOOM_HEADER = struct.Struct('>8sQI')  # magic, bit count, hash count
+RECORD = struct.Struct('>20sI')  # digest, breach count
+PREFIX_COUNT = 1 << 16
+INDEX_ENTRY = struct.Struct('>Q')
+RECORDS_OFFSET = HEADER.size + (PREFIX_COUNT + 1) * INDEX_ENTRY.size
+DIGEST_LENGTH = 20
+
+def _parse_line(line, number):
+    digest, _, count = line.strip().partition(b':')
+    try:
+        value = bytes.fromhex(digest.decode('ascii'))
+        if len(value) != DIGEST_LENGTH:
+            raise ValueError
+        return value, min(int(count or 1), 0xFFFFFFFF)
+    except ValueError:
+        raise ValidationError(f"Line {number} is not a SHA1HEX:COUNT record")
+
+def _read_records(path):
+    """Yields (digest, count) from a binary run file"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(RECORD.size * 4096)
+            if not chunk:
+                return
+            yield from RECORD.iter_unpack(chunk)
+
+def _write_run(records, directory, runs):
+    fd, path = tempfile.mkstemp(prefix='.corpus-run-', dir=directory)
+    runs.append(path)
+    with os.fdopen(fd, 'wb') as f:
+        for record in records:
+            f.write(RECORD.pack(*record))
+
+def _sorted_runs(source, directory, chunk_records, runs):
+    """Splits the dump into sorted binary runs; an ordered dump is one run
+
+    Each run's path goes into runs as soon as the file exists, so the
+    caller can remove them however this fails.
+    """
+    chunk = []
+    for number, line in enumerate(source, 1):
+        if not line.strip():
+            continue
+        chunk.append(_parse_line(line, number))
+        if len(chunk) >= chunk_records:
+            chunk.sort()
+            _write_run(chunk, directory, runs)
+            chunk = []
+    if chunk or not runs:
+        chunk.sort()
+        _write_run(chunk, directory, runs)
+
+def _merged(runs):
+    """Merges sorted runs, adding up the counts of repeated digests"""
+    current, total = None, 0
+    for digest, count in heapq.merge(*(_read_records(run) for run in runs)):
+        if digest == current:
+            total = min(total + count, 0xFFFFFFFF)
+            continue
+        if current is not None:
+            yield current, total
+        current, total = digest, count
+    if current is not None:
+        yield current, total
+
+
+class BloomFilter:
+    """Memory-mapped Bloom filter over SHA-1 digests
+
+    The digest is already uniformly distributed, so the k probe positions
+    come from double hashing two 64-bit slices of it.
+    """
+
+    def __init__(self, path, writable=False):
+        try:
+            self._file = open(path, 'r+b' if writable else 'rb')
+        except OSError as e:
+            raise FileOperationError(f"Failed to open Bloom filter: {e}")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            self._file.close()
+            raise FileOperationError(f"Failed to open Bloom filter: {e}")
+        if len(self._map) < BLOOM_HEADER.size:
+            self.close()
+            raise ValidationError(f"{path} is not a Bloom filter file")
+        magic, self.bits, self.hashes = BLOOM_HEADER.unpack_from(self._map)
+        if (magic != BLOOM_MAGIC or not self.bits or not self.hashes
+                or len(self._map) != BLOOM_HEADER.size + (self.bits + 7) // 8):
+            self.close()
+            raise ValidationError(f"{path} is not a Bloom filter file")
+
+    @staticmethod
+    def create(path, entries, bits_per_entry=BLOOM_BITS_PER_ENTRY):
+        """Creates an empty (sparse) filter sized for entries and opens it for writing"""
+        bits = max(64, entries * bits_per_entry)
+        hashes = max(1, round(bits_per_entry * math.log(2)))
+        with open(path, 'wb') as f:
+            f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, bits, hashes))
+            f.truncate(BLOOM_HEADER.size + (bits + 7) // 8)
+        return BloomFilter(path, writable=True)
+
+    def _positions(self, digest):
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            offset = BLOOM_HEADER.size + (position >> 3)
+            self._map[offset] |= 1 << (position & 7)
+
+    def __contains__(self, digest):
+        for position in self._positions(digest):
+            if not self._map[BLOOM_HEADER.size + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def convert_corpus(source_path, output_path, bloom_path=None,
+                   bits_per_entry=BLOOM_BITS_PER_ENTRY, chunk_records=CORPUS_SORT_CHUNK):
+    """Converts a "SHA1HEX:COUNT" text dump into the binary corpus format
+
+    The dump is sorted chunk_records lines at a time (nearly free for
+    dumps already ordered by hash) and the sorted runs are merged from
+    disk, so memory use stays bounded. Repeated digests have their counts
+    added. Returns the number of distinct digests written; on failure the
+    partly written output and Bloom filter files are removed.
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    runs = []
+    outputs = []
+    bloom = None
+    try:
+        with open(source_path, 'rb') as source:
+            _sorted_runs(source, directory, chunk_records, runs)
+        upper_bound = sum(os.path.getsize(run) for run in runs) // RECORD.size
+
+        if bloom_path:
+            bloom = BloomFilter.create(bloom_path, upper_bound, bits_per_entry)
+            outputs.append(bloom_path)
+        prefix_counts = [0] * PREFIX_COUNT
+        count = 0
+        with open(output_path, 'wb') as out:
+            outputs.append(output_path)
+            out.seek(RECORDS_OFFSET)
+            buffer = []
+            for digest, breaches in _merged(runs):
+                buffer.append(RECORD.pack(digest, breaches))
+                prefix_counts[int.from_bytes(digest[:2], 'big')] += 1
+                if bloom is not None:
+                    bloom.add(digest)
+                count += 1
+                if len(buffer) >= 4096:
+                    out.write(b''.join(buffer))
+                    buffer.clear()
+            out.write(b''.join(buffer))
+
+            out.seek(0)
+            out.write(HEADER.pack(CORPUS_MAGIC, count))
+            offset = 0
+            index = bytearray()
+            for prefix_count in prefix_counts:
+                index += INDEX_ENTRY.pack(offset)
+                offset += prefix_count
+            index += INDEX_ENTRY.pack(offset)
+            out.write(index)
+        outputs.clear()
+    except OSError as e:
+        raise FileOperationError(f"Failed to convert corpus: {e}")
+    finally:
+        if bloom is not None:
+            bloom.close()
+        for path in runs + outputs:
+            os.remove(path)
+    return count
+
+
+class BreachCorpus:
+    """Read-only, memory-mapped view of a converted corpus"""
+
+    def __init__(self, path, bloom_path=None):
+        self.bloom = None
+        try:
+            self._file = open(path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise FileOperationError(f"Failed to open corpus: {e}")
+        if len(self._map) < RECORDS_OFFSET:
+            self.close()
+            raise ValidationError(f"{path} is not a converted corpus")
+        magic, self.count = HEADER.unpack_from(self._map)
+        if magic != CORPUS_MAGIC or len(self._map) != RECORDS_OFFSET + self.count * RECORD.size:
+            self.close()
+            raise ValidationError(f"{path} is not a converted corpus")
+        if hasattr(self._map, 'madvise'):
+            # Lookups jump around; readahead would only evict useful pages
+            self._map.madvise(mmap.MADV_RANDOM)
+        if bloom_path:
+            try:
+                self.bloom = BloomFilter(bloom_path)
+            except (FileOperationError, ValidationError):
+                self.close()
+                raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def lookup(self, digest):
+        """Returns how often the SHA-1 digest was seen in breaches, or 0"""
+        if self.bloom is not None and digest not in self.bloom:
+            return 0
+        data = self._map
+        prefix = int.from_bytes(digest[:2], 'big')
+        low, high = struct.unpack_from('>QQ', data, HEADER.size + prefix * INDEX_ENTRY.size)
+        while low < high:
+            middle = (low + high) // 2
+            offset = RECORDS_OFFSET + middle * RECORD.size
+            candidate = data[offset:offset + DIGEST_LENGTH]
+            if candidate < digest:
+                low = middle + 1
+            elif candidate > digest:
+                high = middle
+            else:
+                return RECORD.unpack_from(data, offset)[1]
+        return 0
+
+    def check(self, password):
+        return self.lookup(hashlib.sha1(password.encode()).digest())
+
+    def close(self):
+        if self.bloom is not None:
+            self.bloom.close()
+            self.bloom = None
+        self._map.close()
+        self._file.close()
+
+
+def audit_breaches(db_manager, corpus, include_history=True):
+    """Checks every current (and past) password of the vault against corpus
+
+    Entries are decrypted a batch at a time as they stream from the
+    database. Returns counts, throughput and one finding per breached
+    entry; findings never include the password itself.
+    """
+    findings = []
+    checked = 0
+    start = time.perf_counter()
+    for entry in db_manager.iter_passwords(decrypt=True):
+        checked += 1
+        breaches = corpus.check(entry.password)
+        if breaches:
+            findings.append({'site': entry.site, 'username': entry.username,
+                             'source': 'current', 'breaches': breaches})
+    if include_history:
+        for site, username, password, changed_date in db_manager.iter_history():
+            checked += 1
+            breaches = corpus.check(password)
+            if breaches:
+                findings.append({'site': site, 'username': username, 'source': 'history',
+                                 'changed_date': changed_date, 'breaches': breaches})
+    elapsed = time.perf_counter() - start
+    return {'checked': checked, 'breached': len(findings), 'seconds': round(elapsed, 3),
+            'checks_per_sec': round(checked / elapsed) if elapsed else checked,
+            'findings': findings}
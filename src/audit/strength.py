@@ -0,0 +1,532 @@
+"""Offline password strength estimation in the style of zxcvbn.
+
+A password is matched against known patterns: words from the bundled
+ranked wordlists (also reversed and with l33t substitutions), keyboard
+walks on QWERTY and the numeric keypad, repeats, character sequences,
+years and dates. Each match is priced in guesses, and the cheapest way
+to cover the whole password with matches and brute-forced gaps gives
+its guess count, mapped to a score from 0 (trivial) to 4 (strong).
+
+The wordlists in data/*.txt, most common first, are compiled into
+data/wordlists.bin: per list, the words in rank order, zlib-compressed.
+Loading builds one word -> rank table plus a table of every word prefix,
+so the substring scan stops as soon as no word can match. Run
+``python -m src.audit.strength`` after editing a list.
+
+audit_strength scores a vault in one streaming pass and caches each
+result under the password's fingerprint, so a repeat audit only scores
+passwords that changed.
+"""
+import math
+import os
+import re
+import struct
+import time
+import zlib
+from datetime import datetime
+from ..exceptions import ValidationError, FileOperationError
+from ..config import READ_BATCH_SIZE
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+WORDLISTS = ('passwords', 'english', 'names')
+WORDLISTS_FILE = os.path.join(DATA_DIR, 'wordlists.bin')
+WORDLISTS_MAGIC = b'PMWORDS1'
+LIST_HEADER = struct.Struct('>BII')  # name length, word count, compressed length
+
+# Bumped when scoring changes, so cached scores are recomputed
+ESTIMATOR_VERSION = 2
+# vault_meta key holding the estimator the cached scores came from
+STRENGTH_VERSION = 'strength_version'
+
+# Longer passwords are matched in blocks of this many characters, or as a
+# repeat when their period is at most this long
+MAX_LENGTH = 64
+BRUTEFORCE_CARDINALITY = 10
+MIN_GUESSES_SINGLE_CHAR = 10
+MIN_GUESSES_MULTI_CHAR = 50
+MIN_GUESSES_BEFORE_GROWING_SEQUENCE = 10000
+MIN_YEAR_SPACE = 20
+REFERENCE_YEAR = datetime.now().year
+# Guess counts at which the score goes up by one
+SCORE_THRESHOLDS = (1e3 + 5, 1e6 + 5, 1e8 + 5, 1e10 + 5)
+
+L33T = {'4': 'a', '@': 'a', '8': 'b', '(': 'c', '{': 'c', '[': 'c', '<': 'c',
+        '3': 'e', '6': 'g', '9': 'g', '1': 'i', '!': 'i', '|': 'i', '0': 'o',
+        '$': 's', '5': 's', '7': 't', '+': 't', '%': 'x', '2': 'z'}
+# Characters with a second plausible reading
+L33T_ALTERNATES = {'1': 'l', '|': 'l'}
+
+QWERTY_ROWS = (('`~', '1!', '2@', '3#', '4$', '5%', '6^', '7&', '8*', '9(', '0)', '-_', '=+'),
+               ('qQ', 'wW', 'eE', 'rR', 'tT', 'yY', 'uU', 'iI', 'oO', 'pP', '[{', ']}', '\\|'),
+               ('aA', 'sS', 'dD', 'fF', 'gG', 'hH', 'jJ', 'kK', 'lL', ';:', '\'"'),
+               ('zZ', 'xX', 'cC', 'vV', 'bB', 'nN', 'mM', ',<', '.>', '/?'))
+# Horizontal offset of each row in half keys; rows alternate between
+# whole and half positions, so diagonal neighbours are half a key away
+QWERTY_OFFSETS = (0, 3, 4, 5)
+KEYPAD_ROWS = (('/', '*', '-'), ('7', '8', '9', '+'), ('4', '5', '6'), ('1', '2', '3'), ('0', '.'))
+
+DATE_SPLITS = {4: ((1, 2), (2, 3)), 5: ((1, 3), (2, 3)), 6: ((1, 2), (2, 4), (4, 5)),
+               7: ((1, 3), (2, 3), (4, 5), (4, 6)), 8: ((2, 4), (4, 6))}
+DATE_WITH_SEPARATOR = re.compile(r'(\d{1,4})([\s/\\_.-])(\d{1,2})\2(\d{1,4})')
+YEAR = re.compile(r'19\d\d|20\d\d')
+REPEAT_GREEDY = re.compile(r'(.+)\1+')
+REPEAT_LAZY = re.compile(r'(.+?)\1+')
+REPEAT_BASE = re.compile(r'^(.+?)\1+$')
+
+
+def _read_lists(source_dir):
+    lists = {}
+    for name in WORDLISTS:
+        try:
+            with open(os.path.join(source_dir, f'{name}.txt'), encoding='utf-8') as f:
+                words = [line.strip().lower() for line in f]
+        except OSError as e:
+            raise FileOperationError(f"Failed to read wordlist {name}: {e}")
+        # Keep each word's first (best) rank
+        lists[name] = list(dict.fromkeys(word for word in words if word))
+    return lists
+
+def build_wordlists(source_dir=DATA_DIR, output_path=WORDLISTS_FILE):
+    """Compiles the ranked text wordlists into one compact file
+
+    Returns the number of words written.
+    """
+    lists = _read_lists(source_dir)
+    try:
+        with open(output_path, 'wb') as f:
+            f.write(WORDLISTS_MAGIC)
+            for name, words in lists.items():
+                data = zlib.compress('\n'.join(words).encode(), 9)
+                f.write(LIST_HEADER.pack(len(name), len(words), len(data)))
+                f.write(name.encode())
+                f.write(data)
+    except OSError as e:
+        raise FileOperationError(f"Failed to write {output_path}: {e}")
+    return sum(len(words) for words in lists.values())
+
+def load_wordlists(path=WORDLISTS_FILE):
+    """Returns {list name: [words, most common first]} from a compiled file"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise FileOperationError(f"Failed to read {path}: {e}")
+    if not data.startswith(WORDLISTS_MAGIC):
+        raise ValidationError(f"{path} is not a compiled wordlist file")
+    lists, offset = {}, len(WORDLISTS_MAGIC)
+    try:
+        while offset < len(data):
+            name_length, count, length = LIST_HEADER.unpack_from(data, offset)
+            offset += LIST_HEADER.size
+            name = data[offset:offset + name_length].decode()
+            offset += name_length
+            words = zlib.decompress(data[offset:offset + length]).decode().split('\n')
+            offset += length
+            if len(words) != count:
+                raise ValueError(f"{name} holds {len(words)} words, expected {count}")
+            lists[name] = words
+    except (struct.error, zlib.error, ValueError) as e:
+        raise ValidationError(f"{path} is corrupted: {e}")
+    return lists
+
+
+def _build_graph(rows, offsets, directions):
+    """Maps each character to its neighbouring keys, one slot per direction"""
+    positions = {}
+    for y, (row, offset) in enumerate(zip(rows, offsets)):
+        for x, key in enumerate(row):
+            positions[(offset + 2 * x, y)] = key
+    graph = {}
+    for (x, y), key in positions.items():
+        neighbours = tuple(positions.get((x + dx, y + dy)) for dx, dy in directions)
+        for char in key:
+            graph[char] = neighbours
+    return graph
+
+QWERTY = _build_graph(QWERTY_ROWS, QWERTY_OFFSETS,
+                      ((-2, 0), (-1, -1), (1, -1), (2, 0), (1, 1), (-1, 1)))
+KEYPAD = _build_graph(KEYPAD_ROWS, (0,) * len(KEYPAD_ROWS),
+                      ((-2, 0), (-2, -1), (0, -1), (2, -1), (2, 0), (2, 1), (0, 1), (-2, 1)))
+
+def _graph_stats(graph):
+    """Returns the number of starting characters and the average key degree"""
+    degree = sum(sum(1 for key in neighbours if key) for neighbours in graph.values()) / len(graph)
+    return len(graph), degree
+
+SHIFTED = frozenset(key[1] for row in QWERTY_ROWS for key in row)
+GRAPHS = (('qwerty', QWERTY, *_graph_stats(QWERTY)), ('keypad', KEYPAD, *_graph_stats(KEYPAD)))
+
+
+def _variations(changed, unchanged):
+    """Ways to place changed characters among a token's letters"""
+    if not changed or not unchanged:
+        return 2
+    return sum(math.comb(changed + unchanged, i) for i in range(1, min(changed, unchanged) + 1))
+
+def _uppercase_variations(token):
+    if token.islower() or not any(char.isalpha() for char in token):
+        return 1
+    if token.isupper() or (token[0].isupper() and token[1:].islower()) or \
+            (token[-1].isupper() and token[:-1].islower()):
+        return 2
+    upper = sum(1 for char in token if char.isupper())
+    lower = sum(1 for char in token if char.islower())
+    return _variations(upper, lower)
+
+def _two_to_four_digit_year(year):
+    if year > 99:
+        return year
+    return year + (1900 if year > 50 else 2000)
+
+def _day_month(first, second):
+    for day, month in ((first, second), (second, first)):
+        if 1 <= day <= 31 and 1 <= month <= 12:
+            return True
+    return False
+
+def _date_year(a, b, c):
+    """Returns the year if the three numbers read as a date, else None"""
+    if b > 31 or b <= 0:
+        return None
+    over_12 = over_31 = under_1 = 0
+    for value in (a, b, c):
+        if 99 < value < 1000 or value > 2050:
+            return None
+        over_31 += value > 31
+        over_12 += value > 12
+        under_1 += value <= 0
+    if over_31 >= 2 or over_12 == 3 or under_1 >= 2:
+        return None
+    candidates = ((c, a, b), (a, b, c))
+    for year, first, second in candidates:
+        if 1000 <= year <= 2050 and _day_month(first, second):
+            return year
+    for year, first, second in candidates:
+        if _day_month(first, second):
+            return _two_to_four_digit_year(year)
+    return None
+
+def _score(guesses):
+    for score, threshold in enumerate(SCORE_THRESHOLDS):
+        if guesses < threshold:
+            return score
+    return len(SCORE_THRESHOLDS)
+
+
+class StrengthEstimator:
+    """Estimates how many guesses an attacker needs for a password"""
+
+    def __init__(self, wordlists=None):
+        if wordlists is None:
+            wordlists = (load_wordlists() if os.path.exists(WORDLISTS_FILE)
+                         else _read_lists(DATA_DIR))
+        # Identifies the wordlists, so cached scores follow list edits
+        self.digest = zlib.crc32('\n'.join(
+            f"{name}:{','.join(words)}" for name, words in sorted(wordlists.items())).encode())
+        self.ranks = {}
+        for words in wordlists.values():
+            for rank, word in enumerate(words, 1):
+                if rank < self.ranks.get(word, rank + 1):
+                    self.ranks[word] = rank
+        self.prefixes = {word[:k] for word in self.ranks for k in range(1, len(word) + 1)}
+        self.max_word = max(map(len, self.ranks), default=0)
+        self._repeat_cache = {}
+
+    def estimate(self, password):
+        """Returns (score 0-4, log10 of the guesses, weakest pattern found)"""
+        if len(password) <= MAX_LENGTH:
+            guesses, pattern = self._guesses(password)
+            log10 = math.log10(guesses)
+        else:
+            log10, pattern = self._long_guesses(password)
+        return _score(10 ** min(log10, 300)), round(log10, 2), pattern
+
+    def _long_guesses(self, password):
+        """Prices a password past MAX_LENGTH, returning log10 of its guesses
+
+        A password that repeats a short base is priced like a repeat match
+        over its whole length. Otherwise each MAX_LENGTH block is matched on
+        its own and the guesses multiply, so a repetitive tail adds what its
+        patterns cost rather than a digit per character.
+        """
+        for period in range(1, MAX_LENGTH + 1):
+            if password[period:] == password[:-period]:
+                base_guesses = self._guesses(password[:period])[0]
+                return math.log10(base_guesses * len(password) / period), 'repeat'
+        log10, pattern = 0, None
+        for start in range(0, len(password), MAX_LENGTH):
+            guesses, block_pattern = self._guesses(password[start:start + MAX_LENGTH])
+            log10 += math.log10(guesses)
+            pattern = pattern or block_pattern
+        return log10, pattern
+
+    def _guesses(self, password):
+        n = len(password)
+        if not n:
+            return 1, 'empty'
+        matches = self._matches(password)
+        by_end = [[] for _ in range(n)]
+        for match in matches:
+            i, j, pattern, guesses = match
+            if j - i < n:
+                guesses = max(guesses, MIN_GUESSES_SINGLE_CHAR if j - i == 1 else MIN_GUESSES_MULTI_CHAR)
+            by_end[j - 1].append((i, j, pattern, guesses))
+
+        # best[k][l]: cheapest covering of password[:k + 1] by l matches,
+        # as (total guesses g, product of match guesses pi, last match)
+        best = [{} for _ in range(n)]
+
+        def update(match, length):
+            i, j, _, guesses = match
+            pi = guesses * best[i - 1][length - 1][1] if length > 1 else guesses
+            g = math.factorial(length) * pi + MIN_GUESSES_BEFORE_GROWING_SEQUENCE ** (length - 1)
+            options = best[j - 1]
+            for other_length, (other_g, _, _) in options.items():
+                if other_length <= length and other_g <= g:
+                    return
+            options[length] = (g, pi, match)
+
+        def bruteforce(i, j):
+            guesses = float(BRUTEFORCE_CARDINALITY) ** (j - i)
+            if j - i < n:
+                guesses = max(guesses, MIN_GUESSES_SINGLE_CHAR if j - i == 1 else MIN_GUESSES_MULTI_CHAR)
+            return (i, j, 'bruteforce', guesses)
+
+        for k in range(n):
+            for match in by_end[k]:
+                if match[0]:
+                    for length in list(best[match[0] - 1]):
+                        update(match, length + 1)
+                else:
+                    update(match, 1)
+            update(bruteforce(0, k + 1), 1)
+            for i in range(1, k + 1):
+                for length, (_, _, last) in list(best[i - 1].items()):
+                    if last[2] != 'bruteforce':
+                        update(bruteforce(i, k + 1), length + 1)
+
+        length, (guesses, _, match) = min(best[n - 1].items(), key=lambda item: item[1][0])
+        # The pattern covering most of the password says what makes it weak
+        weakest, widest = 'bruteforce', 0
+        while True:
+            i, j, pattern, _ = match
+            if pattern != 'bruteforce' and j - i > widest:
+                weakest, widest = pattern, j - i
+            length -= 1
+            if not length:
+                break
+            match = best[i - 1][length][2]
+        return guesses, weakest
+
+    def _matches(self, password):
+        lower = password.lower()
+        matches = self._dictionary(password, lower, 'dictionary')
+        reversed_lower = lower[::-1]
+        n = len(password)
+        for i, j, _, guesses in self._dictionary(password[::-1], reversed_lower, 'reversed'):
+            matches.append((n - j, n - i, 'reversed', guesses * 2))
+        matches += self._l33t(password, lower)
+        matches += self._spatial(password)
+        matches += self._repeat(password)
+        matches += self._sequence(password)
+        if sum(char.isdigit() for char in password) >= 4:
+            matches += self._dates(password)
+        for found in YEAR.finditer(password):
+            matches.append((found.start(), found.end(), 'year',
+                            max(abs(int(found.group()) - REFERENCE_YEAR), MIN_YEAR_SPACE)))
+        return matches
+
+    def _dictionary(self, password, lower, pattern):
+        ranks, prefixes = self.ranks, self.prefixes
+        matches = []
+        n = len(lower)
+        for i in range(n):
+            for j in range(i + 1, min(n, i + self.max_word) + 1):
+                token = lower[i:j]
+                if token not in prefixes:
+                    break
+                rank = ranks.get(token)
+                if rank is not None:
+                    matches.append((i, j, pattern, rank * _uppercase_variations(password[i:j])))
+        return matches
+
+    def _l33t(self, password, lower):
+        if not any(char in L33T for char in lower):
+            return []
+        matches = []
+        translations = {''.join(L33T.get(char, char) for char in lower)}
+        if any(char in L33T_ALTERNATES for char in lower):
+            translations.add(''.join(L33T_ALTERNATES.get(char, L33T.get(char, char))
+                                     for char in lower))
+        seen = set()
+        for translated in translations:
+            for i, j, _, guesses in self._dictionary(password, translated, 'l33t'):
+                subbed = sum(1 for char in lower[i:j] if char in L33T)
+                if not subbed or (i, j) in seen or lower[i:j] in self.ranks:
+                    continue
+                seen.add((i, j))
+                plain = sum(1 for char in lower[i:j] if char.isalpha())
+                matches.append((i, j, 'l33t', guesses * _variations(subbed, plain)))
+        return matches
+
+    def _spatial(self, password):
+        matches = []
+        n = len(password)
+        for _, graph, starts, degree in GRAPHS:
+            i = 0
+            while i < n - 1:
+                j, turns, direction = i + 1, 0, None
+                shifted = int(password[i] in SHIFTED) if graph is QWERTY else 0
+                while j < n:
+                    neighbours = graph.get(password[j - 1])
+                    if neighbours is None:
+                        break
+                    for index, key in enumerate(neighbours):
+                        if key and password[j] in key:
+                            if key.index(password[j]) == 1 and len(key) > 1:
+                                shifted += 1
+                            if index != direction:
+                                turns += 1
+                                direction = index
+                            break
+                    else:
+                        break
+                    j += 1
+                if j - i >= 3:
+                    matches.append((i, j, 'spatial',
+                                    self._spatial_guesses(j - i, turns, shifted, starts, degree)))
+                i = j if j - i >= 3 else i + 1
+        return matches
+
+    @staticmethod
+    def _spatial_guesses(length, turns, shifted, starts, degree):
+        guesses = 0
+        for i in range(2, length + 1):
+            for j in range(1, min(turns, i - 1) + 1):
+                guesses += math.comb(i - 1, j - 1) * starts * degree ** j
+        if shifted:
+            guesses *= _variations(shifted, length - shifted)
+        return guesses
+
+    def _repeat(self, password):
+        matches = []
+        last, n = 0, len(password)
+        while last < n:
+            greedy = REPEAT_GREEDY.search(password, last)
+            if greedy is None:
+                break
+            lazy = REPEAT_LAZY.search(password, last)
+            if len(greedy.group(0)) > len(lazy.group(0)):
+                found, base = greedy, REPEAT_BASE.match(greedy.group(0)).group(1)
+            else:
+                found, base = lazy, lazy.group(1)
+            base_guesses = self._repeat_cache.get(base)
+            if base_guesses is None:
+                if len(self._repeat_cache) > 10000:
+                    self._repeat_cache.clear()
+                base_guesses = self._repeat_cache[base] = self._guesses(base)[0]
+            count = len(found.group(0)) // len(base)
+            matches.append((found.start(), found.end(), 'repeat', base_guesses * count))
+            last = found.end()
+        return matches
+
+    @staticmethod
+    def _sequence(password):
+        matches = []
+        n = len(password)
+        i = 0
+        while i < n - 2:
+            delta = ord(password[i + 1]) - ord(password[i])
+            j = i + 1
+            while j < n and ord(password[j]) - ord(password[j - 1]) == delta:
+                j += 1
+            if j - i >= 3 and 0 < abs(delta) <= 5 and (
+                    password[i:j].isdigit() or password[i:j].isalpha()):
+                first = password[i]
+                base = 4 if first in 'aAzZ019' else 10 if first.isdigit() else 26
+                matches.append((i, j, 'sequence', base * (j - i) * (1 if delta > 0 else 2)))
+                i = j - 1
+            else:
+                i += 1
+        return matches
+
+    @staticmethod
+    def _dates(password):
+        matches = []
+        n = len(password)
+        for i in range(n - 3):
+            for j in range(i + 4, min(n, i + 10) + 1):
+                token = password[i:j]
+                year = None
+                if token.isdigit():
+                    if j - i > 8:
+                        continue
+                    for k, l in DATE_SPLITS[j - i]:
+                        candidate = _date_year(int(token[:k]), int(token[k:l]), int(token[l:]))
+                        if candidate is not None and (
+                                year is None or abs(candidate - REFERENCE_YEAR) < abs(year - REFERENCE_YEAR)):
+                            year = candidate
+                    separator = 1
+                elif j - i >= 6:
+                    found = DATE_WITH_SEPARATOR.fullmatch(token)
+                    if found:
+                        year = _date_year(int(found.group(1)), int(found.group(3)), int(found.group(4)))
+                    separator = 4
+                if year is not None:
+                    guesses = max(abs(year - REFERENCE_YEAR), MIN_YEAR_SPACE) * 365 * separator
+                    matches.append((i, j, 'date', guesses))
+        return matches
+
+
+def audit_strength(db_manager, max_score=2, estimator=None, rescore=False):
+    """Scores every current password of the vault in one streaming pass
+
+    Scores are cached per password fingerprint, so only passwords added
+    or changed since the last audit are decrypted and scored; rescore
+    drops the cache first. Returns counts per score, throughput and one
+    finding per entry scoring max_score or lower, without the password.
+    """
+    estimator = estimator or StrengthEstimator()
+    # The cache is only valid for the estimator and wordlists that filled it
+    version = f"{ESTIMATOR_VERSION}:{estimator.digest:08x}"
+    if rescore or db_manager.get_meta(STRENGTH_VERSION) != version:
+        db_manager.clear_strength_cache()
+        db_manager.set_meta(STRENGTH_VERSION, version)
+
+    scores = [0] * (len(SCORE_THRESHOLDS) + 1)
+    findings = []
+    checked = scored = 0
+    start = time.perf_counter()
+    for batch in db_manager.iter_strength(READ_BATCH_SIZE):
+        missing = [row for row in batch if row[4] is None]
+        results = {}
+        if missing:
+            passwords = db_manager.batch_cipher.decrypt_many(
+                (token for _, _, token, _, _ in missing),
+                [(site, username) for site, username, *_ in missing])
+            fresh = []
+            for (site, username, _, fingerprint, _), password in zip(missing, passwords):
+                result = estimator.estimate(password.decode())
+                results[(site, username)] = result
+                if fingerprint is not None:
+                    fresh.append((fingerprint, result))
+            db_manager.save_strength(fresh)
+            scored += len(missing)
+        for site, username, _, _, cached in batch:
+            score, guesses_log10, pattern = cached or results[(site, username)]
+            checked += 1
+            scores[score] += 1
+            if score <= max_score:
+                findings.append({'site': site, 'username': username, 'score': score,
+                                 'guesses_log10': guesses_log10, 'pattern': pattern})
+    db_manager.prune_strength_cache()
+    elapsed = time.perf_counter() - start
+    return {'checked': checked, 'scored': scored, 'cached': checked - scored,
+            'weak': len(findings), 'scores': {str(score): count for score, count in enumerate(scores)},
+            'seconds': round(elapsed, 3),
+            'checks_per_sec': round(checked / elapsed) if elapsed else checked,
+            'findings': findings}
+
+
+if __name__ == '__main__':
+    print(f"Compiled {build_wordlists()} words into {WORDLISTS_FILE}")
@@ -0,0 +1,508 @@
+"""Encrypted vault backups.
+
+An archive is a fixed header followed by AES-GCM frames. The plaintext
+stream is a zlib-compressed tar holding manifest.json first, then either
+a consistent copy of the database (full backup) or changes.jsonl with the
+rows written since the previous backup (incremental), and the key files.
+
+Frames use the STREAM construction: the nonce is a random prefix, a frame
+counter and a last-frame flag, and the header is authenticated with every
+frame, so reordered, dropped or truncated frames fail to decrypt.
+Everything is processed a frame at a time; memory use does not grow with
+the size of the vault.
+"""
+import base64
+import heapq
+import io
+import json
+import os
+import sqlite3
+import struct
+import tarfile
+import tempfile
+import time
+import uuid
+import zlib
+from . import kdf
+from .exceptions import ValidationError, AuthenticationError, DatabaseError, FileOperationError
+from .config import (
+    DATABASE_FILE, MASTER_KEY_FILE, ENCRYPTION_KEY_FILE, KDF_SETTINGS_FILE,
+    BACKUP_PAGES_PER_STEP, BACKUP_FRAME_SIZE, BACKUP_SCRYPT_N, SCRYPT_R, SCRYPT_P,
+    DB_BUSY_TIMEOUT
+)
+from .database.database_manager import (
+    REPLICA_ID, SYNC_PEERS, HISTORY_POLICY, STORAGE_FORMAT, ROTATION_CHECKPOINT,
+    begin_immediate, new_row_id
+)
+from .database.migrations import EPOCH
+
+MAGIC = b'PMBACKUP'
+FORMAT_VERSION = 1
+SALT_LENGTH = 16
+NONCE_PREFIX_LENGTH = 7
+# magic, version, scrypt n, r, p, salt, nonce prefix
+HEADER = struct.Struct(f'>{len(MAGIC)}sBIII{SALT_LENGTH}s{NONCE_PREFIX_LENGTH}s')
+FRAME = struct.Struct('>BI')  # last-frame flag, ciphertext length
+TAG_LENGTH = 16
+
+MANIFEST_MEMBER = 'manifest.json'
+CHANGES_MEMBER = 'changes.jsonl'
+# Row columns that identify and order versions of an entry across replicas
+SYNC_FIELDS = ('uuid', 'version', 'modified', 'origin')
+SYNC_COLUMNS = ', '.join(SYNC_FIELDS)
+VAULT_FILES = (DATABASE_FILE, MASTER_KEY_FILE, ENCRYPTION_KEY_FILE, KDF_SETTINGS_FILE)
+# vault_meta settings an incremental backup carries in full; the other keys
+# (change_seq, last_backup, sync state) describe this copy of the vault
+SETTINGS_META = (HISTORY_POLICY, STORAGE_FORMAT, ROTATION_CHECKPOINT)
+
+def _derive_key(passphrase, n, r, p, salt):
+    return kdf.derive('scrypt', {'n': n, 'r': r, 'p': p}, passphrase.encode(), salt)
+
+def _nonce(prefix, counter, last):
+    return prefix + struct.pack('>I?', counter, last)
+
+
+class EncryptedWriter(io.RawIOBase):
+    """Write-only stream that compresses, then encrypts, into fixed-size frames"""
+
+    def __init__(self, fileobj, passphrase, frame_size=BACKUP_FRAME_SIZE):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        salt = os.urandom(SALT_LENGTH)
+        self._prefix = os.urandom(NONCE_PREFIX_LENGTH)
+        self._header = HEADER.pack(MAGIC, FORMAT_VERSION, BACKUP_SCRYPT_N,
+                                   SCRYPT_R, SCRYPT_P, salt, self._prefix)
+        self._aead = AESGCM(_derive_key(passphrase, BACKUP_SCRYPT_N, SCRYPT_R, SCRYPT_P, salt))
+        self._fileobj = fileobj
+        self._frame_size = frame_size
+        self._compressor = zlib.compressobj(6)
+        self._buffer = bytearray()
+        self._counter = 0
+        fileobj.write(self._header)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += self._compressor.compress(data)
+        while len(self._buffer) > self._frame_size:
+            self._emit(bytes(self._buffer[:self._frame_size]), last=False)
+            del self._buffer[:self._frame_size]
+        return len(data)
+
+    def _emit(self, chunk, last):
+        if self._counter == 0xFFFFFFFF:
+            raise FileOperationError("Backup archive is too large")
+        ciphertext = self._aead.encrypt(_nonce(self._prefix, self._counter, last),
+                                        chunk, self._header)
+        self._fileobj.write(FRAME.pack(last, len(ciphertext)))
+        self._fileobj.write(ciphertext)
+        self._counter += 1
+
+    def close(self):
+        """Flushes the compressor and writes the final frame"""
+        if not self.closed:
+            self._buffer += self._compressor.flush()
+            while len(self._buffer) > self._frame_size:
+                self._emit(bytes(self._buffer[:self._frame_size]), last=False)
+                del self._buffer[:self._frame_size]
+            self._emit(bytes(self._buffer), last=True)
+            self._buffer.clear()
+        super().close()
+
+
+class EncryptedReader(io.RawIOBase):
+    """Read-only stream that authenticates, decrypts and decompresses frames"""
+
+    def __init__(self, fileobj, passphrase):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        header = fileobj.read(HEADER.size)
+        if len(header) != HEADER.size or not header.startswith(MAGIC):
+            raise ValidationError("Not a password manager backup")
+        _, version, n, r, p, salt, self._prefix = HEADER.unpack(header)
+        if version != FORMAT_VERSION:
+            raise ValidationError(f"Unsupported backup format version {version}")
+        self._header = header
+        self._aead = AESGCM(_derive_key(passphrase, n, r, p, salt))
+        self._fileobj = fileobj
+        self._decompressor = zlib.decompressobj()
+        self._compressed = b''
+        self._counter = 0
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def _next_frame(self):
+        from cryptography.exceptions import InvalidTag
+        frame = self._fileobj.read(FRAME.size)
+        if len(frame) != FRAME.size:
+            raise ValidationError("Backup archive is truncated")
+        last, length = FRAME.unpack(frame)
+        ciphertext = self._fileobj.read(length)
+        if len(ciphertext) != length or length < TAG_LENGTH:
+            raise ValidationError("Backup archive is truncated")
+        try:
+            chunk = self._aead.decrypt(_nonce(self._prefix, self._counter, bool(last)),
+                                       ciphertext, self._header)
+        except InvalidTag:
+            if self._counter == 0:
+                raise AuthenticationError("Wrong passphrase or corrupted backup")
+            raise ValidationError("Backup archive is corrupted")
+        self._counter += 1
+        if last:
+            if self._fileobj.read(1):
+                raise ValidationError("Unexpected data after the end of the backup")
+            self._done = True
+        return chunk
+
+    def readinto(self, buffer):
+        # Decompresses at most len(buffer) bytes at a time so a highly
+        # compressible frame cannot expand into a large allocation
+        while len(buffer):
+            if self._compressed:
+                data = self._decompressor.decompress(self._compressed, len(buffer))
+                self._compressed = self._decompressor.unconsumed_tail
+                if data:
+                    buffer[:len(data)] = data
+                    return len(data)
+            elif self._done:
+                if not self._decompressor.eof:
+                    raise ValidationError("Backup archive is truncated")
+                break
+            else:
+                self._compressed = self._next_frame()
+        return 0
+
+
+def _change_seq(c):
+    c.execute("SELECT value FROM vault_meta WHERE key = 'change_seq'")
+    return c.fetchone()[0]
+
+def _meta(c, key):
+    c.execute("SELECT value FROM vault_meta WHERE key = ?", (key,))
+    row = c.fetchone()
+    return json.loads(row[0]) if row else None
+
+def _set_meta(c, key, value):
+    c.execute("INSERT INTO vault_meta (key, value) VALUES (?, ?) "
+              "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+              (key, json.dumps(value)))
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o600
+    tar.addfile(info, io.BytesIO(data))
+
+def _add_file(tar, name, path):
+    info = tar.gettarinfo(path, arcname=name)
+    info.mode = 0o600
+    info.uid = info.gid = 0
+    info.uname = info.gname = ''
+    with open(path, 'rb') as f:
+        tar.addfile(info, f)
+
+def _snapshot(db_name, path):
+    """Copies the live database to path with the online backup API
+
+    The copy runs BACKUP_PAGES_PER_STEP pages at a time, releasing the
+    source between steps so the vault stays usable; SQLite restarts the
+    copy if another connection writes meanwhile, so the result is always
+    a consistent snapshot. Returns the snapshot's change sequence.
+    """
+    source = sqlite3.connect(db_name)
+    target = sqlite3.connect(path)
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP)
+        return _change_seq(target.cursor())
+    finally:
+        target.close()
+        source.close()
+
+def _dump_changes(db_name, since, path):
+    """Writes every row changed after since to path; returns the new sequence
+
+    Rows, tombstones and deletions are written in one change_seq order.
+    Row ids are reused after a delete, so a deletion must be replayed
+    before the newer row that took its id, never after it. Retention
+    policies and vault settings are not change-tracked, so they follow
+    in full; both are a handful of rows.
+    """
+    b64 = lambda data: base64.b64encode(data if isinstance(data, bytes) else data.encode()).decode()
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    try:
+        c = conn.cursor()
+        c.execute("BEGIN")  # one read snapshot for the whole dump
+        change_seq = _change_seq(c)
+
+        def records(query, record):
+            cursor = conn.execute(query, (since,))
+            return ((row[0], record(*row[1:])) for row in cursor)
+
+        streams = (
+            records(f"""SELECT change_seq, id, site, username, password, description, vclock,
+                               {SYNC_COLUMNS}
+                        FROM passwords WHERE change_seq > ? ORDER BY change_seq""",
+                    lambda row_id, site, username, password, description, vclock, *sync: {
+                        'table': 'passwords', 'id': row_id, 'site': site, 'username': username,
+                        'password': b64(password), 'description': description, 'vclock': vclock,
+                        **dict(zip(SYNC_FIELDS, sync))}),
+            records(f"""SELECT change_seq, id, site, username, old_password, changed_date, {SYNC_COLUMNS}
+                        FROM password_history WHERE change_seq > ? ORDER BY change_seq""",
+                    lambda row_id, site, username, old_password, changed_date, *sync: {
+                        'table': 'password_history', 'id': row_id, 'site': site,
+                        'username': username, 'password': b64(old_password),
+                        'changed_date': changed_date, **dict(zip(SYNC_FIELDS, sync))}),
+            records("""SELECT change_seq, uuid, site, username, version, modified, origin, change_seq
+                       FROM tombstones WHERE change_seq > ? ORDER BY change_seq""",
+                    lambda row_uuid, site, username, version, modified, origin, seq: {
+                        'table': 'tombstones', 'uuid': row_uuid, 'site': site,
+                        'username': username, 'version': version, 'modified': modified,
+                        'origin': origin, 'change_seq': seq}),
+            records("""SELECT change_seq, table_name, row_id FROM deleted_rows
+                       WHERE change_seq > ? ORDER BY change_seq""",
+                    lambda table, row_id: {'table': table, 'id': row_id, 'deleted': True}),
+        )
+        with open(path, 'w', encoding='utf-8') as f:
+            for _, record in heapq.merge(*streams, key=lambda item: item[0]):
+                json.dump(record, f)
+                f.write('\n')
+            c.execute("SELECT site, username, keep_last, max_age_days FROM history_policies")
+            json.dump({'table': 'history_policies', 'rows': c.fetchall()}, f)
+            f.write('\n')
+            c.execute(f"""SELECT key, value FROM vault_meta
+                          WHERE key IN ({', '.join('?' * len(SETTINGS_META))})""", SETTINGS_META)
+            json.dump({'table': 'vault_meta',
+                       'settings': {key: json.loads(value) for key, value in c.fetchall()}}, f)
+            f.write('\n')
+        c.execute("COMMIT")
+        return change_seq
+    finally:
+        conn.close()
+
+def create_backup(db_manager, path, passphrase, incremental=False, key_files=None):
+    """Writes an encrypted archive of the vault behind db_manager to path
+
+    key_files lists the key and settings files to bundle; missing ones are
+    skipped. An incremental backup carries only the rows changed since the
+    previous backup of this vault and must be restored on top of it.
+    Returns the manifest.
+    """
+    if key_files is None:
+        key_files = [MASTER_KEY_FILE, ENCRYPTION_KEY_FILE, KDF_SETTINGS_FILE]
+    # The archive is read from the file, which an in-memory vault may not have caught up
+    db_manager.flush()
+    previous = db_manager.get_meta('last_backup')
+    if incremental and previous is None:
+        raise ValidationError("No previous backup of this vault; run a full backup first")
+
+    manifest = {'id': uuid.uuid4().hex, 'created': time.time(),
+                'type': 'incremental' if incremental else 'full'}
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.backup-', dir=directory)
+    os.close(fd)
+    try:
+        if incremental:
+            manifest['parent'] = previous['id']
+            manifest['since'] = previous['change_seq']
+            manifest['change_seq'] = _dump_changes(db_manager.db_name, previous['change_seq'], temp_path)
+        else:
+            manifest['change_seq'] = _snapshot(db_manager.db_name, temp_path)
+
+        archive_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(archive_fd, 'wb') as f, EncryptedWriter(f, passphrase) as stream:
+            with tarfile.open(fileobj=stream, mode='w|') as tar:
+                _add_bytes(tar, MANIFEST_MEMBER, json.dumps(manifest).encode())
+                _add_file(tar, CHANGES_MEMBER if incremental else DATABASE_FILE, temp_path)
+                for key_file in key_files:
+                    if os.path.exists(key_file):
+                        _add_file(tar, os.path.basename(key_file), key_file)
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to back up the database: {e}")
+    except OSError as e:
+        raise FileOperationError(f"Failed to write backup: {e}")
+    finally:
+        os.remove(temp_path)
+
+    db_manager.set_meta('last_backup', {'id': manifest['id'], 'change_seq': manifest['change_seq']})
+    return manifest
+
+def _apply_changes(c, lines):
+    """Replays changes.jsonl rows onto an open transaction"""
+    for line in lines:
+        change = json.loads(line)
+        table = change['table']
+        if table == 'tombstones':
+            c.execute("""INSERT OR REPLACE INTO tombstones
+                         (uuid, site, username, version, modified, origin, change_seq)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                      (change['uuid'], change['site'], change['username'], change['version'],
+                       change['modified'], change['origin'], change['change_seq']))
+            continue
+        if table == 'history_policies':
+            c.execute("DELETE FROM history_policies")
+            c.executemany("""INSERT INTO history_policies (site, username, keep_last, max_age_days)
+                             VALUES (?, ?, ?, ?)""", change['rows'])
+            continue
+        if table == 'vault_meta':
+            # Settings missing from the backup were cleared after the parent
+            for key in SETTINGS_META:
+                if key in change['settings']:
+                    _set_meta(c, key, change['settings'][key])
+                else:
+                    c.execute("DELETE FROM vault_meta WHERE key = ?", (key,))
+            continue
+        if table not in ('passwords', 'password_history'):
+            raise ValidationError(f"Unexpected table in backup: {table}")
+        row_id = change['id']
+        if change.get('deleted'):
+            c.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+            continue
+        password = base64.b64decode(change['password'])
+        # Backups made before sync have no row ids; the restored rows get new ones
+        sync = (change.get('uuid') or new_row_id(), change.get('version', 1),
+                change.get('modified', EPOCH), change.get('origin', ''))
+        if table == 'passwords':
+            # Deleting first (rather than INSERT OR REPLACE) fires the
+            # delete triggers that keep the search index in step
+            c.execute("DELETE FROM passwords WHERE id = ? OR (site = ? AND username = ?)",
+                      (row_id, change['site'], change['username']))
+            c.execute(f"""INSERT INTO passwords
+                          (id, site, username, password, description, vclock, {SYNC_COLUMNS})
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                      (row_id, change['site'], change['username'], password, change['description'],
+                       change.get('vclock', '{}'), *sync))
+        else:
+            c.execute("DELETE FROM password_history WHERE id = ?", (row_id,))
+            c.execute(f"""INSERT INTO password_history
+                          (id, site, username, old_password, changed_date, {SYNC_COLUMNS})
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                      (row_id, change['site'], change['username'], password, change['changed_date'],
+                       *sync))
+
+def restore_backup(path, passphrase, target_dir='.', force=False):
+    """Restores an archive made by create_backup into target_dir
+
+    A full backup replaces the vault files and refuses to overwrite an
+    existing vault unless force is set. An incremental backup is applied
+    to the vault restored from its parent backup. Returns the manifest.
+    """
+    db_path = os.path.join(target_dir, DATABASE_FILE)
+    staged = {}
+    try:
+        os.makedirs(target_dir, exist_ok=True)
+        with open(path, 'rb') as f, EncryptedReader(f, passphrase) as stream:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                member = tar.next()
+                if member is None or member.name != MANIFEST_MEMBER:
+                    raise ValidationError("Backup archive has no manifest")
+                manifest = json.load(tar.extractfile(member))
+                incremental = manifest['type'] == 'incremental'
+                if incremental:
+                    _check_parent(db_path, manifest)
+                elif not force and any(os.path.exists(os.path.join(target_dir, name))
+                                       for name in VAULT_FILES):
+                    raise ValidationError(f"A vault already exists in {target_dir}; use --force to replace it")
+
+                allowed = VAULT_FILES + (CHANGES_MEMBER,) if incremental else VAULT_FILES
+                while True:
+                    member = tar.next()
+                    if member is None:
+                        break
+                    if not member.isfile() or member.name not in allowed:
+                        raise ValidationError(f"Unexpected file in backup: {member.name}")
+                    staged[member.name] = _stage(tar.extractfile(member), target_dir)
+            # Read to the final frame so truncation is caught before anything is replaced
+            while stream.read(BACKUP_FRAME_SIZE):
+                pass
+
+        if incremental:
+            if CHANGES_MEMBER not in staged:
+                raise ValidationError("Incremental backup has no changes")
+            _apply_incremental(db_path, staged.pop(CHANGES_MEMBER), manifest)
+        elif DATABASE_FILE not in staged:
+            raise ValidationError("Backup archive has no database")
+        else:
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+            _record_restore(staged[DATABASE_FILE], manifest)
+
+        for name, temp_path in staged.items():
+            os.replace(temp_path, os.path.join(target_dir, name))
+        staged.clear()
+    except (OSError, tarfile.TarError, zlib.error) as e:
+        raise FileOperationError(f"Failed to restore backup: {e}")
+    finally:
+        for temp_path in staged.values():
+            os.remove(temp_path)
+    return manifest
+
+def _stage(source, target_dir):
+    """Copies an archive member to a private temporary file in target_dir"""
+    fd, temp_path = tempfile.mkstemp(prefix='.restore-', dir=target_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = source.read(BACKUP_FRAME_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+def _check_parent(db_path, manifest):
+    if not os.path.exists(db_path):
+        raise ValidationError("Restore the full backup before applying incremental ones")
+    conn = sqlite3.connect(db_path)
+    try:
+        restored = _meta(conn.cursor(), 'last_backup')
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to read backup state: {e}")
+    finally:
+        conn.close()
+    if restored is None or restored['id'] != manifest['parent']:
+        raise ValidationError("This incremental backup does not follow the last restored backup")
+
+def _apply_incremental(db_path, changes_path, manifest):
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=DB_BUSY_TIMEOUT)
+    try:
+        c = conn.cursor()
+        begin_immediate(c)
+        try:
+            with open(changes_path, encoding='utf-8') as f:
+                _apply_changes(c, f)
+            _set_meta(c, 'last_backup', {'id': manifest['id'], 'change_seq': manifest['change_seq']})
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to apply incremental backup: {e}")
+    finally:
+        conn.close()
+        os.remove(changes_path)
+
+def _record_restore(db_path, manifest):
+    """Marks the restored database so its incremental backups can follow
+
+    The restored vault also becomes a new sync replica (see
+    sync.new_replica), since the vault it was backed up from may still
+    be in use.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=DB_BUSY_TIMEOUT)
+    try:
+        with conn:
+            c = conn.cursor()
+            _set_meta(c, 'last_backup', {'id': manifest['id'], 'change_seq': manifest['change_seq']})
+            # Vaults older than migration 6 get an id when they are opened
+            c.execute("UPDATE vault_meta SET value = ? WHERE key = ?",
+                      (json.dumps(uuid.uuid4().hex), REPLICA_ID))
+            c.execute("DELETE FROM vault_meta WHERE key = ?", (SYNC_PEERS,))
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to read the restored database: {e}")
+    finally:
+        conn.close()
@@ -1,11 +1,113 @@
+import os
+
 # File names
 MASTER_KEY_FILE = '.master.key'
 ENCRYPTION_KEY_FILE = '.encryption.key'
 DATABASE_FILE = '.passwords.db'
 
+# Named vaults (--vault NAME) live in subdirectories of VAULT_DIR, each
+# with its own copies of the files above; without a name the vault in
+# the working directory is used
+VAULT_DIR = '.vaults'
+# Cross-vault queries: pages read at once across all vaults, and pages
+# each vault may read ahead of the merged stream
+VAULT_QUERY_WORKERS = 4
+VAULT_QUERY_PREFETCH = 2
+
 # Security settings
 MIN_PASSWORD_LENGTH = 8
 MAX_DESCRIPTION_LENGTH = 500
 MAX_LOGIN_ATTEMPTS = 3
 HASH_ITERATIONS = 100000
-DB_TIMEOUT = 30 
\ No newline at end of file
+
+# Master password KDF ('pbkdf2-sha256' or 'scrypt'); calibration overrides
+# these defaults through KDF_SETTINGS_FILE, kept next to each vault's database
+KDF_ALGORITHM = 'pbkdf2-sha256'
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+KDF_TARGET_MS = 250
+KDF_SETTINGS_FILE = '.kdf.json'
+
+# Database tuning
+DB_CACHED_STATEMENTS = 128
+DB_CACHE_SIZE_KB = 8192
+DB_MMAP_SIZE = 64 * 1024 * 1024
+
+# Write concurrency: writers take the write lock up front (BEGIN IMMEDIATE),
+# waiting up to DB_BUSY_TIMEOUT seconds in SQLite's busy handler; a database
+# still busy after that is retried DB_WRITE_RETRIES times with jittered
+# exponential backoff starting at DB_RETRY_BACKOFF seconds
+DB_BUSY_TIMEOUT = 2
+DB_WRITE_RETRIES = 5
+DB_RETRY_BACKOFF = 0.01
+DB_RETRY_BACKOFF_MAX = 1.0
+
+# In-memory mode (--in-memory): seconds between writes of the memory copy
+# to the database file; 0 writes every transaction through as it commits
+MEMORY_FLUSH_INTERVAL = 0
+
+# Group commit (WriteQueue): writes per transaction, and how long the
+# first write of a group waits for company (0 takes only the writes that
+# queued up while the previous group was committing)
+WRITE_QUEUE_BATCH = 64
+WRITE_QUEUE_DELAY = 0
+
+# Import settings
+IMPORT_BATCH_SIZE = 1000
+
+# Rows re-encrypted per transaction during key rotation
+ROTATION_BATCH_SIZE = 1000
+
+# History rows deleted per transaction by compact
+PRUNE_BATCH_SIZE = 1000
+
+# Rows converted per transaction by migrate-format
+FORMAT_BATCH_SIZE = 1000
+
+# Listing settings
+PAGE_SIZE = 20
+READ_BATCH_SIZE = 500
+
+# Batch encryption settings (CRYPTO_WORKERS = None uses every core)
+CRYPTO_WORKERS = None
+CRYPTO_MIN_PARALLEL = 2000
+CRYPTO_MIN_CHUNK = 256
+
+# Search settings
+SEARCH_LIMIT = 50
+FUZZY_MIN_SCORE = 0.6
+FUZZY_CANDIDATES = 500
+
+# Decrypted entry cache (ENTRY_CACHE_SIZE = 0 disables it)
+ENTRY_CACHE_SIZE = 0
+ENTRY_CACHE_TTL = 300
+
+# Agent settings (None places the socket in a private per-user runtime directory)
+AGENT_SOCKET = None
+AGENT_IDLE_TIMEOUT = 900
+AGENT_CACHE_SIZE = 1024
+AGENT_MAX_FRAME = 1024 * 1024
+
+# asyncio front end
+ASYNC_MAX_CONCURRENCY = 4
+
+# Backup settings (pages copied per online backup step, plaintext bytes per
+# encrypted frame, scrypt cost for the archive key)
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_FRAME_SIZE = 64 * 1024
+BACKUP_SCRYPT_N = 2 ** 15
+
+# Instrumentation (enabled with --profile or --slow-ms); operations at or
+# over SLOW_OPERATION_MS are appended to SLOW_OPERATION_LOG, which lives in
+# the per-user state directory rather than next to the vault
+SLOW_OPERATION_MS = 250
+SLOW_OPERATION_LOG = os.path.join(
+    os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state'),
+    'password-manager', 'slow_operations.log')
+
+# Breach audit (Bloom filter bits per corpus entry, about 1% false
+# positives at 10; records sorted in memory at a time when converting an
+# unsorted dump)
+BLOOM_BITS_PER_ENTRY = 10
+CORPUS_SORT_CHUNK = 4000000
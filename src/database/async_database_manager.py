@@ -0,0 +1,112 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from ..config import DATABASE_FILE, PAGE_SIZE, READ_BATCH_SIZE, SEARCH_LIMIT, ASYNC_MAX_CONCURRENCY
+from .database_manager import DatabaseManager
+
+class AsyncDatabaseManager:
+    """asyncio front end for DatabaseManager
+
+    Every call runs on a dedicated thread pool so SQLite I/O and Fernet work
+    never block the event loop. At most max_concurrency calls are in flight.
+    Each call is a complete DatabaseManager operation, so cancelling the
+    awaiting task never leaves a transaction half-applied: the worker runs
+    it to commit or rollback and only then frees its slot.
+    """
+
+    def __init__(self, db_manager, max_concurrency=ASYNC_MAX_CONCURRENCY):
+        self.db_manager = db_manager
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='vault-db')
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @classmethod
+    async def open(cls, cipher_suite, db_name=DATABASE_FILE, key=None,
+                   max_concurrency=ASYNC_MAX_CONCURRENCY, **options):
+        """Opens (and if needed migrates) the database without blocking the loop"""
+        loop = asyncio.get_running_loop()
+        db_manager = await loop.run_in_executor(
+            None, partial(DatabaseManager, cipher_suite, db_name, key, **options)
+        )
+        return cls(db_manager, max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _run(self, function, *args, **kwargs):
+        await self._semaphore.acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(function, *args, **kwargs)
+            )
+        except BaseException:
+            self._semaphore.release()
+            raise
+        future.add_done_callback(self._release)
+        # shield keeps the worker's result (or error) owned by the future even
+        # if the caller is cancelled while the transaction is still running
+        return await asyncio.shield(future)
+
+    def _release(self, future):
+        self._semaphore.release()
+        if not future.cancelled():
+            future.exception()  # marks the error as retrieved after a cancel
+
+    async def add_password(self, site, username, password, description=''):
+        return await self._run(self.db_manager.add_password, site, username, password, description)
+
+    async def add_passwords_bulk(self, entries, on_duplicate='skip', **kwargs):
+        return await self._run(self.db_manager.add_passwords_bulk, entries, on_duplicate, **kwargs)
+
+    async def get_password(self, site, username):
+        return await self._run(self.db_manager.get_password, site, username)
+
+    async def get_passwords(self):
+        return await self._run(self.db_manager.get_passwords)
+
+    async def get_passwords_page(self, limit=PAGE_SIZE, after=None, decrypt=False):
+        return await self._run(self.db_manager.get_passwords_page, limit, after, decrypt)
+
+    async def iter_passwords(self, batch_size=READ_BATCH_SIZE, decrypt=False):
+        """Async iterator over every entry, fetching one page per worker call"""
+        after = None
+        while True:
+            page = await self.get_passwords_page(batch_size, after, decrypt)
+            for entry in page:
+                yield entry
+            if len(page) < batch_size:
+                return
+            after = page[-1].key
+
+    async def count_passwords(self):
+        return await self._run(self.db_manager.count_passwords)
+
+    async def search_passwords(self, query, mode='substring', limit=SEARCH_LIMIT):
+        return await self._run(self.db_manager.search_passwords, query, mode, limit)
+
+    async def update_password(self, site, username, new_password):
+        return await self._run(self.db_manager.update_password, site, username, new_password)
+
+    async def get_password_history(self, site, username, limit=None):
+        return await self._run(self.db_manager.get_password_history, site, username, limit)
+
+    async def update_username(self, site, old_username, new_username):
+        return await self._run(self.db_manager.update_username, site, old_username, new_username)
+
+    async def update_description(self, site, username, new_description):
+        return await self._run(self.db_manager.update_description, site, username, new_description)
+
+    async def compact(self, **kwargs):
+        return await self._run(self.db_manager.compact, **kwargs)
+
+    async def delete_password(self, site, username):
+        return await self._run(self.db_manager.delete_password, site, username)
+
+    async def close(self):
+        """Waits for in-flight operations, then closes the database"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+        await loop.run_in_executor(None, self.db_manager.close)
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+def _wipe(buffer):
+    """Overwrites a plaintext buffer in place"""
+    buffer[:] = bytes(len(buffer))
+
+class EntryCache:
+    """LRU cache of decrypted passwords keyed by (site, username)
+
+    Entries expire after ttl seconds without being read. Plaintexts are held
+    in bytearrays and zeroed when they leave the cache; the str handed back
+    to callers is a copy Python gives no way to wipe.
+    """
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        # Least recently used entries sit at the front, so stop at the first live one
+        while self._entries:
+            key, (buffer, last_used) = next(iter(self._entries.items()))
+            if now - last_used < self.ttl:
+                break
+            del self._entries[key]
+            _wipe(buffer)
+            self.expirations += 1
+
+    def get(self, key):
+        """Returns the cached password for key, or None"""
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries[key] = (item[0], now)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0].decode()
+
+    def put(self, key, password):
+        """Caches a decrypted password, evicting the least recently used entry"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                _wipe(old[0])
+            self._entries[key] = (bytearray(password.encode()), now)
+            while len(self._entries) > self.max_size:
+                _, (buffer, _) = self._entries.popitem(last=False)
+                _wipe(buffer)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Drops one entry"""
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is not None:
+                _wipe(item[0])
+
+    def clear(self):
+        """Drops and wipes every entry"""
+        with self._lock:
+            for buffer, _ in self._entries.values():
+                _wipe(buffer)
+            self._entries.clear()
+
+    def stats(self):
+        """Returns hit/miss counters for tuning max_size and ttl"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -1,38 +1,285 @@
+import json
+import random
 import sqlite3
-from datetime import datetime
-from ..exceptions import DatabaseError
-from ..config import DATABASE_FILE, DB_TIMEOUT
+import threading
+import time
+import uuid
+from itertools import islice
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from ..exceptions import DatabaseError, ValidationError
+from ..config import (
+    DATABASE_FILE, DB_BUSY_TIMEOUT, DB_CACHED_STATEMENTS,
+    DB_CACHE_SIZE_KB, DB_MMAP_SIZE, IMPORT_BATCH_SIZE,
+    PAGE_SIZE, READ_BATCH_SIZE, SEARCH_LIMIT, ENTRY_CACHE_SIZE, ENTRY_CACHE_TTL,
+    ROTATION_BATCH_SIZE, PRUNE_BATCH_SIZE, FORMAT_BATCH_SIZE, MEMORY_FLUSH_INTERVAL,
+    DB_WRITE_RETRIES, DB_RETRY_BACKOFF, DB_RETRY_BACKOFF_MAX
+)
 from ..utils import sanitize_input, make_file_hidden
-from ..encryption import Encryption
+from ..encryption import Encryption, BatchCipher, RecordCipher, RECORD_VERSION
+from .migrations import migrate
+from .entry import PasswordEntry
+from .cache import EntryCache
+
+# vault_meta key holding the last re-encrypted id per table
+ROTATION_CHECKPOINT = 'key_rotation'
+# vault_meta key holding the vault-wide history retention policy
+HISTORY_POLICY = 'history_policy'
+# vault_meta key holding the format new password values are written in
+STORAGE_FORMAT = 'storage_format'
+# vault_meta key holding this replica's id, recorded as the origin of its writes
+REPLICA_ID = 'replica_id'
+# vault_meta key holding the sync checkpoints of each named peer
+SYNC_PEERS = 'sync_peers'
+# Counts one more edit by the replica passed (twice) as a parameter in a
+# row's version vector, which sync uses to tell descendants from conflicts
+VCLOCK_BUMP = """vclock = json_set(vclock, '$."' || ? || '"',
+                            COALESCE(json_extract(vclock, '$."' || ? || '"'), 0) + 1)"""
+# Associated data binding a cached strength result to its fingerprint
+STRENGTH_IDENTITY = 'strength'
+
+# History rows outside their account's policy (or the vault policy for
+# accounts without one); a NULL limit never matches
+_PRUNABLE_HISTORY = """
+    SELECT h.id FROM (
+        SELECT id, site, username, changed_date,
+               ROW_NUMBER() OVER (PARTITION BY site, username
+                                  ORDER BY changed_date DESC, id DESC) AS position
+        FROM password_history) h
+    LEFT JOIN history_policies p ON p.site = h.site AND p.username = h.username
+    WHERE h.position > (CASE WHEN p.site IS NULL THEN :keep_last ELSE p.keep_last END)
+       OR h.changed_date < datetime(:now,
+              '-' || (CASE WHEN p.site IS NULL THEN :max_age_days ELSE p.max_age_days END) || ' days')
+"""
+
+def _database_size(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_size * conn.execute("PRAGMA page_count").fetchone()[0]
+
+def _now():
+    # Bound as a parameter rather than SQL 'now', so a replayed statement
+    # (see memory.WriteThrough) prunes exactly what the original did
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _utcnow():
+    # Modification times are compared across replicas, so they are UTC
+    return datetime.now(timezone.utc).isoformat(timespec='microseconds')
+
+def new_row_id():
+    """Returns a new stable row id, the key rows are matched by across replicas"""
+    return uuid.uuid4().hex
+
+def _distinct_rounds(rows):
+    """Splits rows into consecutive rounds in which each account appears once
+
+    Later rows for an account go to later rounds, so applying the rounds in
+    order gives the same result as applying the rows one at a time.
+    """
+    while rows:
+        seen = set()
+        current, later = [], []
+        for row in rows:
+            account = (row[0], row[1])
+            (later if account in seen else current).append(row)
+            seen.add(account)
+        yield current
+        rows = later
+
+def _is_busy(error):
+    return getattr(error, 'sqlite_errorcode', None) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+def begin_immediate(cursor, retries=DB_WRITE_RETRIES):
+    """Starts a write transaction, retrying a busy database with backoff
+
+    Taking the write lock up front means no statement inside the
+    transaction can fail on a lock upgrade half way through. Each attempt
+    already waits out the connection's busy timeout; the jittered backoff
+    between attempts keeps competing processes from retrying in lockstep.
+    Returns the number of retries needed.
+    """
+    for attempt in range(retries + 1):
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            return attempt
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt == retries:
+                raise
+            time.sleep(random.uniform(0, min(DB_RETRY_BACKOFF_MAX, DB_RETRY_BACKOFF * 2 ** attempt)))
 
 class DatabaseManager:
-    def __init__(self, cipher_suite):
-        self.db_name = DATABASE_FILE
-        self.cipher_suite = cipher_suite
-        self._init_database()
+    def __init__(self, cipher_suite, db_name=DATABASE_FILE, key=None,
+                 cache_size=ENTRY_CACHE_SIZE, cache_ttl=ENTRY_CACHE_TTL,
+                 in_memory=False, flush_interval=MEMORY_FLUSH_INTERVAL):
+        self.db_name = db_name
+        self.cache = EntryCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self._data_version = None
+        self._lock = threading.RLock()
+        self._depth = 0
+        self.busy_retries = 0
+        self.batch_cipher = None
+        self._write_through = None
+        self._log = None
+        self.conn = self._connect()
+        created = self._init_database()
+        self.replica_id = self.get_meta(REPLICA_ID)
+        # New vaults store compact records; older ones keep Fernet tokens until migrate_format
+        if created and key is not None:
+            self.set_meta(STORAGE_FORMAT, 'aead')
+        self.set_cipher(cipher_suite, key)
         self._make_db_hidden()
+        self.backfill_fingerprints()
+        if in_memory:
+            self._load_into_memory(flush_interval)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self):
+        """Opens the long-lived connection and applies performance pragmas"""
+        try:
+            # isolation_level=None lets _transaction() issue BEGIN/COMMIT itself
+            conn = sqlite3.connect(
+                self.db_name,
+                timeout=DB_BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=DB_CACHED_STATEMENTS
+            )
+            # Only takes effect on a new database; compact converts old ones
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+            conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+            return conn
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Failed to open database: {e}")
+
+    def _load_into_memory(self, flush_interval):
+        """Serves reads from a :memory: copy; writes go through to the file (see memory.py)"""
+        from . import memory
+        with self._lock:
+            disk = self.conn
+            self.conn = memory.load(disk)
+            self._write_through = memory.WriteThrough(disk, flush_interval)
+
+    def flush(self):
+        """Writes pending in-memory changes to the database file"""
+        if self._write_through is not None:
+            self._write_through.flush()
+
+    def close(self):
+        """Closes the database connection"""
+        if self.batch_cipher is not None:
+            self.batch_cipher.close()
+        if self.cache is not None:
+            self.cache.clear()
+        with self._lock:
+            if self.conn is None:
+                return
+            if self._write_through is not None:
+                try:
+                    self._write_through.close()
+                finally:
+                    self._write_through = None
+                    self.conn.close()
+                    self.conn = None
+                return
+            try:
+                self.conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+            self.conn.close()
+            self.conn = None
+
+    @contextmanager
+    def _transaction(self):
+        """Runs the enclosed statements in a single write transaction
+
+        The transaction starts with BEGIN IMMEDIATE (see begin_immediate).
+        A nested call runs in a savepoint of the enclosing transaction, so
+        its statements can fail and roll back without aborting the rest.
+        In memory mode the statements are logged and written through to
+        the file when the outermost transaction commits.
+        """
+        with self._lock:
+            if self.conn is None:
+                raise DatabaseError("Database connection is closed")
+            raw = cursor = self.conn.cursor()
+            savepoint = f"nested_{self._depth}" if self._depth else None
+            try:
+                if savepoint:
+                    raw.execute(f"SAVEPOINT {savepoint}")
+                else:
+                    self.busy_retries += begin_immediate(raw)
+            except sqlite3.Error as e:
+                raise DatabaseError(f"Database is busy: {e}" if _is_busy(e)
+                                    else f"Database operation failed: {e}")
+            mark = None
+            if self._write_through is not None:
+                if not savepoint:
+                    self._log = []
+                mark = len(self._log)
+                cursor = self._write_through.record(raw, self._log)
+            self._depth += 1
+            try:
+                yield cursor
+                if savepoint:
+                    raw.execute(f"RELEASE {savepoint}")
+                elif self._write_through is not None:
+                    self._write_through.commit(self._log, self.conn.commit)
+                else:
+                    self.conn.commit()
+            except sqlite3.Error as e:
+                self._rollback(raw, savepoint, mark)
+                raise DatabaseError(f"Database operation failed: {e}")
+            except BaseException:
+                self._rollback(raw, savepoint, mark)
+                raise
+            finally:
+                self._depth -= 1
+                if not savepoint:
+                    self._log = None
+
+    def _rollback(self, cursor, savepoint, mark=None):
+        if savepoint:
+            cursor.execute(f"ROLLBACK TO {savepoint}")
+            cursor.execute(f"RELEASE {savepoint}")
+            if mark is not None:
+                # Nothing the savepoint ran is left to replay
+                del self._log[mark:]
+        else:
+            self.conn.rollback()
+
+    def _fetchall(self, query, params=()):
+        """Runs a read query on the shared connection"""
+        with self._lock:
+            if self.conn is None:
+                raise DatabaseError("Database connection is closed")
+            try:
+                return self.conn.execute(query, params).fetchall()
+            except sqlite3.Error as e:
+                raise DatabaseError(f"Database operation failed: {e}")
 
     def _init_database(self):
-        """Initializes the database"""
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        
-        # Main passwords table with description field
-        c.execute('''CREATE TABLE IF NOT EXISTS passwords
-                    (site TEXT, 
-                     username TEXT, 
-                     password TEXT,
-                     description TEXT DEFAULT '')''')
-        
-        # Password history table
-        c.execute('''CREATE TABLE IF NOT EXISTS password_history
-                    (site TEXT, 
-                     username TEXT, 
-                     old_password TEXT,
-                     changed_date TEXT)''')
-        
-        conn.commit()
-        conn.close()
+        """Initializes the database and upgrades its schema if needed
+
+        Returns whether the database was created from scratch. A vault
+        from before schema versions also reads user_version 0, so this
+        looks for the passwords table instead.
+        """
+        created = not self._fetchall(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='passwords'"
+        )
+        migrate(self._transaction)
+        self._search_indexed = bool(self._fetchall(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='passwords_fts'"
+        ))
+        return created
 
     def _make_db_hidden(self):
         """Makes the database file hidden"""
@@ -44,151 +291,760 @@ class DatabaseManager:
             site = sanitize_input(site)
             username = sanitize_input(username)
             description = sanitize_input(description)
-            
-            encrypted_password = self.cipher_suite.encrypt(password.encode())
-            query = "INSERT INTO passwords VALUES (?, ?, ?, ?)"
-            self._execute_query(query, (site, username, encrypted_password, description))
+
+            encrypted_password = self.cipher.encrypt(password.encode(), (site, username))
+            with self._transaction() as c:
+                c.execute("SELECT 1 FROM passwords WHERE site=? AND username=?",
+                         (site, username))
+                if c.fetchone():
+                    raise DatabaseError(f"An entry for {username} on {site} already exists")
+                c.execute("""INSERT INTO passwords (site, username, password, description,
+                                                   fingerprint, uuid, modified, origin, vclock)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                         (site, username, encrypted_password, description,
+                          self._fingerprint(password), new_row_id(), _utcnow(), self.replica_id,
+                          self._new_vclock()))
             return True
         except Exception as e:
             raise DatabaseError(f"Failed to add password: {e}")
 
+    def add_passwords_bulk(self, entries, on_duplicate='skip', batch_size=IMPORT_BATCH_SIZE):
+        """Adds many (site, username, password, description) entries
+
+        Entries are consumed lazily and written in batches, one transaction
+        per batch. Existing accounts are skipped, or with on_duplicate='merge'
+        updated in place with their previous password moved to history.
+        An account repeated in the input counts as added once; its later
+        rows are skipped or merged like any existing account.
+        Returns a dict with 'added', 'updated' and 'skipped' counts.
+        """
+        if on_duplicate not in ('skip', 'merge'):
+            raise DatabaseError(f"Unknown duplicate policy: {on_duplicate}")
+
+        counts = {'added': 0, 'updated': 0, 'skipped': 0}
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                break
+            accounts = [(sanitize_input(site), sanitize_input(username)) for site, username, _, _ in batch]
+            encrypted = self.batch_cipher.encrypt_many(
+                (password.encode() for _, _, password, _ in batch), accounts
+            )
+            modified = _utcnow()
+            rows = [
+                (site, username, encrypted_password,
+                 sanitize_input(description or ''), self._fingerprint(password),
+                 new_row_id(), modified, self.replica_id, self._new_vclock())
+                for (site, username), (_, _, password, description), encrypted_password
+                in zip(accounts, batch, encrypted)
+            ]
+            # A merge copies current passwords to history before upserting,
+            # so an account repeated within one statement would be counted
+            # as added twice and lose its earlier password
+            rounds = _distinct_rounds(rows) if on_duplicate == 'merge' else [rows]
+            with self._transaction() as c:
+                for round_rows in rounds:
+                    self._write_import_rows(c, round_rows, on_duplicate, modified, counts)
+        return counts
+
+    def _write_import_rows(self, c, rows, on_duplicate, modified, counts):
+        """Inserts one round of import rows, counting what the statements changed"""
+        if on_duplicate == 'merge':
+            current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            c.executemany("""INSERT INTO password_history
+                            (site, username, old_password, changed_date,
+                             uuid, modified, origin)
+                            SELECT site, username, password, ?, ?, ?, ?
+                            FROM passwords WHERE site=? AND username=?""",
+                         ((current_date, new_row_id(), modified, self.replica_id,
+                           site, username) for site, username, *_ in rows))
+            # rowcount sums direct changes only, unlike total_changes
+            # which also counts writes made by the search index triggers
+            updated = c.rowcount
+            c.executemany("""INSERT INTO passwords
+                            (site, username, password, description, fingerprint,
+                             uuid, modified, origin, vclock)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (site, username) DO UPDATE
+                            SET password=excluded.password,
+                                fingerprint=excluded.fingerprint,
+                                version=passwords.version + 1,
+                                vclock=json_set(passwords.vclock,
+                                    '$."' || excluded.origin || '"',
+                                    COALESCE(json_extract(passwords.vclock,
+                                        '$."' || excluded.origin || '"'), 0) + 1),
+                                modified=excluded.modified,
+                                origin=excluded.origin,
+                                description=CASE WHEN excluded.description != ''
+                                                 THEN excluded.description
+                                                 ELSE passwords.description END""",
+                         rows)
+            counts['updated'] += updated
+            counts['added'] += len(rows) - updated
+            if updated:
+                self._invalidate(*((site, username) for site, username, *_ in rows))
+        else:
+            c.executemany("""INSERT OR IGNORE INTO passwords
+                            (site, username, password, description, fingerprint,
+                             uuid, modified, origin, vclock)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+            added = c.rowcount
+            counts['added'] += added
+            counts['skipped'] += len(rows) - added
+
+    def _new_vclock(self):
+        return json.dumps({self.replica_id: 1})
+
+    def _fingerprint(self, password):
+        if self._fingerprint_key is None:
+            return None
+        return Encryption.fingerprint(self._fingerprint_key, password)
+
+    def backfill_fingerprints(self, batch_size=READ_BATCH_SIZE):
+        """Fingerprints rows stored without one, in a single pass by id
+
+        Returns the number of rows updated.
+        """
+        if self._fingerprint_key is None:
+            return 0
+        done, after = 0, 0
+        while True:
+            rows = self._fetchall("""SELECT id, password, site, username FROM passwords
+                        WHERE fingerprint IS NULL AND id > ?
+                        ORDER BY id LIMIT ?""", (after, batch_size))
+            if not rows:
+                break
+            plaintexts = self.batch_cipher.decrypt_many((row[1] for row in rows),
+                                                        [row[2:] for row in rows])
+            with self._transaction() as c:
+                c.executemany("UPDATE passwords SET fingerprint = ? WHERE id = ? AND password = ?",
+                              ((self._fingerprint(plaintext.decode()), row[0], row[1])
+                               for plaintext, row in zip(plaintexts, rows)))
+            done += len(rows)
+            after = rows[-1][0]
+        if done:
+            # Statistics gathered while the column was empty would steer the
+            # planner away from the fingerprint index
+            with self._transaction() as c:
+                c.execute("ANALYZE idx_passwords_fingerprint")
+        return done
+
+    def find_reuse(self, password):
+        """Returns the (site, username) of every account using password
+
+        One indexed lookup on the keyed fingerprint; nothing is decrypted.
+        """
+        fingerprint = self._fingerprint(password)
+        if fingerprint is None:
+            return []
+        return self._fetchall("""SELECT site, username FROM passwords
+                    WHERE fingerprint = ? ORDER BY site, username""", (fingerprint,))
+
+    def find_reused_passwords(self):
+        """Returns groups of (site, username) accounts that share a password"""
+        rows = self._fetchall("""SELECT fingerprint, site, username FROM passwords
+                    WHERE fingerprint IN (SELECT fingerprint FROM passwords
+                                          WHERE fingerprint IS NOT NULL
+                                          GROUP BY fingerprint HAVING COUNT(*) > 1)
+                    ORDER BY fingerprint, site, username""")
+        groups = {}
+        for fingerprint, site, username in rows:
+            groups.setdefault(fingerprint, []).append((site, username))
+        return list(groups.values())
+
+    def iter_strength(self, batch_size=READ_BATCH_SIZE):
+        """Yields batches of current passwords with their cached strength
+
+        Rows are (site, username, encrypted password, fingerprint, result)
+        in id order, where result is the cached (score, guesses_log10,
+        pattern) for the fingerprint, or None if it has not been scored.
+        """
+        after = 0
+        while True:
+            rows = self._fetchall("""SELECT p.id, p.site, p.username, p.password, p.fingerprint,
+                                            s.result
+                        FROM passwords p
+                        LEFT JOIN strength_cache s ON s.fingerprint = p.fingerprint
+                        WHERE p.id > ?
+                        ORDER BY p.id
+                        LIMIT ?""", (after, batch_size))
+            if not rows:
+                return
+            after = rows[-1][0]
+            cached = [row for row in rows if row[5] is not None]
+            results = self.batch_cipher.decrypt_many(
+                (row[5] for row in cached), [(STRENGTH_IDENTITY, row[4].hex()) for row in cached])
+            results = {row[0]: tuple(json.loads(result)) for row, result in zip(cached, results)}
+            yield [(*row[1:5], results.get(row[0])) for row in rows]
+
+    def save_strength(self, results):
+        """Caches (fingerprint, (score, guesses_log10, pattern)) pairs"""
+        results = list(results)
+        if not results:
+            return
+        tokens = self.batch_cipher.encrypt_many(
+            (json.dumps(result).encode() for _, result in results),
+            [(STRENGTH_IDENTITY, fingerprint.hex()) for fingerprint, _ in results])
+        with self._transaction() as c:
+            c.executemany("INSERT OR REPLACE INTO strength_cache (fingerprint, result) VALUES (?, ?)",
+                          ((fingerprint, token) for (fingerprint, _), token in zip(results, tokens)))
+
+    def prune_strength_cache(self):
+        """Drops cached results no current password refers to"""
+        with self._transaction() as c:
+            c.execute("""DELETE FROM strength_cache WHERE fingerprint NOT IN
+                         (SELECT fingerprint FROM passwords WHERE fingerprint IS NOT NULL)""")
+            return c.rowcount
+
+    def clear_strength_cache(self):
+        """Drops every cached strength result"""
+        with self._transaction() as c:
+            c.execute("DELETE FROM strength_cache")
+
+    def get_password(self, site, username):
+        """Returns the decrypted password for one account, or None"""
+        if self.cache is not None:
+            self._drop_stale_cache()
+            password = self.cache.get((site, username))
+            if password is not None:
+                return password
+
+        # Hold the lock so a concurrent update cannot slip in before caching
+        with self._lock:
+            rows = self._fetchall("SELECT password FROM passwords WHERE site=? AND username=?",
+                                  (site, username))
+            if not rows:
+                return None
+            password = self.cipher.decrypt(rows[0][0], (site, username)).decode()
+            if self.cache is not None:
+                self.cache.put((site, username), password)
+        return password
+
+    def _drop_stale_cache(self):
+        """Clears the entry cache if another connection committed since the last check
+
+        data_version only moves for other connections' commits; this one's
+        writes invalidate their own keys.
+        """
+        version = self._fetchall("PRAGMA data_version")[0][0]
+        if version != self._data_version:
+            self.cache.clear()
+            self._data_version = version
+
+    def cache_stats(self):
+        """Returns entry cache counters, or None when caching is disabled"""
+        return self.cache.stats() if self.cache is not None else None
+
+    def _invalidate(self, *keys):
+        """Drops cached plaintexts for the given (site, username) keys"""
+        if self.cache is not None:
+            for key in keys:
+                self.cache.invalidate(key)
+
     def get_passwords(self):
         """Retrieves and decrypts all passwords"""
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute("SELECT site, username, password, description FROM passwords")
-        passwords = c.fetchall()
-        conn.close()
-
-        decrypted_passwords = []
-        for site, username, encrypted_password, description in passwords:
-            decrypted_password = self.cipher_suite.decrypt(encrypted_password).decode()
-            decrypted_passwords.append((site, username, decrypted_password, description))
-        return decrypted_passwords
+        rows = self._fetchall("""SELECT site, username, password, description
+                    FROM passwords
+                    ORDER BY site, username""")
+        passwords = self.batch_cipher.decrypt_many((row[2] for row in rows),
+                                                   [row[:2] for row in rows])
+        return [
+            (site, username, password.decode(), description)
+            for (site, username, _, description), password in zip(rows, passwords)
+        ]
+
+    def get_passwords_page(self, limit=PAGE_SIZE, after=None, decrypt=False):
+        """Returns up to limit entries ordered by site and username
+
+        after is the (site, username) key of the last entry of the previous
+        page. Passwords are not decrypted until they are read, unless
+        decrypt is set, in which case the whole page is decrypted as a batch.
+        """
+        if after is None:
+            rows = self._fetchall("""SELECT id, site, username, password, description
+                        FROM passwords
+                        ORDER BY site, username
+                        LIMIT ?""", (limit,))
+        else:
+            rows = self._fetchall("""SELECT id, site, username, password, description
+                        FROM passwords
+                        WHERE (site, username) > (?, ?)
+                        ORDER BY site, username
+                        LIMIT ?""", (after[0], after[1], limit))
+        if not decrypt:
+            return [PasswordEntry(*row, self.cipher.decrypt) for row in rows]
+
+        passwords = self.batch_cipher.decrypt_many((row[3] for row in rows),
+                                                   [row[1:3] for row in rows])
+        return [
+            PasswordEntry(*row, self.cipher.decrypt, password.decode())
+            for row, password in zip(rows, passwords)
+        ]
+
+    def iter_passwords(self, batch_size=READ_BATCH_SIZE, decrypt=False):
+        """Yields every entry, fetching batch_size rows at a time"""
+        after = None
+        while True:
+            page = self.get_passwords_page(batch_size, after, decrypt)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after = page[-1].key
+
+    def iter_history(self, batch_size=READ_BATCH_SIZE):
+        """Yields (site, username, password, changed_date) for all history
+
+        Rows are read in id order and decrypted batch_size at a time.
+        """
+        after = 0
+        while True:
+            rows = self._fetchall("""SELECT id, site, username, old_password, changed_date
+                        FROM password_history
+                        WHERE id > ?
+                        ORDER BY id
+                        LIMIT ?""", (after, batch_size))
+            passwords = self.batch_cipher.decrypt_many((row[3] for row in rows),
+                                                       [row[1:3] for row in rows])
+            for row, password in zip(rows, passwords):
+                yield row[1], row[2], password.decode(), row[4]
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+    def count_passwords(self):
+        """Returns the number of stored accounts"""
+        return self._fetchall("SELECT COUNT(*) FROM passwords")[0][0]
+
+    def get_meta(self, key, default=None):
+        """Returns a JSON value stored in the vault_meta table"""
+        rows = self._fetchall("SELECT value FROM vault_meta WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def set_meta(self, key, value):
+        """Stores a JSON-serializable value in the vault_meta table"""
+        with self._transaction() as c:
+            self._set_meta(c, key, value)
+
+    def delete_meta(self, key):
+        """Removes a value from the vault_meta table"""
+        with self._transaction() as c:
+            c.execute("DELETE FROM vault_meta WHERE key = ?", (key,))
+
+    def _set_meta(self, c, key, value):
+        c.execute("""INSERT INTO vault_meta (key, value) VALUES (?, ?)
+                     ON CONFLICT (key) DO UPDATE SET value = excluded.value""",
+                  (key, json.dumps(value)))
+
+    def set_cipher(self, cipher_suite, key=None):
+        """Switches to a new cipher suite, e.g. after the key file changes
+
+        New values are written in the vault's storage format; without the
+        raw key only Fernet tokens can be written (and compact records
+        cannot be read).
+        """
+        storage_format = self.get_meta(STORAGE_FORMAT, 'fernet') if key is not None else 'fernet'
+        with self._lock:
+            if self.batch_cipher is not None:
+                self.batch_cipher.close()
+            self.cipher_suite = cipher_suite
+            self._key = key
+            self.cipher = RecordCipher(cipher_suite, key, storage_format)
+            self.batch_cipher = BatchCipher(self.cipher, key)
+            # Without the raw key no fingerprints are written; the next keyed open backfills them
+            self._fingerprint_key = Encryption.derive_subkey(key, 'fingerprint') if key else None
+
+    def migrate_format(self, storage_format='aead', batch_size=FORMAT_BATCH_SIZE, progress=None):
+        """Converts every stored password to storage_format ('aead' or 'fernet')
+
+        The vault switches format first, so new writes already use it; then
+        both tables are walked in id order and rows still in the other
+        format are converted a batch per transaction, with the same
+        compare-and-set as reencrypt_all. Rerunning after an interruption
+        picks up the rows left. Returns the number of rows converted.
+        """
+        RecordCipher(self.cipher_suite, self._key, storage_format)  # validates the format and key
+        self.set_meta(STORAGE_FORMAT, storage_format)
+        self.set_cipher(self.cipher_suite, self._key)
+        done = 0
+        for table, column in (('passwords', 'password'), ('password_history', 'old_password')):
+            after = 0
+            while True:
+                rows = self._fetchall(f"""SELECT id, {column}, site, username FROM {table}
+                                          WHERE id > ? AND (substr({column}, 1, 1) = ?) != ?
+                                          ORDER BY id LIMIT ?""",
+                                      (after, RECORD_VERSION, storage_format == 'aead', batch_size))
+                if not rows:
+                    break
+                after = rows[-1][0]
+                tokens = self.batch_cipher.rotate_many((row[1] for row in rows),
+                                                       [row[2:] for row in rows])
+                with self._transaction() as c:
+                    c.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ? AND {column} = ?",
+                                  ((token, row[0], row[1]) for token, row in zip(tokens, rows)))
+                done += len(rows)
+                if progress is not None:
+                    progress(done)
+        return done
+
+    def storage_stats(self):
+        """Counts stored values per format and their total size in bytes"""
+        stats = {}
+        for table, column in (('passwords', 'password'), ('password_history', 'old_password')):
+            for is_record, count, size in self._fetchall(f"""
+                    SELECT substr({column}, 1, 1) = ?, COUNT(*), COALESCE(SUM(length({column})), 0)
+                    FROM {table} GROUP BY 1""", (RECORD_VERSION,)):
+                entry = stats.setdefault('aead' if is_record else 'fernet', {'rows': 0, 'bytes': 0})
+                entry['rows'] += count
+                entry['bytes'] += size
+        return {'storage_format': self.cipher.storage_format, 'formats': stats}
+
+    def reencrypt_all(self, batch_size=ROTATION_BATCH_SIZE, progress=None):
+        """Re-encrypts every stored password under the primary key
+
+        Requires a MultiFernet cipher suite; values are rewritten in the
+        vault's current storage format. Each table is walked in id
+        order; a batch is read, re-encrypted outside the lock and written
+        back in one transaction together with a checkpoint, so an
+        interrupted run resumes after the last committed batch. A row
+        changed meanwhile is already under the primary key and is left
+        alone. Fingerprints are recomputed with the new key's subkey, so
+        reuse checks only see the whole vault again once the run finishes,
+        and cached strength results, keyed by the old fingerprints, are dropped.
+        progress, if given, is called with the running row count.
+        Returns the number of rows re-encrypted.
+        """
+        checkpoint = self.get_meta(ROTATION_CHECKPOINT, {})
+        done = 0
+        for table, column in (('passwords', 'password'), ('password_history', 'old_password')):
+            after = checkpoint.get(table, 0)
+            while True:
+                rows = self._fetchall(f"""SELECT id, {column}, site, username FROM {table}
+                                          WHERE id > ? ORDER BY id LIMIT ?""", (after, batch_size))
+                if not rows:
+                    break
+                after = rows[-1][0]
+                checkpoint[table] = after
+                accounts = [row[2:] for row in rows]
+                if table == 'passwords':
+                    plaintexts = self.batch_cipher.decrypt_many((row[1] for row in rows), accounts)
+                    tokens = self.batch_cipher.encrypt_many(plaintexts, accounts)
+                    updates = [(token, self._fingerprint(plaintext.decode()), row[0], row[1])
+                               for token, plaintext, row in zip(tokens, plaintexts, rows)]
+                    statement = """UPDATE passwords SET password = ?, fingerprint = ?
+                                   WHERE id = ? AND password = ?"""
+                else:
+                    tokens = self.batch_cipher.rotate_many((row[1] for row in rows), accounts)
+                    updates = [(token, row[0], row[1]) for token, row in zip(tokens, rows)]
+                    statement = f"UPDATE {table} SET {column} = ? WHERE id = ? AND {column} = ?"
+                with self._transaction() as c:
+                    c.executemany(statement, updates)
+                    self._set_meta(c, ROTATION_CHECKPOINT, checkpoint)
+                done += len(rows)
+                if progress is not None:
+                    progress(done)
+        self.delete_meta(ROTATION_CHECKPOINT)
+        self.clear_strength_cache()
+        return done
+
+    def search_passwords(self, query, mode='substring', limit=SEARCH_LIMIT):
+        """Searches site, username and description without decrypting the vault
+
+        mode is 'substring', 'prefix' or 'fuzzy'. Matching entries are
+        returned with their passwords still encrypted until read.
+        """
+        from .search import search_rows
+        rows = search_rows(self._fetchall, query, mode, limit, self._search_indexed)
+        return [PasswordEntry(*row, self.cipher.decrypt) for row in rows]
 
     def delete_password(self, site, username):
         """Deletes a password"""
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute("DELETE FROM passwords WHERE site=? AND username=?", 
-                 (site, username))
-        conn.commit()
-        conn.close()
+        with self._transaction() as c:
+            c.execute("SELECT uuid, version FROM passwords WHERE site=? AND username=?",
+                     (site, username))
+            row = c.fetchone()
+            c.execute("DELETE FROM passwords WHERE site=? AND username=?",
+                     (site, username))
+            if row:
+                self._add_tombstone(c, row[0], site, username, row[1] + 1,
+                                    _utcnow(), self.replica_id)
+            self._invalidate((site, username))
         return True
 
+    def _add_tombstone(self, c, row_uuid, site, username, version, modified, origin):
+        """Records a deleted entry for sync, keeping the newer of two tombstones"""
+        c.execute("UPDATE vault_meta SET value = value + 1 WHERE key = 'change_seq'")
+        c.execute("""INSERT INTO tombstones
+                     (uuid, site, username, version, modified, origin, change_seq)
+                     VALUES (?, ?, ?, ?, ?, ?,
+                             (SELECT value FROM vault_meta WHERE key = 'change_seq'))
+                     ON CONFLICT (uuid) DO UPDATE SET
+                     site = excluded.site, username = excluded.username,
+                     version = excluded.version, modified = excluded.modified,
+                     origin = excluded.origin, change_seq = excluded.change_seq
+                     WHERE (excluded.modified, excluded.version, excluded.origin)
+                         > (tombstones.modified, tombstones.version, tombstones.origin)""",
+                  (row_uuid, site, username, version, modified, origin))
+
     def update_password(self, site, username, new_password):
         """Updates a password and saves the old one to history"""
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        
-        # Get current password
-        c.execute("SELECT password FROM passwords WHERE site=? AND username=?", 
-                 (site, username))
-        result = c.fetchone()
-        
-        if not result:
-            conn.close()
-            return False
-            
-        old_password = result[0]
-        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Save old password to history
-        c.execute("""INSERT INTO password_history 
-                    (site, username, old_password, changed_date) 
-                    VALUES (?, ?, ?, ?)""",
-                 (site, username, old_password, current_date))
-        
-        # Update with new password
-        encrypted_password = self.cipher_suite.encrypt(new_password.encode())
-        c.execute("""UPDATE passwords 
-                    SET password=? 
-                    WHERE site=? AND username=?""", 
-                 (encrypted_password, site, username))
-        
-        conn.commit()
-        conn.close()
+        with self._transaction() as c:
+            # Get current password
+            c.execute("SELECT password FROM passwords WHERE site=? AND username=?",
+                     (site, username))
+            result = c.fetchone()
+
+            if not result:
+                return False
+
+            old_password = result[0]
+            current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            modified = _utcnow()
+
+            # Save old password to history
+            c.execute("""INSERT INTO password_history
+                        (site, username, old_password, changed_date, uuid, modified, origin)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                     (site, username, old_password, current_date,
+                      new_row_id(), modified, self.replica_id))
+
+            # Update with new password
+            encrypted_password = self.cipher.encrypt(new_password.encode(), (site, username))
+            c.execute(f"""UPDATE passwords
+                        SET password=?, fingerprint=?, version=version + 1, {VCLOCK_BUMP},
+                            modified=?, origin=?
+                        WHERE site=? AND username=?""",
+                     (encrypted_password, self._fingerprint(new_password),
+                      self.replica_id, self.replica_id, modified, self.replica_id, site, username))
+            self._apply_history_policy(c, site, username)
+            self._invalidate((site, username))
         return True
 
-    def get_password_history(self, site, username):
-        """Retrieves password history for a specific account"""
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute("""SELECT old_password, changed_date 
-                    FROM password_history 
+    def get_password_history(self, site, username, limit=None):
+        """Retrieves password history for a specific account, newest first
+
+        With a limit only that many of the newest entries are read and decrypted.
+        """
+        history = self._fetchall("""SELECT old_password, changed_date
+                    FROM password_history
                     WHERE site=? AND username=?
-                    ORDER BY changed_date DESC""", 
-                 (site, username))
-        history = c.fetchall()
-        conn.close()
+                    ORDER BY changed_date DESC, id DESC
+                    LIMIT ?""",
+                 (site, username, -1 if limit is None else limit))
+
+        passwords = self.batch_cipher.decrypt_many((row[0] for row in history),
+                                                   [(site, username)] * len(history))
+        return [
+            (password.decode(), date)
+            for password, (_, date) in zip(passwords, history)
+        ]
 
-        decrypted_history = []
-        for encrypted_password, date in history:
-            decrypted_password = self.cipher_suite.decrypt(encrypted_password).decode()
-            decrypted_history.append((decrypted_password, date))
-        return decrypted_history
+    def get_history_policy(self, site=None, username=None):
+        """Returns the retention policy for an account, or the vault-wide one
+
+        The result has keep_last and max_age_days, either of which may be
+        None for no limit, and says whether it came from the account.
+        """
+        if site is not None:
+            rows = self._fetchall("""SELECT keep_last, max_age_days FROM history_policies
+                                     WHERE site=? AND username=?""", (site, username))
+            if rows:
+                return {'keep_last': rows[0][0], 'max_age_days': rows[0][1], 'account': True}
+        policy = self.get_meta(HISTORY_POLICY, {})
+        return {'keep_last': policy.get('keep_last'),
+                'max_age_days': policy.get('max_age_days'), 'account': False}
+
+    def set_history_policy(self, keep_last=None, max_age_days=None, site=None, username=None):
+        """Sets the vault-wide policy, or an account's when site is given
+
+        An entry is pruned once it falls outside either limit. Setting no
+        limits removes the policy; an account then follows the vault's.
+        """
+        for value in (keep_last, max_age_days):
+            if value is not None and value < 0:
+                raise ValidationError("Retention limits cannot be negative")
+        clear = keep_last is None and max_age_days is None
+        with self._transaction() as c:
+            if site is None:
+                if clear:
+                    c.execute("DELETE FROM vault_meta WHERE key = ?", (HISTORY_POLICY,))
+                else:
+                    self._set_meta(c, HISTORY_POLICY,
+                                   {'keep_last': keep_last, 'max_age_days': max_age_days})
+            elif clear:
+                c.execute("DELETE FROM history_policies WHERE site=? AND username=?",
+                          (site, username))
+            else:
+                c.execute("""INSERT INTO history_policies (site, username, keep_last, max_age_days)
+                             VALUES (?, ?, ?, ?)
+                             ON CONFLICT (site, username) DO UPDATE SET
+                             keep_last = excluded.keep_last, max_age_days = excluded.max_age_days""",
+                          (site, username, keep_last, max_age_days))
+
+    def _apply_history_policy(self, c, site, username):
+        """Prunes one account's history inside the caller's transaction"""
+        c.execute("""SELECT keep_last, max_age_days FROM history_policies
+                     WHERE site=? AND username=?""", (site, username))
+        row = c.fetchone()
+        if row is None:
+            c.execute("SELECT value FROM vault_meta WHERE key = ?", (HISTORY_POLICY,))
+            meta = c.fetchone()
+            policy = json.loads(meta[0]) if meta else {}
+            row = (policy.get('keep_last'), policy.get('max_age_days'))
+        keep_last, max_age_days = row
+        if keep_last is not None:
+            c.execute("""DELETE FROM password_history
+                         WHERE site=? AND username=? AND id NOT IN (
+                             SELECT id FROM password_history
+                             WHERE site=? AND username=?
+                             ORDER BY changed_date DESC, id DESC LIMIT ?)""",
+                      (site, username, site, username, keep_last))
+        if max_age_days is not None:
+            c.execute("""DELETE FROM password_history
+                         WHERE site=? AND username=?
+                         AND changed_date < datetime(?, ?)""",
+                      (site, username, _now(), f'-{max_age_days} days'))
+
+    def prune_history(self, batch_size=PRUNE_BATCH_SIZE):
+        """Deletes history outside the retention policies, batch by batch
+
+        The candidates are collected in one pass into a temporary table,
+        then deleted batch_size rows per transaction so other operations
+        can interleave. Returns the number of rows deleted.
+        """
+        policy = self.get_meta(HISTORY_POLICY, {})
+        with self._transaction() as c:
+            c.execute("DROP TABLE IF EXISTS temp.prune_ids")
+            c.execute("CREATE TEMP TABLE prune_ids (id INTEGER PRIMARY KEY)")
+            c.execute("INSERT INTO prune_ids " + _PRUNABLE_HISTORY,
+                      {'keep_last': policy.get('keep_last'),
+                       'max_age_days': policy.get('max_age_days'), 'now': _now()})
+        deleted, after = 0, 0
+        try:
+            while True:
+                ids = self._fetchall("SELECT id FROM prune_ids WHERE id > ? ORDER BY id LIMIT ?",
+                                     (after, batch_size))
+                if not ids:
+                    break
+                with self._transaction() as c:
+                    c.executemany("DELETE FROM password_history WHERE id = ?", ids)
+                    deleted += c.rowcount
+                after = ids[-1][0]
+        finally:
+            with self._transaction() as c:
+                c.execute("DROP TABLE temp.prune_ids")
+        return deleted
+
+    def compact(self, batch_size=PRUNE_BATCH_SIZE, full=False):
+        """Prunes history and deletion logs, then returns freed pages to the OS
+
+        Uses incremental vacuum when the database supports it; otherwise, or
+        with full=True, runs VACUUM, which also switches the database to
+        incremental auto-vacuum. Returns counts and the bytes reclaimed.
+        """
+        pruned = self.prune_history(batch_size)
+        last_backup = self.get_meta('last_backup')
+        with self._transaction() as c:
+            # Deletions already covered by the last backup are no longer needed
+            if last_backup is None:
+                c.execute("DELETE FROM deleted_rows")
+            else:
+                c.execute("DELETE FROM deleted_rows WHERE change_seq <= ?",
+                          (last_backup['change_seq'],))
+            log_entries = c.rowcount
+
+        with self._lock:
+            if self._write_through is None:
+                vacuum, size_before, size_after = self._vacuum(self.conn, full)
+            else:
+                # The file is what takes disk space; the memory copy reuses its free pages
+                disk, disk_lock = self._write_through.maintenance()
+                with disk_lock:
+                    vacuum, size_before, size_after = self._vacuum(disk, full)
+        return {'pruned': pruned, 'log_entries': log_entries, 'vacuum': vacuum,
+                'bytes_before': size_before, 'bytes_after': size_after,
+                'bytes_reclaimed': size_before - size_after}
+
+    @staticmethod
+    def _vacuum(conn, full):
+        """Returns (mode, bytes before, bytes after) of vacuuming conn's database"""
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            size_before = _database_size(conn)
+            incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+            if incremental and not full:
+                # executescript steps the pragma to completion; execute
+                # would free a single page
+                conn.executescript("PRAGMA incremental_vacuum")
+                vacuum = 'incremental'
+            else:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+                vacuum = 'full'
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return vacuum, size_before, _database_size(conn)
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Failed to compact database: {e}")
 
     def update_username(self, site, old_username, new_username):
-        """Updates username for an existing account"""
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        
-        # Check if account exists
-        c.execute("SELECT * FROM passwords WHERE site=? AND username=?", 
-                 (site, old_username))
-        if not c.fetchone():
-            conn.close()
-            return False
-            
-        # Update username in passwords table
-        c.execute("""UPDATE passwords 
-                    SET username=? 
-                    WHERE site=? AND username=?""", 
-                 (new_username, site, old_username))
-        
-        # Update username in history table
-        c.execute("""UPDATE password_history 
-                    SET username=? 
-                    WHERE site=? AND username=?""", 
-                 (new_username, site, old_username))
-        
-        conn.commit()
-        conn.close()
+        """Updates username for an existing account
+
+        Compact records are bound to their account, so the password and its
+        history are re-encrypted for the new username.
+        """
+        old_account, new_account = (site, old_username), (site, new_username)
+        with self._transaction() as c:
+            # Check if account exists
+            c.execute("SELECT id, password FROM passwords WHERE site=? AND username=?",
+                     old_account)
+            row = c.fetchone()
+            if not row:
+                return False
+
+            # Update username in passwords table
+            modified = _utcnow()
+            c.execute(f"""UPDATE passwords
+                        SET username=?, password=?, version=version + 1, {VCLOCK_BUMP},
+                            modified=?, origin=?
+                        WHERE id=?""",
+                     (new_username, self.cipher.rebind(row[1], old_account, new_account),
+                      self.replica_id, self.replica_id, modified, self.replica_id, row[0]))
+
+            # Update username in history table
+            c.execute("""SELECT id, old_password FROM password_history
+                        WHERE site=? AND username=?""", old_account)
+            c.executemany("""UPDATE password_history
+                            SET username=?, old_password=?,
+                                version=version + 1, modified=?, origin=?
+                            WHERE id=?""",
+                         [(new_username, self.cipher.rebind(token, old_account, new_account),
+                           modified, self.replica_id, history_id)
+                          for history_id, token in c.fetchall()])
+            c.execute("""UPDATE OR REPLACE history_policies
+                        SET username=?
+                        WHERE site=? AND username=?""",
+                     (new_username, site, old_username))
+            self._invalidate((site, old_username), (site, new_username))
         return True
 
     def update_description(self, site, username, new_description):
         """Updates description for an existing account"""
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        
-        c.execute("""UPDATE passwords 
-                    SET description=? 
-                    WHERE site=? AND username=?""", 
-                 (new_description, site, username))
-        
-        rows_affected = c.rowcount
-        conn.commit()
-        conn.close()
+        with self._transaction() as c:
+            c.execute(f"""UPDATE passwords
+                        SET description=?, version=version + 1, {VCLOCK_BUMP},
+                            modified=?, origin=?
+                        WHERE site=? AND username=?""",
+                     (new_description, self.replica_id, self.replica_id, _utcnow(),
+                      self.replica_id, site, username))
+            rows_affected = c.rowcount
+            self._invalidate((site, username))
         return rows_affected > 0
 
     def _execute_query(self, query, params=None):
         """Executes a database query with error handling"""
-        conn = None
-        try:
-            conn = sqlite3.connect(self.db_name, timeout=DB_TIMEOUT)
-            cursor = conn.cursor()
-            
+        with self._transaction() as cursor:
             if params:
                 cursor.execute(query, params)
             else:
                 cursor.execute(query)
-            
-            conn.commit()
-            return cursor
-        except sqlite3.Error as e:
-            if conn:
-                conn.rollback()
-            raise DatabaseError(f"Database operation failed: {e}")
-        finally:
-            if conn:
-                conn.close() 
\ No newline at end of file
+        return cursor
@@ -0,0 +1,33 @@
+class PasswordEntry:
+    """A stored account whose password is only decrypted when it is read"""
+    __slots__ = ('id', 'site', 'username', 'description', 'encrypted_password',
+                 '_decrypt', '_password')
+
+    def __init__(self, entry_id, site, username, encrypted_password, description, decrypt,
+                 password=None):
+        self.id = entry_id
+        self.site = site
+        self.username = username
+        self.description = description or ''
+        self.encrypted_password = encrypted_password
+        self._decrypt = decrypt
+        self._password = password
+
+    @property
+    def key(self):
+        """The (site, username) pair identifying this account"""
+        return (self.site, self.username)
+
+    @property
+    def password(self):
+        """Decrypts the password on first access"""
+        if self._password is None:
+            self._password = self._decrypt(self.encrypted_password, self.key).decode()
+        return self._password
+
+    def __iter__(self):
+        # Allows unpacking like the (site, username, password, description) tuples
+        return iter((self.site, self.username, self.password, self.description))
+
+    def __repr__(self):
+        return f"PasswordEntry(site={self.site!r}, username={self.username!r})"
@@ -0,0 +1,173 @@
+"""In-memory vault with write-through to the database file.
+
+DatabaseManager(in_memory=True) copies the vault into a private :memory:
+database with the backup API at unlock and serves every read from there.
+Write transactions run on the memory copy through a RecordingCursor that
+logs each statement, and WriteThrough replays the logs on the file inside
+one transaction, so the file always holds a prefix of the committed
+transactions: a crash loses at most the unflushed tail, never part of one.
+
+With flush_interval=0 each log is replayed before the memory transaction
+commits, and a failed disk write rolls both back. With a positive
+interval committed logs queue up and a background thread replays them
+every flush_interval seconds, all in one disk transaction.
+
+Replay only reproduces deterministic statements, so DatabaseManager binds
+times as parameters instead of using SQL 'now'. No other process may
+write the file meanwhile; each flush compares the file's change sequence
+with the one it left behind and refuses to write if it moved.
+"""
+import sqlite3
+import threading
+from ..exceptions import DatabaseError
+from ..config import DB_CACHED_STATEMENTS, DB_CACHE_SIZE_KB
+from .database_manager import begin_immediate
+
+class RecordingCursor:
+    """Cursor proxy that logs the writes it runs, for replay on the file"""
+
+    def __init__(self, cursor, log):
+        self._cursor = cursor
+        self.log = log
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql, params)
+        if not sql.lstrip()[:6].upper() == 'SELECT':
+            self.log.append((sql, params, False))
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        self._cursor.executemany(sql, seq_of_params)
+        self.log.append((sql, seq_of_params, True))
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+def load(disk):
+    """Copies the database open on disk into a new :memory: connection"""
+    try:
+        memory = sqlite3.connect(':memory:', isolation_level=None, check_same_thread=False,
+                                 cached_statements=DB_CACHED_STATEMENTS)
+        disk.backup(memory)
+        memory.execute("PRAGMA temp_store=MEMORY")
+        memory.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        return memory
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to load the vault into memory: {e}")
+
+def _change_seq(cursor):
+    cursor.execute("SELECT value FROM vault_meta WHERE key = 'change_seq'")
+    return int(cursor.fetchone()[0])
+
+class WriteThrough:
+    """Replays statement logs of the memory copy on the database file"""
+
+    def __init__(self, disk, flush_interval=0):
+        self.disk = disk
+        self.flush_interval = flush_interval
+        self.flushes = 0
+        self.statements = 0
+        self.error = None
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._change_seq = _change_seq(disk.cursor())
+        self._stop = threading.Event()
+        self._thread = None
+        if flush_interval:
+            self._thread = threading.Thread(target=self._run, name='write-through', daemon=True)
+            self._thread.start()
+
+    def record(self, cursor, log):
+        """Wraps a memory cursor so its writes are appended to log"""
+        return RecordingCursor(cursor, log)
+
+    def commit(self, log, commit_memory):
+        """Makes log durable around commit_memory(), the memory transaction's commit"""
+        if not log:
+            commit_memory()
+            return
+        if not self.flush_interval:
+            self._replay([log])
+            commit_memory()
+            return
+        if self.error is not None:
+            raise DatabaseError(f"Vault file is not being updated: {self.error}")
+        commit_memory()
+        with self._pending_lock:
+            self._pending.append(log)
+
+    def flush(self):
+        """Writes every queued log to the file now"""
+        with self._pending_lock:
+            logs, self._pending = self._pending, []
+        if not logs:
+            return
+        try:
+            self._replay(logs)
+        except DatabaseError as e:
+            with self._pending_lock:
+                self._pending = logs + self._pending
+            self.error = e
+            raise
+        self.error = None
+
+    def _replay(self, logs):
+        with self._lock:
+            c = self.disk.cursor()
+            try:
+                begin_immediate(c)
+            except sqlite3.Error as e:
+                raise DatabaseError(f"Failed to write through to the vault file: {e}")
+            try:
+                if _change_seq(c) != self._change_seq:
+                    raise DatabaseError("The vault file was changed by another process; "
+                                        "in-memory changes were not written")
+                for log in logs:
+                    for sql, params, many in log:
+                        if many:
+                            c.executemany(sql, params)
+                        else:
+                            c.execute(sql, params)
+                    self.statements += len(log)
+                self._change_seq = _change_seq(c)
+                c.execute("COMMIT")
+                self.flushes += 1
+            except sqlite3.Error as e:
+                c.execute("ROLLBACK")
+                raise DatabaseError(f"Failed to write through to the vault file: {e}")
+            except BaseException:
+                c.execute("ROLLBACK")
+                raise
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except DatabaseError:
+                pass  # kept in self.error; writes are refused until a flush succeeds
+
+    def maintenance(self):
+        """Flushes, then returns the file connection and the lock guarding it"""
+        self.flush()
+        return self.disk, self._lock
+
+    def close(self):
+        """Stops the flush thread, writes what is left and closes the file"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                try:
+                    self.disk.execute("PRAGMA optimize")
+                except sqlite3.Error:
+                    pass
+                self.disk.close()
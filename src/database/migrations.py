@@ -0,0 +1,260 @@
+import json
+import sqlite3
+import uuid
+from datetime import datetime
+from ..exceptions import DatabaseError
+
+# Modification time of rows that predate sync
+EPOCH = '1970-01-01T00:00:00.000000+00:00'
+
+def _table_exists(c, name):
+    """Checks if a table exists in the database"""
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    return c.fetchone() is not None
+
+def _migrate_keyed_schema(c):
+    """Adds row ids, a unique (site, username) key and a history index"""
+    c.execute('''CREATE TABLE passwords_v1
+                (id INTEGER PRIMARY KEY,
+                 site TEXT NOT NULL,
+                 username TEXT NOT NULL,
+                 password TEXT NOT NULL,
+                 description TEXT DEFAULT '',
+                 UNIQUE (site, username))''')
+
+    c.execute('''CREATE TABLE password_history_v1
+                (id INTEGER PRIMARY KEY,
+                 site TEXT NOT NULL,
+                 username TEXT NOT NULL,
+                 old_password TEXT NOT NULL,
+                 changed_date TEXT NOT NULL)''')
+
+    if _table_exists(c, 'passwords'):
+        # The newest row wins for duplicate accounts; the older passwords
+        # are kept in history rather than silently dropped
+        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        c.execute("""INSERT INTO password_history_v1
+                    (site, username, old_password, changed_date)
+                    SELECT site, username, password, ?
+                    FROM passwords
+                    WHERE rowid NOT IN (SELECT MAX(rowid) FROM passwords
+                                        GROUP BY site, username)
+                    ORDER BY rowid""", (current_date,))
+        c.execute("""INSERT INTO passwords_v1 (site, username, password, description)
+                    SELECT site, username, password, COALESCE(description, '')
+                    FROM passwords
+                    WHERE rowid IN (SELECT MAX(rowid) FROM passwords
+                                    GROUP BY site, username)
+                    ORDER BY rowid""")
+        c.execute("DROP TABLE passwords")
+
+    if _table_exists(c, 'password_history'):
+        c.execute("""INSERT INTO password_history_v1
+                    (site, username, old_password, changed_date)
+                    SELECT site, username, old_password, changed_date
+                    FROM password_history
+                    ORDER BY rowid""")
+        c.execute("DROP TABLE password_history")
+
+    c.execute("ALTER TABLE passwords_v1 RENAME TO passwords")
+    c.execute("ALTER TABLE password_history_v1 RENAME TO password_history")
+    c.execute('''CREATE INDEX idx_history_account
+                ON password_history (site, username, changed_date)''')
+
+def _migrate_search_index(c):
+    """Adds a trigram full-text index over site, username and description"""
+    try:
+        c.execute('''CREATE VIRTUAL TABLE passwords_fts USING fts5
+                    (site, username, description,
+                     content='passwords', content_rowid='id',
+                     tokenize='trigram')''')
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5 or older than 3.34; search falls back to LIKE
+        return
+
+    c.execute('''CREATE TRIGGER passwords_fts_insert AFTER INSERT ON passwords BEGIN
+                    INSERT INTO passwords_fts (rowid, site, username, description)
+                    VALUES (new.id, new.site, new.username, new.description);
+                 END''')
+    c.execute('''CREATE TRIGGER passwords_fts_delete AFTER DELETE ON passwords BEGIN
+                    INSERT INTO passwords_fts (passwords_fts, rowid, site, username, description)
+                    VALUES ('delete', old.id, old.site, old.username, old.description);
+                 END''')
+    c.execute('''CREATE TRIGGER passwords_fts_update
+                 AFTER UPDATE OF site, username, description ON passwords BEGIN
+                    INSERT INTO passwords_fts (passwords_fts, rowid, site, username, description)
+                    VALUES ('delete', old.id, old.site, old.username, old.description);
+                    INSERT INTO passwords_fts (rowid, site, username, description)
+                    VALUES (new.id, new.site, new.username, new.description);
+                 END''')
+    c.execute("INSERT INTO passwords_fts (passwords_fts) VALUES ('rebuild')")
+
+_NEXT_SEQ = "UPDATE vault_meta SET value = value + 1 WHERE key = 'change_seq';"
+_CURRENT_SEQ = "(SELECT value FROM vault_meta WHERE key = 'change_seq')"
+
+def _migrate_change_tracking(c):
+    """Stamps rows with a vault-wide change sequence and logs deletions
+
+    Incremental backups export the rows whose change_seq is newer than the
+    last backup, plus the ids recorded in deleted_rows since then.
+    """
+    c.execute('''CREATE TABLE vault_meta
+                (key TEXT PRIMARY KEY,
+                 value)''')
+    c.execute("INSERT INTO vault_meta (key, value) VALUES ('change_seq', 0)")
+    c.execute("ALTER TABLE passwords ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+    c.execute("ALTER TABLE password_history ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+    c.execute("CREATE INDEX idx_passwords_change_seq ON passwords (change_seq)")
+    c.execute("CREATE INDEX idx_history_change_seq ON password_history (change_seq)")
+    c.execute('''CREATE TABLE deleted_rows
+                (table_name TEXT NOT NULL,
+                 row_id INTEGER NOT NULL,
+                 change_seq INTEGER NOT NULL)''')
+    c.execute("CREATE INDEX idx_deleted_rows_change_seq ON deleted_rows (change_seq)")
+
+    for table, columns in (('passwords', 'site, username, password, description'),
+                           ('password_history', 'site, username, old_password, changed_date')):
+        c.execute(f'''CREATE TRIGGER {table}_track_insert AFTER INSERT ON {table} BEGIN
+                        {_NEXT_SEQ}
+                        UPDATE {table} SET change_seq = {_CURRENT_SEQ} WHERE id = new.id;
+                     END''')
+        _create_update_trigger(c, table, columns)
+        c.execute(f'''CREATE TRIGGER {table}_track_delete AFTER DELETE ON {table} BEGIN
+                        {_NEXT_SEQ}
+                        INSERT INTO deleted_rows (table_name, row_id, change_seq)
+                        VALUES ('{table}', old.id, {_CURRENT_SEQ});
+                     END''')
+
+def _create_update_trigger(c, table, columns):
+    """Stamps a row with the next change_seq when any of columns is updated"""
+    c.execute(f'''CREATE TRIGGER {table}_track_update AFTER UPDATE OF {columns} ON {table} BEGIN
+                    {_NEXT_SEQ}
+                    UPDATE {table} SET change_seq = {_CURRENT_SEQ} WHERE id = new.id;
+                 END''')
+
+def _migrate_history_policies(c):
+    """Adds per-account password history retention policies
+
+    A NULL limit means no limit; accounts without a row follow the
+    vault-wide policy stored in vault_meta.
+    """
+    c.execute('''CREATE TABLE history_policies
+                (site TEXT NOT NULL,
+                 username TEXT NOT NULL,
+                 keep_last INTEGER,
+                 max_age_days INTEGER,
+                 PRIMARY KEY (site, username))''')
+
+def _migrate_fingerprints(c):
+    """Adds an indexed keyed fingerprint of each current password
+
+    Existing rows are left NULL here, since migrations run without the
+    key; DatabaseManager backfills them when the vault is next opened.
+    """
+    c.execute("ALTER TABLE passwords ADD COLUMN fingerprint BLOB")
+    c.execute("CREATE INDEX idx_passwords_fingerprint ON passwords (fingerprint)")
+
+def _migrate_sync(c):
+    """Adds stable row ids, version counters and tombstones for delta sync
+
+    Existing rows get ids derived from their content rather than random
+    ones, so copies of a vault made before the upgrade still agree on
+    them. Their modification time is the epoch, which any real edit beats.
+    """
+    c.execute("INSERT INTO vault_meta (key, value) VALUES ('replica_id', ?)",
+              (json.dumps(uuid.uuid4().hex),))
+    for table in ('passwords', 'password_history'):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN uuid TEXT")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN modified TEXT NOT NULL DEFAULT '{EPOCH}'")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN origin TEXT NOT NULL DEFAULT ''")
+
+    c.execute("SELECT id, site, username FROM passwords")
+    c.executemany("UPDATE passwords SET uuid = ? WHERE id = ?",
+                  [(uuid.uuid5(uuid.NAMESPACE_OID, f"passwords\0{site}\0{username}").hex, row_id)
+                   for row_id, site, username in c.fetchall()])
+    c.execute("SELECT id, site, username, changed_date FROM password_history")
+    c.executemany("UPDATE password_history SET uuid = ? WHERE id = ?",
+                  [(uuid.uuid5(uuid.NAMESPACE_OID,
+                               f"password_history\0{site}\0{username}\0{changed}\0{row_id}").hex,
+                    row_id)
+                   for row_id, site, username, changed in c.fetchall()])
+    c.execute("CREATE UNIQUE INDEX idx_passwords_uuid ON passwords (uuid)")
+    c.execute("CREATE UNIQUE INDEX idx_history_uuid ON password_history (uuid)")
+
+    # One row per deleted entry, kept so the deletion reaches other replicas
+    c.execute('''CREATE TABLE tombstones
+                (uuid TEXT PRIMARY KEY,
+                 site TEXT NOT NULL,
+                 username TEXT NOT NULL,
+                 version INTEGER NOT NULL,
+                 modified TEXT NOT NULL,
+                 origin TEXT NOT NULL,
+                 change_seq INTEGER NOT NULL)''')
+    c.execute("CREATE INDEX idx_tombstones_change_seq ON tombstones (change_seq)")
+
+def _migrate_strength_cache(c):
+    """Adds a cache of password strength results keyed by fingerprint
+
+    Results are stored encrypted, so the file alone does not reveal
+    which accounts have weak passwords.
+    """
+    c.execute('''CREATE TABLE strength_cache
+                (fingerprint BLOB PRIMARY KEY,
+                 result BLOB NOT NULL) WITHOUT ROWID''')
+
+def _migrate_version_vectors(c):
+    """Adds a version vector to each entry: edits counted per replica
+
+    Sync uses it to tell whether one version of an entry was derived from
+    another. Existing rows start empty, which every version descends from.
+    Merging a vector changes the row for sync, so it also bumps change_seq.
+    """
+    c.execute("ALTER TABLE passwords ADD COLUMN vclock TEXT NOT NULL DEFAULT '{}'")
+    c.execute("DROP TRIGGER passwords_track_update")
+    _create_update_trigger(c, 'passwords', 'site, username, password, description, vclock')
+
+# Ordered list of (version, migration); each runs in its own transaction
+MIGRATIONS = [
+    (1, _migrate_keyed_schema),
+    (2, _migrate_search_index),
+    (3, _migrate_change_tracking),
+    (4, _migrate_history_policies),
+    (5, _migrate_fingerprints),
+    (6, _migrate_sync),
+    (7, _migrate_strength_cache),
+    (8, _migrate_version_vectors),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(c):
+    """Returns the schema version stored in the database header"""
+    c.execute("PRAGMA user_version")
+    return c.fetchone()[0]
+
+def migrate(transaction):
+    """Upgrades the database schema in place to SCHEMA_VERSION
+
+    transaction is a callable returning a transaction context manager
+    that yields a cursor, such as DatabaseManager._transaction.
+    """
+    with transaction() as c:
+        version = get_schema_version(c)
+
+    if version > SCHEMA_VERSION:
+        raise DatabaseError(
+            f"Database schema version {version} is newer than supported "
+            f"version {SCHEMA_VERSION}"
+        )
+
+    for target, migration in MIGRATIONS:
+        with transaction() as c:
+            # Re-read inside the transaction in case another process migrated
+            version = get_schema_version(c)
+            if target <= version:
+                continue
+            migration(c)
+            c.execute(f"PRAGMA user_version = {target}")
+            version = target
+    return version
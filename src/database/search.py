@@ -0,0 +1,101 @@
+import re
+from difflib import SequenceMatcher
+from ..exceptions import ValidationError
+from ..config import SEARCH_LIMIT, FUZZY_MIN_SCORE, FUZZY_CANDIDATES
+
+SEARCH_MODES = ('substring', 'prefix', 'fuzzy')
+
+# The trigram tokenizer can only use its index for terms of 3+ characters
+_MIN_INDEXED_LENGTH = 3
+_TOKEN_SPLIT = re.compile(r'[^0-9a-z]+')
+
+def _fts_phrase(text):
+    """Quotes text as a single FTS5 phrase"""
+    return '"' + text.replace('"', '""') + '"'
+
+def _like_escape(text):
+    """Escapes LIKE wildcards so the query is matched literally"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def fuzzy_score(query, fields):
+    """Scores how closely query matches any field or word within it (0..1)"""
+    best = 0.0
+    for field in fields:
+        field = (field or '').lower()
+        for candidate in [field, *_TOKEN_SPLIT.split(field)]:
+            if candidate:
+                best = max(best, SequenceMatcher(None, query, candidate).ratio())
+    return best
+
+def _like_query(table, pattern, limit, match=None):
+    """Builds a LIKE query over the three metadata columns of table
+
+    match optionally narrows the rows through the full-text index first.
+    """
+    source = "passwords p" if table == 'passwords' else \
+        "passwords_fts f JOIN passwords p ON p.id = f.rowid"
+    alias = 'p' if table == 'passwords' else 'f'
+    where = "passwords_fts MATCH ? AND " if match else ""
+    sql = f"""SELECT p.id, p.site, p.username, p.password, p.description
+              FROM {source}
+              WHERE {where}({alias}.site LIKE ? ESCAPE '\\'
+                 OR {alias}.username LIKE ? ESCAPE '\\'
+                 OR {alias}.description LIKE ? ESCAPE '\\')
+              LIMIT ?"""
+    params = (pattern, pattern, pattern, limit)
+    return sql, (match,) + params if match else params
+
+def search_rows(fetchall, query, mode='substring', limit=SEARCH_LIMIT, indexed=True):
+    """Finds (id, site, username, password, description) rows matching query
+
+    Only plaintext metadata is searched; the encrypted passwords are returned
+    untouched so callers decrypt just the hits. fetchall runs a read query,
+    and indexed says whether the passwords_fts table exists.
+    """
+    if mode not in SEARCH_MODES:
+        raise ValidationError(f"Unknown search mode: {mode}")
+    query = query.strip().lower()
+    if not query:
+        raise ValidationError("Search query cannot be empty")
+
+    if mode == 'fuzzy' and len(query) < _MIN_INDEXED_LENGTH:
+        mode = 'substring'
+    table = 'passwords_fts' if indexed else 'passwords'
+
+    if mode == 'substring':
+        if indexed and len(query) >= _MIN_INDEXED_LENGTH:
+            rows = fetchall("""SELECT p.id, p.site, p.username, p.password, p.description
+                        FROM passwords_fts f JOIN passwords p ON p.id = f.rowid
+                        WHERE passwords_fts MATCH ?
+                        LIMIT ?""", (_fts_phrase(query), limit))
+        else:
+            rows = fetchall(*_like_query(table, f"%{_like_escape(query)}%", limit))
+        return sorted(rows, key=lambda row: (row[1], row[2]))
+
+    if mode == 'prefix':
+        match = _fts_phrase(query) if indexed and len(query) >= _MIN_INDEXED_LENGTH else None
+        rows = fetchall(*_like_query(table, f"{_like_escape(query)}%", limit, match))
+        return sorted(rows, key=lambda row: (row[1], row[2]))
+
+    # Fuzzy: shortlist rows sharing trigrams with the query, then rank them
+    if indexed:
+        match = ' OR '.join(_fts_phrase(gram) for gram in sorted(_trigrams(query)))
+        candidates = fetchall("""SELECT p.id, p.site, p.username, p.password, p.description
+                    FROM passwords_fts f JOIN passwords p ON p.id = f.rowid
+                    WHERE passwords_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ?""", (match, max(limit * 10, FUZZY_CANDIDATES)))
+    else:
+        candidates = fetchall("""SELECT id, site, username, password, description
+                    FROM passwords""")
+
+    scored = []
+    for row in candidates:
+        score = fuzzy_score(query, row[1:3] + row[4:5])
+        if score >= FUZZY_MIN_SCORE:
+            scored.append((score, row))
+    scored.sort(key=lambda item: (-item[0], item[1][1], item[1][2]))
+    return [row for _, row in scored[:limit]]
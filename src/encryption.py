@@ -1,41 +1,234 @@
-from cryptography.fernet import Fernet
-import hashlib
+import hmac
 import os
+import struct
+from . import kdf
+from .exceptions import ValidationError, EncryptionError
+from .config import CRYPTO_WORKERS, CRYPTO_MIN_PARALLEL, CRYPTO_MIN_CHUNK, KDF_SETTINGS_FILE
+
+# Storage formats for password columns; see RecordCipher
+STORAGE_FORMATS = ('fernet', 'aead')
+# First byte of a compact record (Fernet tokens are base64 and start with b'g')
+RECORD_VERSION = b'\x01'
+RECORD_NONCE_SIZE = 12
 
 class PasswordHasher:
-    def __init__(self):
+    def __init__(self, algorithm=None, params=None, settings_path=KDF_SETTINGS_FILE):
         self.salt_length = 16
+        if algorithm is None:
+            algorithm, settings_params = kdf.load_settings(settings_path)
+            params = params or settings_params
+        self.algorithm = algorithm
+        self.params = params or kdf.default_params(algorithm)
         
     def hash_password(self, password):
-        """Creates a salted hash of the password"""
+        """Creates a salted, self-describing hash of the password"""
         salt = os.urandom(self.salt_length)
-        hashed = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode(),
-            salt,
-            100000
-        )
-        return salt + hashed
+        hashed = kdf.derive(self.algorithm, self.params, password.encode(), salt)
+        return kdf.encode(self.algorithm, self.params, salt, hashed)
         
     def verify_password(self, stored_password, provided_password):
         """Verifies if the provided password matches the stored hash"""
-        salt = stored_password[:self.salt_length]
-        stored_hash = stored_password[self.salt_length:]
-        hash_to_check = hashlib.pbkdf2_hmac(
-            'sha256',
-            provided_password.encode(),
-            salt,
-            100000
-        )
-        return hash_to_check == stored_hash
+        algorithm, params, salt, stored_hash = kdf.decode(stored_password)
+        hash_to_check = kdf.derive(algorithm, params, provided_password.encode(), salt)
+        return hmac.compare_digest(hash_to_check, stored_hash)
+
+    def needs_rehash(self, stored_password):
+        """Checks if the stored hash is legacy or uses other parameters than the current ones"""
+        if not stored_password.startswith(b'$'):
+            return True
+        algorithm, params, _, _ = kdf.decode(stored_password)
+        return algorithm != self.algorithm or params != self.params
 
 class Encryption:
     @staticmethod
     def generate_key():
         """Generates a new encryption key"""
+        from cryptography.fernet import Fernet
         return Fernet.generate_key()
     
     @staticmethod
     def get_cipher_suite(key):
-        """Creates a cipher suite from the given key"""
-        return Fernet(key) 
\ No newline at end of file
+        """Creates a cipher suite from the given key
+
+        key may hold several whitespace-separated keys, as the key file
+        does during a rotation; the first encrypts and any of them decrypts.
+        """
+        from cryptography.fernet import Fernet, MultiFernet
+        keys = key.split()
+        if len(keys) > 1:
+            return MultiFernet([Fernet(k) for k in keys])
+        return Fernet(keys[0])
+
+    @staticmethod
+    def derive_subkey(key, purpose):
+        """Derives an independent 32-byte key for purpose from the primary vault key"""
+        import base64
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+        primary = base64.urlsafe_b64decode(key.split()[0])
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                    info=b'password-manager/' + purpose.encode()).derive(primary)
+
+    @staticmethod
+    def fingerprint(fingerprint_key, password):
+        """Keyed HMAC-SHA256 of a password, equal for equal passwords in one vault"""
+        return hmac.new(fingerprint_key, password.encode(), 'sha256').digest()
+
+def _associated_data(identity):
+    """Binds a record to its (site, username), length-prefixed so no two pairs collide"""
+    if identity is None:
+        raise ValidationError("Compact records need the (site, username) they belong to")
+    site, username = (value.encode() for value in identity)
+    return RECORD_VERSION + struct.pack('>I', len(site)) + site + username
+
+class RecordCipher:
+    """Encrypts stored passwords in the vault's storage format
+
+    'fernet' writes Fernet tokens. 'aead' writes compact records,
+        version (1 byte) | nonce (12 bytes) | AES-256-GCM ciphertext and tag
+    authenticated together with the row's (site, username), so a record
+    moved to another account fails to decrypt. The AES keys are derived
+    from the vault keys with HKDF, the first key encrypting. Reads
+    dispatch on the first byte, so both formats can share a table.
+    """
+
+    def __init__(self, cipher_suite, key=None, storage_format='fernet'):
+        if storage_format not in STORAGE_FORMATS:
+            raise ValidationError(f"Unknown storage format: {storage_format}")
+        if storage_format == 'aead' and key is None:
+            raise ValidationError("The compact storage format needs the raw vault key")
+        self.cipher_suite = cipher_suite
+        self.storage_format = storage_format
+        self._aeads = []
+        if key is not None:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+            self._aeads = [AESGCM(Encryption.derive_subkey(k, 'storage')) for k in key.split()]
+
+    def encrypt(self, data, identity=None):
+        """Encrypts data for the account identity = (site, username)"""
+        if self.storage_format == 'fernet':
+            return self.cipher_suite.encrypt(data)
+        nonce = os.urandom(RECORD_NONCE_SIZE)
+        return RECORD_VERSION + nonce + self._aeads[0].encrypt(nonce, data, _associated_data(identity))
+
+    def decrypt(self, token, identity=None):
+        """Decrypts a Fernet token or compact record stored for identity"""
+        if token[:1] != RECORD_VERSION:
+            return self.cipher_suite.decrypt(token)
+        if not self._aeads:
+            raise EncryptionError("Compact records need the raw vault key, which is not loaded")
+        from cryptography.exceptions import InvalidTag
+        from cryptography.fernet import InvalidToken
+        nonce = token[1:1 + RECORD_NONCE_SIZE]
+        ciphertext = token[1 + RECORD_NONCE_SIZE:]
+        associated_data = _associated_data(identity)
+        for aead in self._aeads:
+            try:
+                return aead.decrypt(nonce, ciphertext, associated_data)
+            except InvalidTag:
+                continue
+        raise InvalidToken
+
+    def rotate(self, token, identity=None):
+        """Re-encrypts a stored value under the first key, in the current format"""
+        return self.encrypt(self.decrypt(token, identity), identity)
+
+    def rebind(self, token, old_identity, new_identity):
+        """Re-encrypts a compact record for a renamed account; Fernet tokens need nothing"""
+        if token[:1] != RECORD_VERSION:
+            return token
+        if not self._aeads:
+            raise EncryptionError("Compact records need the raw vault key, which is not loaded")
+        nonce = os.urandom(RECORD_NONCE_SIZE)
+        return RECORD_VERSION + nonce + self._aeads[0].encrypt(
+            nonce, self.decrypt(token, old_identity), _associated_data(new_identity))
+
+# Cipher used by BatchCipher worker processes, built once per process
+_worker_cipher = None
+
+def _init_worker(key, storage_format):
+    global _worker_cipher
+    _worker_cipher = RecordCipher(Encryption.get_cipher_suite(key), key, storage_format)
+
+def _encrypt_chunk(items, cipher=None):
+    cipher = cipher or _worker_cipher
+    return [cipher.encrypt(value, identity) for value, identity in items]
+
+def _decrypt_chunk(items, cipher=None):
+    cipher = cipher or _worker_cipher
+    return [cipher.decrypt(token, identity) for token, identity in items]
+
+def _rotate_chunk(items, cipher=None):
+    cipher = cipher or _worker_cipher
+    return [cipher.rotate(token, identity) for token, identity in items]
+
+class BatchCipher:
+    """Encrypts and decrypts many values at once across a worker pool
+
+    With the raw key available the work is spread over processes, since
+    Fernet holds the GIL for most of each call; otherwise threads are used.
+    Batches smaller than min_parallel run serially in the calling thread.
+    identities, where given, are the (site, username) of each value.
+    """
+
+    def __init__(self, cipher, key=None, max_workers=CRYPTO_WORKERS,
+                 min_parallel=CRYPTO_MIN_PARALLEL):
+        self.cipher = cipher
+        self.key = key
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_parallel = min_parallel
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Pools are rarely needed, so their modules load on first use
+            from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+            import multiprocessing
+            if self.key is not None:
+                # spawn avoids forking a process that holds SQLite handles and locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.key, self.cipher.storage_format)
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _chunk_size(self, count):
+        """Aims for a few chunks per worker so uneven chunks balance out"""
+        return max(CRYPTO_MIN_CHUNK, -(-count // (self.max_workers * 4)))
+
+    def _run(self, chunk_function, values, identities):
+        values = list(values)
+        items = list(zip(values, identities)) if identities is not None else [(v, None) for v in values]
+        if len(items) < self.min_parallel or self.max_workers < 2:
+            return chunk_function(items, self.cipher)
+
+        size = self._chunk_size(len(items))
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        executor = self._get_executor()
+        if self.key is not None:
+            results = executor.map(chunk_function, chunks)
+        else:
+            results = executor.map(chunk_function, chunks, [self.cipher] * len(chunks))
+        return [value for chunk in results for value in chunk]
+
+    def encrypt_many(self, values, identities=None):
+        """Encrypts a sequence of bytes values, preserving order"""
+        return self._run(_encrypt_chunk, values, identities)
+
+    def decrypt_many(self, tokens, identities=None):
+        """Decrypts a sequence of tokens, preserving order"""
+        return self._run(_decrypt_chunk, tokens, identities)
+
+    def rotate_many(self, tokens, identities=None):
+        """Re-encrypts tokens under the primary key, in the current format"""
+        return self._run(_rotate_chunk, tokens, identities)
+
+    def close(self):
+        """Shuts down the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
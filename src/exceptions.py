@@ -16,4 +16,12 @@ class DatabaseError(PasswordManagerError):
 
 class FileOperationError(PasswordManagerError):
     """Raised when file operations fail"""
-    pass 
\ No newline at end of file
+    pass
+
+class EncryptionError(PasswordManagerError):
+    """Raised when a value cannot be encrypted or decrypted with the loaded keys"""
+    pass
+
+class AgentError(PasswordManagerError):
+    """Raised when the background agent cannot be reached or rejects a request"""
+    pass
@@ -0,0 +1,40 @@
+import csv
+import json
+import os
+from .exceptions import ValidationError, FileOperationError
+
+EXPORT_FORMATS = ('csv', 'json')
+
+def _open_private(path):
+    """Opens path for writing, readable only by the current user"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    return os.fdopen(fd, 'w', newline='', encoding='utf-8')
+
+def write_export(entries, path, fmt='csv'):
+    """Streams decrypted entries to a file the importers can read back
+
+    entries yields objects with site, username, password and description.
+    Returns the number of entries written.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValidationError(f"Unsupported export format: {fmt}")
+    count = 0
+    try:
+        with _open_private(path) as f:
+            if fmt == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(['site', 'username', 'password', 'description'])
+                for entry in entries:
+                    writer.writerow([entry.site, entry.username, entry.password, entry.description])
+                    count += 1
+            else:
+                f.write('[')
+                for entry in entries:
+                    f.write(',\n' if count else '\n')
+                    json.dump({'site': entry.site, 'username': entry.username,
+                               'password': entry.password, 'description': entry.description}, f)
+                    count += 1
+                f.write('\n]\n')
+    except OSError as e:
+        raise FileOperationError(f"Failed to write export file: {e}")
+    return count
@@ -0,0 +1,157 @@
+import csv
+import json
+import re
+from urllib.parse import urlparse
+from .exceptions import ValidationError, FileOperationError
+
+IMPORT_FORMATS = ('auto', 'chrome', 'firefox', 'bitwarden-csv', 'bitwarden-json', 'csv', 'json')
+
+# Header columns that identify each CSV export
+_CSV_SIGNATURES = [
+    ('bitwarden-csv', {'login_uri', 'login_username', 'login_password'}),
+    ('firefox', {'url', 'username', 'password', 'httprealm'}),
+    ('chrome', {'name', 'url', 'username', 'password'}),
+    ('csv', {'site', 'username', 'password'}),
+]
+
+_JSON_ITEMS_KEY = re.compile(r'"items"\s*:\s*\[')
+_JSON_CHUNK_SIZE = 64 * 1024
+
+class ImportRow:
+    """A single credential read from an export file"""
+    __slots__ = ('line', 'site', 'username', 'password', 'description')
+
+    def __init__(self, line, site, username, password, description=''):
+        self.line = line
+        self.site = site
+        self.username = username
+        self.password = password
+        self.description = description
+
+def site_from_url(url, fallback=''):
+    """Derives a site name from a login URL"""
+    url = (url or '').strip()
+    if url:
+        parsed = urlparse(url if '://' in url else f'//{url}')
+        if parsed.hostname:
+            return parsed.hostname
+    return (fallback or '').strip()
+
+def detect_format(path):
+    """Guesses the export format from the file extension and header"""
+    if str(path).lower().endswith('.json'):
+        return 'json'
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            header = {column.strip().lower() for column in next(csv.reader(f), [])}
+    except OSError as e:
+        raise FileOperationError(f"Failed to read import file: {e}")
+    for fmt, columns in _CSV_SIGNATURES:
+        if columns <= header:
+            return fmt
+    raise ValidationError("Unrecognized import file format")
+
+def _row_from_csv(fmt, line, record):
+    """Maps a CSV record onto an ImportRow"""
+    get = lambda key: (record.get(key) or '').strip()
+    if fmt == 'bitwarden-csv':
+        if get('type') not in ('', 'login'):
+            raise ValidationError(f"Skipping non-login item of type {get('type')}")
+        return ImportRow(line, site_from_url(get('login_uri'), get('name')),
+                         get('login_username'), record.get('login_password') or '',
+                         get('notes'))
+    if fmt == 'firefox':
+        return ImportRow(line, site_from_url(get('url')), get('username'),
+                         record.get('password') or '')
+    if fmt == 'chrome':
+        return ImportRow(line, site_from_url(get('url'), get('name')), get('username'),
+                         record.get('password') or '', get('note'))
+    return ImportRow(line, get('site'), get('username'), record.get('password') or '',
+                     get('description'))
+
+def _row_from_json(index, item):
+    """Maps a Bitwarden item or a plain site/username/password object onto an ImportRow"""
+    if not isinstance(item, dict):
+        raise ValidationError("Expected an object")
+    if 'login' in item or 'type' in item:
+        login = item.get('login') or {}
+        if item.get('type', 1) != 1 or not login:
+            raise ValidationError("Skipping non-login item")
+        uris = login.get('uris') or []
+        url = uris[0].get('uri', '') if uris else ''
+        return ImportRow(index, site_from_url(url, item.get('name', '')),
+                         (login.get('username') or '').strip(), login.get('password') or '',
+                         (item.get('notes') or '').strip())
+    return ImportRow(index, (item.get('site') or '').strip(), (item.get('username') or '').strip(),
+                     item.get('password') or '', (item.get('description') or '').strip())
+
+def _iter_json_array(f):
+    """Yields the elements of the credentials array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    buffer = f.read(_JSON_CHUNK_SIZE)
+    eof = not buffer
+    stripped = buffer.lstrip()
+    if stripped.startswith('['):
+        pos = len(buffer) - len(stripped) + 1
+    else:
+        # Bitwarden exports keep the entries under a top-level "items" key
+        while True:
+            match = _JSON_ITEMS_KEY.search(buffer)
+            if match or eof:
+                break
+            chunk = f.read(_JSON_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+        if not match:
+            raise ValidationError("No credential list found in JSON file")
+        pos = match.end()
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            if eof:
+                raise ValidationError("Malformed JSON in import file")
+            chunk = f.read(_JSON_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+        # Drop consumed text so memory stays bounded by the largest item
+        buffer = buffer[end:]
+        pos = 0
+
+def iter_import_rows(path, fmt='auto'):
+    """Streams credentials from an export file
+
+    Yields ImportRow objects, or ValidationError instances for records
+    that cannot be mapped, so callers can report them and carry on.
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValidationError(f"Unsupported import format: {fmt}")
+    if fmt == 'auto':
+        fmt = detect_format(path)
+    try:
+        if fmt in ('bitwarden-json', 'json'):
+            with open(path, encoding='utf-8-sig') as f:
+                for index, item in enumerate(_iter_json_array(f), 1):
+                    try:
+                        yield _row_from_json(index, item)
+                    except ValidationError as e:
+                        yield ValidationError(f"Item {index}: {e}")
+        else:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                reader = csv.DictReader(f)
+                reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+                for record in reader:
+                    try:
+                        yield _row_from_csv(fmt, reader.line_num, record)
+                    except ValidationError as e:
+                        yield ValidationError(f"Line {reader.line_num}: {e}")
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        raise FileOperationError(f"Failed to read import file: {e}")
@@ -0,0 +1,244 @@
+"""Opt-in timing of KDF, SQLite and encryption work.
+
+Nothing here runs unless enable() is called: it replaces the methods of
+the instrumented classes with timing wrappers, and disable() puts the
+originals back, so a normal run pays no overhead at all. Only this
+project's own classes are wrapped; Fernet work is timed through
+RecordCipher, which every stored value passes through.
+
+Each operation records a latency histogram, its total and self time (time
+not spent in other instrumented operations, so phases add up to the wall
+clock), rows returned and bytes decrypted. Operations slower than the
+threshold are written to the slow-operation log.
+"""
+import bisect
+import inspect
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from .exceptions import FileOperationError
+from .config import SLOW_OPERATION_MS, SLOW_OPERATION_LOG
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+slow_log = logging.getLogger('password_manager.slow')
+
+class OperationStats:
+    """Aggregated timings for one instrumented operation"""
+
+    __slots__ = ('name', 'phase', 'calls', 'total', 'own', 'max', 'rows', 'bytes', 'buckets')
+
+    def __init__(self, name, phase):
+        self.name = name
+        self.phase = phase
+        self.calls = 0
+        self.total = 0.0
+        self.own = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def record(self, elapsed, own, rows=None, nbytes=None):
+        self.calls += 1
+        self.total += elapsed
+        self.own += own
+        self.max = max(self.max, elapsed)
+        self.rows += rows or 0
+        self.bytes += nbytes or 0
+        self.buckets[bisect.bisect_left(BUCKETS_MS, elapsed * 1000)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound in ms of the bucket holding the given fraction of calls"""
+        threshold = fraction * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return self.max * 1000
+
+
+class Profiler:
+    """Collects OperationStats and tracks nesting per thread"""
+
+    def __init__(self, slow_ms=SLOW_OPERATION_MS):
+        self.slow_ms = slow_ms
+        self.started = time.perf_counter()
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self):
+        self._stack().append(0.0)
+        return time.perf_counter()
+
+    def _exit(self, start):
+        """Returns (elapsed, own) and charges elapsed to the enclosing operation"""
+        elapsed = time.perf_counter() - start
+        stack = self._stack()
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        return elapsed, elapsed - children
+
+    def record(self, name, phase, elapsed, own, rows=None, nbytes=None):
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = OperationStats(name, phase)
+            stats.record(elapsed, own, rows, nbytes)
+        if self.slow_ms is not None and elapsed * 1000 >= self.slow_ms:
+            slow_log.warning("%s took %.1f ms (self %.1f ms, rows %s)",
+                             name, elapsed * 1000, own * 1000, rows)
+
+    def wrap(self, function, name, phase, measure=None):
+        """Returns a timing wrapper around function
+
+        measure(result) returns (rows, bytes) for the call. Generator
+        functions are timed across every step and recorded when exhausted.
+        """
+        profiler = self
+
+        if inspect.isgeneratorfunction(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                generator = function(*args, **kwargs)
+                total = own = 0.0
+                rows = 0
+                try:
+                    while True:
+                        start = profiler._enter()
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed, step_own = profiler._exit(start)
+                            total += elapsed
+                            own += step_own
+                        rows += 1
+                        yield item
+                finally:
+                    generator.close()
+                    profiler.record(name, phase, total, own, rows)
+            return wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = profiler._enter()
+            result = None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            finally:
+                elapsed, own = profiler._exit(start)
+                rows, nbytes = measure(result) if measure and result is not None else _count(result)
+                profiler.record(name, phase, elapsed, own, rows, nbytes)
+        return wrapper
+
+    def report(self, stream):
+        """Writes the per-phase and per-operation breakdown"""
+        wall = time.perf_counter() - self.started
+        with self._lock:
+            stats = sorted(self.stats.values(), key=lambda s: s.own, reverse=True)
+        phases = {}
+        for s in stats:
+            phases[s.phase] = phases.get(s.phase, 0.0) + s.own
+        phases['other'] = max(0.0, wall - sum(phases.values()))
+
+        ms = lambda seconds: f"{seconds * 1000:.1f}"
+        stream.write(f"\nProfile ({ms(wall)} ms wall)\n")
+        stream.write(f"{'phase':<12}{'self ms':>10}{'share':>8}\n")
+        for phase, own in sorted(phases.items(), key=lambda item: item[1], reverse=True):
+            share = own / wall * 100 if wall else 0
+            stream.write(f"{phase:<12}{ms(own):>10}{share:>7.1f}%\n")
+
+        stream.write(f"\n{'operation':<36}{'calls':>7}{'total ms':>10}{'self ms':>9}"
+                     f"{'p50':>8}{'p95':>8}{'max':>9}{'rows':>8}{'bytes':>10}\n")
+        for s in stats:
+            stream.write(f"{s.name:<36}{s.calls:>7}{ms(s.total):>10}{ms(s.own):>9}"
+                         f"{s.percentile(0.5):>8}{s.percentile(0.95):>8}{ms(s.max):>9}"
+                         f"{s.rows:>8}{s.bytes:>10}\n")
+
+
+def _count(result):
+    """Default (rows, bytes) for a call: the length of list results"""
+    if isinstance(result, (list, tuple)):
+        return len(result), None
+    return None, None
+
+def _decrypted_bytes(result):
+    return None, len(result)
+
+def _decrypted_batch(result):
+    return len(result), sum(len(value) for value in result)
+
+
+_profiler = None
+_originals = []
+
+def get_profiler():
+    """Returns the active Profiler, or None when instrumentation is off"""
+    return _profiler
+
+def instrument(owner, names, phase, prefix=None, measure=None):
+    """Wraps the named attributes of a class or module with the profiler"""
+    prefix = prefix or getattr(owner, '__name__', str(owner))
+    for name in names:
+        original = vars(owner)[name]
+        function = original.__func__ if isinstance(original, staticmethod) else original
+        wrapped = _profiler.wrap(function, f"{prefix}.{name}", phase, measure)
+        setattr(owner, name, staticmethod(wrapped) if isinstance(original, staticmethod) else wrapped)
+        _originals.append((owner, name, original))
+
+def enable(slow_ms=SLOW_OPERATION_MS, log_file=SLOW_OPERATION_LOG):
+    """Starts profiling the KDF, encryption and database layers"""
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    if slow_ms is not None and log_file and not slow_log.handlers:
+        try:
+            directory = os.path.dirname(log_file)
+            if directory:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+            handler = logging.FileHandler(log_file)
+        except OSError as e:
+            raise FileOperationError(f"Failed to open the slow-operation log: {e}")
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_log.addHandler(handler)
+    _profiler = Profiler(slow_ms)
+
+    from .encryption import PasswordHasher, Encryption, BatchCipher, RecordCipher
+    from .database.database_manager import DatabaseManager
+
+    instrument(PasswordHasher, ('hash_password', 'verify_password'), 'kdf')
+    instrument(Encryption, ('generate_key', 'get_cipher_suite', 'derive_subkey', 'fingerprint'),
+               'cipher')
+    instrument(BatchCipher, ('encrypt_many', 'rotate_many'), 'cipher')
+    instrument(BatchCipher, ('decrypt_many',), 'cipher', measure=_decrypted_batch)
+    instrument(RecordCipher, ('encrypt', 'rotate', 'rebind'), 'cipher')
+    instrument(RecordCipher, ('decrypt',), 'cipher', measure=_decrypted_bytes)
+    # __init__ covers opening the connection and running migrations
+    methods = ['__init__'] + [name for name, value in vars(DatabaseManager).items()
+                              if callable(value) and not name.startswith('_')]
+    instrument(DatabaseManager, methods, 'sqlite')
+    return _profiler
+
+def disable():
+    """Restores the original methods and returns the finished Profiler"""
+    global _profiler
+    while _originals:
+        owner, name, original = _originals.pop()
+        setattr(owner, name, original)
+    profiler, _profiler = _profiler, None
+    return profiler
@@ -0,0 +1,98 @@
+import base64
+import hashlib
+import json
+import os
+import time
+from .exceptions import ValidationError, FileOperationError
+from .config import (
+    KDF_ALGORITHM, HASH_ITERATIONS, SCRYPT_N, SCRYPT_R, SCRYPT_P,
+    KDF_SETTINGS_FILE, KDF_TARGET_MS
+)
+
+KDF_ALGORITHMS = ('pbkdf2-sha256', 'scrypt')
+
+# Pre-format master key files hold a 16-byte salt and a 32-byte PBKDF2 hash
+LEGACY_SALT_LENGTH = 16
+LEGACY_ITERATIONS = 100000
+
+def default_params(algorithm):
+    """Returns the configured cost parameters for algorithm"""
+    if algorithm == 'pbkdf2-sha256':
+        return {'i': HASH_ITERATIONS}
+    if algorithm == 'scrypt':
+        return {'n': SCRYPT_N, 'r': SCRYPT_R, 'p': SCRYPT_P}
+    raise ValidationError(f"Unsupported KDF algorithm: {algorithm}")
+
+def derive(algorithm, params, password, salt):
+    """Runs the key derivation function and returns the 32-byte digest"""
+    if algorithm == 'pbkdf2-sha256':
+        return hashlib.pbkdf2_hmac('sha256', password, salt, params['i'])
+    if algorithm == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r + 1024 * 1024, dklen=32)
+    raise ValidationError(f"Unsupported KDF algorithm: {algorithm}")
+
+def encode(algorithm, params, salt, digest):
+    """Formats a self-describing hash: $algorithm$k=v,...$salt$digest"""
+    cost = ','.join(f"{name}={value}" for name, value in sorted(params.items()))
+    b64 = lambda data: base64.b64encode(data).decode().rstrip('=')
+    return f"${algorithm}${cost}${b64(salt)}${b64(digest)}".encode()
+
+def decode(stored):
+    """Parses a stored hash into (algorithm, params, salt, digest)"""
+    if not stored.startswith(b'$'):
+        return ('pbkdf2-sha256', {'i': LEGACY_ITERATIONS},
+                stored[:LEGACY_SALT_LENGTH], stored[LEGACY_SALT_LENGTH:])
+    try:
+        _, algorithm, cost, salt, digest = stored.decode().split('$')
+        params = {name: int(value) for name, value in
+                  (item.split('=') for item in cost.split(','))}
+        unb64 = lambda text: base64.b64decode(text + '=' * (-len(text) % 4))
+        return algorithm, params, unb64(salt), unb64(digest)
+    except ValueError as e:
+        raise ValidationError(f"Malformed master password hash: {e}")
+
+def load_settings(path=KDF_SETTINGS_FILE):
+    """Returns (algorithm, params) from the calibration file or the config defaults"""
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+        return settings['algorithm'], settings['params']
+    except FileNotFoundError:
+        return KDF_ALGORITHM, default_params(KDF_ALGORITHM)
+    except (OSError, ValueError, KeyError) as e:
+        raise FileOperationError(f"Failed to read KDF settings: {e}")
+
+def save_settings(algorithm, params, path=KDF_SETTINGS_FILE):
+    """Stores calibrated KDF parameters for future master password hashes"""
+    try:
+        with open(path, 'w') as f:
+            json.dump({'algorithm': algorithm, 'params': params}, f)
+    except OSError as e:
+        raise FileOperationError(f"Failed to save KDF settings: {e}")
+
+def _time_once(algorithm, params):
+    start = time.perf_counter()
+    derive(algorithm, params, b'calibration-password', os.urandom(16))
+    return (time.perf_counter() - start) * 1000
+
+def calibrate(algorithm=KDF_ALGORITHM, target_ms=KDF_TARGET_MS):
+    """Finds cost parameters that take about target_ms to verify on this host"""
+    if algorithm == 'pbkdf2-sha256':
+        # PBKDF2 cost is linear in the iteration count, so scale from a sample
+        sample = 20000
+        elapsed = min(_time_once(algorithm, {'i': sample}) for _ in range(3))
+        iterations = max(LEGACY_ITERATIONS, int(sample * target_ms / max(elapsed, 0.001)))
+        return {'i': round(iterations, -3)}
+
+    if algorithm == 'scrypt':
+        # Memory-hard cost grows with n; double it until the target is reached
+        params = {'n': 2 ** 14, 'r': SCRYPT_R, 'p': SCRYPT_P}
+        while params['n'] < 2 ** 20 and _time_once(algorithm, params) < target_ms / 2:
+            params['n'] *= 2
+        if _time_once(algorithm, params) < target_ms * 0.75 and params['n'] < 2 ** 20:
+            params['n'] *= 2
+        return params
+
+    raise ValidationError(f"Unsupported KDF algorithm: {algorithm}")
@@ -0,0 +1,364 @@
+"""Incremental sync between replicas of a vault.
+
+Every entry and history row carries a stable uuid, a version counter, the
+UTC time it was last modified and the replica that modified it, and
+deleting an entry leaves a tombstone (see migration 6). A delta holds the
+rows and tombstones whose change_seq is newer than a checkpoint, found
+through the change_seq indexes, so exporting or applying one costs time
+in proportion to the changes, not to the size of the vault.
+
+A delta file is encrypted like a backup archive (see backup.py) and holds
+JSON lines: a header, then one record per row. Passwords travel as
+plaintext inside the encrypted stream and are re-encrypted under the
+receiving vault's key, so replicas need not share a key file.
+
+Conflicts are resolved per row by last writer wins on the clock
+(modified, version, origin), so every replica keeps the same version of
+a row whichever order deltas arrive in. Each entry also carries a version
+vector counting the edits each replica made to it (see migration 8).
+The losing password is kept in history unless the winner's vector covers
+the loser's, which proves the winner was edited from the loser. It is
+stored under an id derived from the losing version, so both replicas
+record it once. The merged vector is sent back to the peer, so both
+replicas see later edits as descendants of both sides.
+"""
+import io
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from .exceptions import ValidationError, FileOperationError
+from .backup import EncryptedWriter, EncryptedReader
+from .database.database_manager import REPLICA_ID, SYNC_PEERS
+
+DELTA_FORMAT = 'pm-delta'
+DELTA_VERSION = 2
+# Version 1 deltas have no version vectors; their entries count as ancestors
+SUPPORTED_VERSIONS = (1, 2)
+
+CLOCK_COLUMNS = 'modified, version, origin'
+
+
+def _change_seq(c):
+    c.execute("SELECT value FROM vault_meta WHERE key = 'change_seq'")
+    return int(c.fetchone()[0])
+
+def _peers(c):
+    c.execute("SELECT value FROM vault_meta WHERE key = ?", (SYNC_PEERS,))
+    row = c.fetchone()
+    return json.loads(row[0]) if row else {}
+
+def _clock(record):
+    return (record['modified'], record['version'], record['origin'])
+
+def _merge_vclocks(first, second):
+    return {replica: max(first.get(replica, 0), second.get(replica, 0))
+            for replica in first.keys() | second.keys()}
+
+def _descends(vclock, ancestor):
+    """Tells whether the version with vclock was edited from the one with ancestor"""
+    return all(vclock.get(replica, 0) >= count for replica, count in ancestor.items())
+
+def _write(stream, record):
+    stream.write(json.dumps(record).encode())
+    stream.write(b'\n')
+
+def new_replica(db_manager):
+    """Gives a copied or restored vault a replica id of its own
+
+    A copy keeps the id of the vault it came from, so the two would break
+    ties between their edits the same way and share version vector
+    counts. The peer checkpoints are dropped as well, since they describe
+    the other vault's exchanges; the first delta from each peer then has
+    to be a full one. Returns the new sync status.
+    """
+    with db_manager._transaction() as c:
+        replica_id = uuid.uuid4().hex
+        db_manager._set_meta(c, REPLICA_ID, replica_id)
+        db_manager._set_meta(c, SYNC_PEERS, {})
+    db_manager.replica_id = replica_id
+    return sync_status(db_manager)
+
+def sync_status(db_manager):
+    """Returns this replica's id, its change_seq and the peer checkpoints"""
+    seq = db_manager._fetchall("SELECT value FROM vault_meta WHERE key = 'change_seq'")[0][0]
+    return {'replica_id': db_manager.replica_id, 'change_seq': seq,
+            'peers': db_manager.get_meta(SYNC_PEERS, {})}
+
+def export_delta(db_manager, path, passphrase, since=None, peer=None):
+    """Writes the changes made after a checkpoint to an encrypted delta file
+
+    The checkpoint is since, or the last export to peer, or 0 for the
+    whole vault. Exporting for a peer moves its checkpoint past this
+    delta. Returns the header with the record counts; its change_seq is
+    the checkpoint for the next delta.
+    """
+    decrypt = db_manager.cipher.decrypt
+    counts = {'entries': 0, 'history': 0, 'tombstones': 0}
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'wb') as f, EncryptedWriter(f, passphrase) as stream:
+            # One transaction, so the delta is a consistent cut at change_seq
+            with db_manager._transaction() as c:
+                peers = _peers(c)
+                state = peers.get(peer, {}) if peer else {}
+                follows = since
+                if since is None:
+                    since, follows = state.get('sent', 0), state.get('exported', 0)
+                header = {'format': DELTA_FORMAT, 'version': DELTA_VERSION,
+                          'replica': db_manager.replica_id, 'since': since, 'follows': follows,
+                          'change_seq': _change_seq(c), 'created': time.time()}
+                _write(stream, header)
+
+                c.execute(f"""SELECT uuid, site, username, password, description, vclock,
+                                     {CLOCK_COLUMNS}
+                              FROM passwords WHERE change_seq > ? ORDER BY change_seq""", (since,))
+                for row_uuid, site, username, token, description, vclock, *clock in c.fetchall():
+                    _write(stream, {'type': 'entry', 'uuid': row_uuid, 'site': site,
+                                    'username': username,
+                                    'password': decrypt(token, (site, username)).decode(),
+                                    'description': description, 'vclock': json.loads(vclock),
+                                    **dict(zip(('modified', 'version', 'origin'), clock))})
+                    counts['entries'] += 1
+
+                c.execute(f"""SELECT uuid, site, username, old_password, changed_date, {CLOCK_COLUMNS}
+                              FROM password_history WHERE change_seq > ? ORDER BY change_seq""",
+                          (since,))
+                for row_uuid, site, username, token, changed_date, *clock in c.fetchall():
+                    _write(stream, {'type': 'history', 'uuid': row_uuid, 'site': site,
+                                    'username': username,
+                                    'password': decrypt(token, (site, username)).decode(),
+                                    'changed_date': changed_date,
+                                    **dict(zip(('modified', 'version', 'origin'), clock))})
+                    counts['history'] += 1
+
+                c.execute(f"""SELECT uuid, site, username, {CLOCK_COLUMNS}
+                              FROM tombstones WHERE change_seq > ? ORDER BY change_seq""", (since,))
+                for row_uuid, site, username, *clock in c.fetchall():
+                    _write(stream, {'type': 'tombstone', 'uuid': row_uuid, 'site': site,
+                                    'username': username,
+                                    **dict(zip(('modified', 'version', 'origin'), clock))})
+                    counts['tombstones'] += 1
+
+                if peer:
+                    state['sent'] = state['exported'] = header['change_seq']
+                    peers[peer] = state
+                    db_manager._set_meta(c, SYNC_PEERS, peers)
+    except OSError as e:
+        raise FileOperationError(f"Failed to write delta: {e}")
+    return {**header, **counts}
+
+def apply_delta(db_manager, path, passphrase, peer=None):
+    """Merges an encrypted delta file into the vault in one transaction
+
+    With peer, refuses a delta that does not follow the last one applied
+    from that peer, since the changes in between would be missing.
+    Returns the header with counts of records applied, already present
+    and older than the local row, of entries deleted, and of conflicts,
+    edits made on both sides where the losing password went to history.
+    """
+    counts = {'applied': 0, 'unchanged': 0, 'outdated': 0, 'deleted': 0, 'conflicts': 0}
+    try:
+        with open(path, 'rb') as f, EncryptedReader(f, passphrase) as stream:
+            lines = io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8')
+            try:
+                header = json.loads(next(lines))
+            except (StopIteration, ValueError):
+                raise ValidationError("Not a sync delta")
+            if header.get('format') != DELTA_FORMAT:
+                raise ValidationError("Not a sync delta")
+            if header.get('version') not in SUPPORTED_VERSIONS:
+                raise ValidationError(f"Unsupported delta version {header.get('version')}")
+
+            with db_manager._transaction() as c:
+                peers = _peers(c)
+                state = peers.get(peer, {}) if peer else {}
+                # follows is the change_seq of the delta exported before this one
+                if peer and header['follows'] > state.get('received', 0):
+                    raise ValidationError(
+                        f"This delta follows change {header['follows']} but only changes up to "
+                        f"{state.get('received', 0)} were applied from {peer}; export it again "
+                        f"with --since {state.get('received', 0)}")
+                seq_before = _change_seq(c)
+                merger = _Merger(db_manager, c, counts)
+                for line in lines:
+                    record = json.loads(line)
+                    handler = merger.handlers.get(record.get('type'))
+                    if handler is None:
+                        raise ValidationError(f"Unexpected record in delta: {record.get('type')}")
+                    handler(record)
+
+                if peer:
+                    state['received'] = max(state.get('received', 0), header['change_seq'])
+                    # The peer already has what it just sent; unless this
+                    # vault had other unsent changes, or merged version
+                    # vectors the peer lacks, don't echo it back.
+                    # 'exported' stays put, so the next delta still follows it
+                    if state.get('sent') == seq_before and not merger.echo:
+                        state['sent'] = _change_seq(c)
+                    peers[peer] = state
+                    db_manager._set_meta(c, SYNC_PEERS, peers)
+    except OSError as e:
+        raise FileOperationError(f"Failed to read delta: {e}")
+    return {**header, **counts}
+
+
+class _Merger:
+    """Applies delta records to the vault inside one open transaction"""
+
+    def __init__(self, db_manager, cursor, counts):
+        self.db = db_manager
+        self.c = cursor
+        self.counts = counts
+        # Set when a row now holds a version vector the sender does not have
+        self.echo = False
+        self.handlers = {'entry': self.entry, 'history': self.history,
+                         'tombstone': self.tombstone}
+
+    def _local_entry(self, where, params):
+        self.c.execute(f"""SELECT id, uuid, site, username, password, description, vclock,
+                                  {CLOCK_COLUMNS}
+                           FROM passwords WHERE {where}""", params)
+        row = self.c.fetchone()
+        if row is None:
+            return None
+        row_id, row_uuid, site, username, token, description, vclock, modified, version, origin = row
+        return {'id': row_id, 'uuid': row_uuid, 'site': site, 'username': username,
+                'token': token, 'description': description, 'vclock': json.loads(vclock),
+                'modified': modified, 'version': version, 'origin': origin}
+
+    def _password(self, entry):
+        if 'password' not in entry:
+            entry['password'] = self.db.cipher.decrypt(
+                entry['token'], (entry['site'], entry['username'])).decode()
+        return entry['password']
+
+    def _archive(self, loser, winner):
+        """Keeps the losing side of a conflict in the winner's history
+
+        Both replicas derive the same history row from the same pair, so
+        the archived password is recorded once however the deltas cross.
+        Version vectors only relate versions of the same entry.
+        """
+        related = loser['uuid'] == winner['uuid']
+        if (related and _descends(winner['vclock'], loser['vclock'])) or \
+                self._password(loser) == self._password(winner):
+            return  # the winner was edited from the loser, or nothing is lost
+        account = (winner['site'], winner['username'])
+        row_uuid = uuid.uuid5(uuid.NAMESPACE_OID, '\0'.join(
+            ('conflict', loser['uuid'], str(loser['version']), loser['modified'], loser['origin'])
+        )).hex
+        changed_date = datetime.fromisoformat(winner['modified']).astimezone()
+        self.counts['conflicts'] += 1
+        self.c.execute(f"""INSERT OR IGNORE INTO password_history
+                           (site, username, old_password, changed_date, uuid, {CLOCK_COLUMNS})
+                           VALUES (?, ?, ?, ?, ?, ?, 1, ?)""",
+                       (*account, self.db.cipher.encrypt(self._password(loser).encode(), account),
+                        changed_date.strftime("%Y-%m-%d %H:%M:%S"), row_uuid,
+                        winner['modified'], winner['origin']))
+
+    def _tombstoned(self, record):
+        self.c.execute(f"SELECT {CLOCK_COLUMNS} FROM tombstones WHERE uuid = ?", (record['uuid'],))
+        row = self.c.fetchone()
+        return row is not None and tuple(row) >= _clock(record)
+
+    def _merge_into(self, local, record):
+        """Stores the union of both version vectors on the local row"""
+        merged = _merge_vclocks(local['vclock'], record['vclock'])
+        if merged != local['vclock']:
+            self.c.execute("UPDATE passwords SET vclock = ? WHERE id = ?",
+                           (json.dumps(merged), local['id']))
+        self.echo = self.echo or merged != record['vclock']
+
+    def entry(self, record):
+        record.setdefault('vclock', {})
+        if self._tombstoned(record):
+            self.counts['unchanged'] += 1
+            return
+        account = (record['site'], record['username'])
+        local = self._local_entry("uuid = ?", (record['uuid'],))
+
+        # The same account created separately on two replicas, or renamed
+        # onto an existing one: the two entries are resolved like versions
+        other = self._local_entry("site = ? AND username = ? AND uuid != ?",
+                                  (*account, record['uuid']))
+        if other is not None:
+            if _clock(other) > _clock(record):
+                self._archive(record, other)
+                self.counts['outdated'] += 1
+                return
+            self._archive(other, record)
+            self.c.execute("DELETE FROM passwords WHERE id = ?", (other['id'],))
+            self.db._invalidate(account)
+
+        if local is None:
+            self.c.execute(f"""INSERT INTO passwords
+                               (site, username, password, description, fingerprint,
+                                uuid, vclock, {CLOCK_COLUMNS})
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                           (*account, self.db.cipher.encrypt(record['password'].encode(), account),
+                            record['description'], self.db._fingerprint(record['password']),
+                            record['uuid'], json.dumps(record['vclock']), *_clock(record)))
+            self.counts['applied'] += 1
+            return
+
+        if _clock(local) == _clock(record):
+            self._merge_into(local, record)
+            self.counts['unchanged'] += 1
+            return
+        if _clock(local) > _clock(record):
+            self._archive(record, local)
+            self._merge_into(local, record)
+            self.counts['outdated'] += 1
+            return
+        self._archive(local, record)
+        merged = _merge_vclocks(local['vclock'], record['vclock'])
+        self.echo = self.echo or merged != record['vclock']
+        self.c.execute(f"""UPDATE passwords
+                           SET site = ?, username = ?, password = ?, description = ?,
+                               fingerprint = ?, vclock = ?, modified = ?, version = ?, origin = ?
+                           WHERE id = ?""",
+                       (*account, self.db.cipher.encrypt(record['password'].encode(), account),
+                        record['description'], self.db._fingerprint(record['password']),
+                        json.dumps(merged), *_clock(record), local['id']))
+        self.db._invalidate((local['site'], local['username']), account)
+        self.counts['applied'] += 1
+
+    def history(self, record):
+        account = (record['site'], record['username'])
+        self.c.execute(f"SELECT id, {CLOCK_COLUMNS} FROM password_history WHERE uuid = ?",
+                       (record['uuid'],))
+        row = self.c.fetchone()
+        if row is not None and tuple(row[1:]) >= _clock(record):
+            self.counts['unchanged'] += 1
+            return
+        token = self.db.cipher.encrypt(record['password'].encode(), account)
+        if row is None:
+            self.c.execute(f"""INSERT INTO password_history
+                               (site, username, old_password, changed_date, uuid, {CLOCK_COLUMNS})
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                           (*account, token, record['changed_date'], record['uuid'],
+                            *_clock(record)))
+        else:
+            self.c.execute(f"""UPDATE password_history
+                               SET site = ?, username = ?, old_password = ?, changed_date = ?,
+                                   modified = ?, version = ?, origin = ?
+                               WHERE id = ?""",
+                           (*account, token, record['changed_date'], *_clock(record), row[0]))
+        self.counts['applied'] += 1
+
+    def tombstone(self, record):
+        local = self._local_entry("uuid = ?", (record['uuid'],))
+        if local is not None:
+            if _clock(local) > _clock(record):
+                self.counts['outdated'] += 1  # edited after it was deleted elsewhere
+                return
+            self.c.execute("DELETE FROM passwords WHERE id = ?", (local['id'],))
+            self.db._invalidate((local['site'], local['username']))
+            self.counts['deleted'] += 1
+        elif self._tombstoned(record):
+            self.counts['unchanged'] += 1
+            return
+        self.db._add_tombstone(self.c, record['uuid'], record['site'], record['username'],
+                               record['version'], record['modified'], record['origin'])
@@ -1,5 +1,5 @@
 import re
-import platform
+import sys
 from .exceptions import ValidationError
 from .config import MIN_PASSWORD_LENGTH, MAX_DESCRIPTION_LENGTH
 
@@ -31,12 +31,12 @@ def sanitize_input(text):
 
 def make_file_hidden(filepath):
     """Makes a file hidden in the file system"""
-    if platform.system() == 'Windows':
+    if sys.platform == 'win32':
         import ctypes
         ctypes.windll.kernel32.SetFileAttributesW(filepath, 2)  # 2 = Hidden attribute
 
 def get_hidden_path(filename):
     """Creates a hidden file path based on the operating system"""
-    if platform.system() == 'Windows':
+    if sys.platform == 'win32':
         return filename
     return filename  # For Unix-like systems, dot prefix is enough 
\ No newline at end of file
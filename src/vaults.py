@@ -0,0 +1,215 @@
+"""Named vaults kept side by side in one vault directory.
+
+Each named vault is a subdirectory of the vault directory holding the
+usual database, key and master password files, so it has its own key,
+unlocks with its own master password, and its database only grows with
+its own accounts. The single vault in the working directory keeps
+working as before when no vault is named.
+
+VaultSet holds several unlocked vaults and answers list, search and audit
+queries from all of them at once. For list and search, every vault gets
+a reader thread that fetches pages into a short queue. At most
+VAULT_QUERY_WORKERS pages are being read at any moment. The pages are
+merged into one sorted stream as they arrive, so the first results show
+up before the slowest vault is done. If the caller stops early, the
+readers stop too.
+"""
+import heapq
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .exceptions import ValidationError, FileOperationError
+from .config import (
+    VAULT_DIR, VAULT_QUERY_WORKERS, VAULT_QUERY_PREFETCH, MASTER_KEY_FILE, DATABASE_FILE,
+    READ_BATCH_SIZE, SEARCH_LIMIT
+)
+from .database.search import fuzzy_score
+
+VAULT_NAME = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]{0,63}\Z')
+_DONE = object()
+
+
+def vault_path(name, vault_dir=VAULT_DIR):
+    """Returns the directory of the named vault"""
+    if not VAULT_NAME.match(name):
+        raise ValidationError(f"Invalid vault name {name!r}; use letters, digits, '.', '_' and '-'")
+    return os.path.join(vault_dir, name)
+
+def list_vaults(vault_dir=VAULT_DIR):
+    """Returns the names of the vaults in vault_dir, sorted"""
+    try:
+        names = os.listdir(vault_dir)
+    except FileNotFoundError:
+        return []
+    except OSError as e:
+        raise FileOperationError(f"Failed to read vault directory {vault_dir}: {e}")
+    return sorted(name for name in names if VAULT_NAME.match(name)
+                  and os.path.exists(os.path.join(vault_dir, name, MASTER_KEY_FILE)))
+
+def vault_stats(vault_dir=VAULT_DIR):
+    """Returns the name and database size of every vault in vault_dir"""
+    stats = []
+    for name in list_vaults(vault_dir):
+        path = os.path.join(vault_dir, name, DATABASE_FILE)
+        size = sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+        stats.append({'name': name, 'bytes': size})
+    return stats
+
+
+class VaultSet:
+    """Several unlocked vaults queried together"""
+
+    def __init__(self, managers, max_workers=VAULT_QUERY_WORKERS):
+        # {vault name: unlocked PasswordManager}
+        self.managers = dict(managers)
+        self.max_workers = max(1, max_workers)
+
+    @classmethod
+    def open(cls, openers, max_workers=VAULT_QUERY_WORKERS):
+        """Unlocks vaults in parallel from {name: callable returning a manager}
+
+        The master password checks run at the same time, since the KDF
+        releases the GIL. If any vault fails to unlock, the others are
+        closed again and the first error is raised.
+        """
+        managers, error = {}, None
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(openers))),
+                                thread_name_prefix='vault-open') as executor:
+            futures = {executor.submit(opener): name for name, opener in openers.items()}
+            for future in as_completed(futures):
+                try:
+                    managers[futures[future]] = future.result()
+                except Exception as e:
+                    error = error or e
+        if error is not None:
+            for manager in managers.values():
+                manager.close()
+            raise error
+        # Keep the caller's order, which breaks ties between vaults
+        return cls({name: managers[name] for name in openers}, max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes every vault"""
+        for manager in self.managers.values():
+            manager.close()
+
+    def iter_entries(self, decrypt=False, batch_size=READ_BATCH_SIZE):
+        """Yields (vault, entry) for every entry of every vault
+
+        Entries come ordered by site, username and vault, as if the
+        vaults were one.
+        """
+        def pages(name, db):
+            after = None
+            while True:
+                page = db.get_passwords_page(batch_size, after, decrypt)
+                yield [((entry.site, entry.username), name, entry) for entry in page]
+                if len(page) < batch_size:
+                    return
+                after = page[-1].key
+        return self._merge(pages)
+
+    def search(self, query, mode='substring', limit=SEARCH_LIMIT):
+        """Yields up to limit (vault, entry) matches across all vaults
+
+        Each vault returns its own best limit matches; fuzzy matches are
+        merged by score, the others by site and username.
+        """
+        needle = query.strip().lower()
+
+        def sort_key(entry):
+            if mode == 'fuzzy':
+                return (-fuzzy_score(needle, (entry.site, entry.username, entry.description)),
+                        entry.site, entry.username)
+            return (entry.site, entry.username)
+
+        def pages(name, db):
+            yield sorted(((sort_key(entry), name, entry)
+                          for entry in db.search_passwords(query, mode, limit)),
+                         key=lambda item: item[:2])
+        return (match for match, _ in zip(self._merge(pages), range(limit)))
+
+    def run(self, function):
+        """Calls function(db_manager) on every vault in parallel
+
+        Yields (vault, result) as each vault finishes.
+        """
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(self.managers)) or 1,
+                                thread_name_prefix='vault-query') as executor:
+            futures = {executor.submit(function, manager.db_manager): name
+                       for name, manager in self.managers.items()}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def _merge(self, pages):
+        """Merges sorted (key, vault, item) pages from every vault into one stream
+
+        pages(name, db_manager) yields lists of such tuples, each vault's
+        in ascending order. Yields (vault, item).
+        """
+        stop = threading.Event()
+        slots = threading.BoundedSemaphore(self.max_workers)
+        queues, threads = [], []
+        for name, manager in self.managers.items():
+            out = queue.Queue(VAULT_QUERY_PREFETCH)
+            thread = threading.Thread(target=self._read, name=f'vault-query-{name}', daemon=True,
+                                      args=(pages(name, manager.db_manager), out, slots, stop))
+            thread.start()
+            queues.append(out)
+            threads.append(thread)
+        try:
+            merged = heapq.merge(*(self._drain(out) for out in queues), key=lambda item: item[:2])
+            for _, name, item in merged:
+                yield name, item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def _read(pages, out, slots, stop):
+        """Moves one vault's pages into its queue until done or stopped"""
+        try:
+            while not stop.is_set():
+                with slots:
+                    page = next(pages, _DONE)
+                if page is _DONE:
+                    break
+                if page and not VaultSet._put(out, page, stop):
+                    return
+        except Exception as e:
+            VaultSet._put(out, e, stop)
+            return
+        VaultSet._put(out, _DONE, stop)
+
+    @staticmethod
+    def _put(out, item, stop):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _drain(out):
+        while True:
+            item = out.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield from item
@@ -0,0 +1,35 @@
+"""Shared fixtures: throwaway vaults in temporary directories."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MASTER_PASSWORD = 'test-master-password'
+
+
+class VaultTestCase(unittest.TestCase):
+    """Runs each test in its own empty working directory"""
+
+    def setUp(self):
+        self._previous = os.getcwd()
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self._previous)
+        self._directory.cleanup()
+
+    def open_vault(self, directory='.', **options):
+        """Opens (creating if needed) the vault in directory"""
+        from password_manager import PasswordManager
+        previous = os.getcwd()
+        os.chdir(directory)
+        try:
+            pm = PasswordManager(MASTER_PASSWORD, **options)
+        finally:
+            os.chdir(previous)
+        self.addCleanup(pm.close)
+        return pm
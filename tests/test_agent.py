@@ -0,0 +1,52 @@
+import os
+import stat
+import unittest
+
+from tests.helpers import VaultTestCase
+from src.agent import PasswordAgent
+from src.agent_client import check_socket_dir
+from src.exceptions import AgentError
+
+
+class SocketDirTest(VaultTestCase):
+
+    def test_creates_private_directory(self):
+        check_socket_dir('runtime', create=True)
+        self.assertEqual(stat.S_IMODE(os.lstat('runtime').st_mode), 0o700)
+        check_socket_dir('runtime')
+
+    def test_missing_directory_is_not_created_for_clients(self):
+        with self.assertRaises(AgentError):
+            check_socket_dir('runtime')
+        self.assertFalse(os.path.exists('runtime'))
+
+    def test_refuses_symlink(self):
+        os.mkdir('elsewhere', 0o700)
+        os.symlink('elsewhere', 'runtime')
+        with self.assertRaisesRegex(AgentError, 'not a directory'):
+            check_socket_dir('runtime', create=True)
+
+    def test_refuses_open_mode(self):
+        os.mkdir('runtime')
+        os.chmod('runtime', 0o755)
+        with self.assertRaisesRegex(AgentError, '0700'):
+            check_socket_dir('runtime', create=True)
+
+
+class DispatchTest(VaultTestCase):
+
+    def test_unexpected_error_becomes_error_response(self):
+        agent = PasswordAgent(self.open_vault(), os.path.join(self.directory, 'agent.sock'))
+        self.addCleanup(agent.lock)
+
+        def fail(message):
+            raise RuntimeError("secret detail")
+        agent._operations['get'] = fail
+        response = agent.dispatch({'op': 'get', 'site': 'x.example', 'username': 'me'})
+        self.assertEqual(response, {'ok': False, 'type': 'AgentError',
+                                    'error': "Request failed with RuntimeError"})
+        self.assertEqual(agent.dispatch({'op': 'ping'}), {'ok': True, 'result': 'pong'})
+
+
+if __name__ == '__main__':
+    unittest.main()
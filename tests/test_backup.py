@@ -0,0 +1,57 @@
+import os
+import unittest
+
+from tests.helpers import MASTER_PASSWORD, VaultTestCase
+from src.backup import restore_backup
+
+
+class IncrementalRestoreTest(VaultTestCase):
+
+    def test_reused_row_id_survives_incremental_restore(self):
+        pm = self.open_vault()
+        db = pm.db_manager
+        db.add_password('a.example', 'alice', 'first-password')
+        db.add_password('b.example', 'bob', 'second-password')
+        pm.backup('full.pmb', MASTER_PASSWORD)
+        # SQLite hands the deleted highest id to the next insert
+        db.delete_password('b.example', 'bob')
+        db.add_password('c.example', 'carol', 'third-password')
+        pm.backup('incremental.pmb', MASTER_PASSWORD, incremental=True)
+        pm.close()
+
+        restore_backup('full.pmb', MASTER_PASSWORD, 'restored')
+        restore_backup('incremental.pmb', MASTER_PASSWORD, 'restored')
+        restored = self.open_vault('restored').db_manager
+        self.assertEqual([(site, username) for site, username, *_ in restored.get_passwords()],
+                         [('a.example', 'alice'), ('c.example', 'carol')])
+        self.assertEqual(restored.get_password('c.example', 'carol'), 'third-password')
+
+    def test_incremental_restore_carries_policies_and_settings(self):
+        pm = self.open_vault()
+        db = pm.db_manager
+        db.add_password('a.example', 'alice', 'first-password')
+        db.set_history_policy(keep_last=5, site='a.example', username='alice')
+        pm.backup('full.pmb', MASTER_PASSWORD)
+        db.set_history_policy(keep_last=1)
+        db.set_history_policy(max_age_days=30, site='b.example', username='bob')
+        db.set_history_policy(site='a.example', username='alice')
+        pm.backup('incremental.pmb', MASTER_PASSWORD, incremental=True)
+        expected = {key: db.get_meta(key) for key in ('history_policy', 'storage_format')}
+        pm.close()
+
+        restore_backup('full.pmb', MASTER_PASSWORD, 'restored')
+        restore_backup('incremental.pmb', MASTER_PASSWORD, 'restored')
+        restored = self.open_vault('restored').db_manager
+        self.assertEqual(restored.get_history_policy(), policy(1, None, False))
+        self.assertEqual(restored.get_history_policy('b.example', 'bob'), policy(None, 30, True))
+        self.assertEqual(restored.get_history_policy('a.example', 'alice'), policy(1, None, False))
+        self.assertEqual({key: restored.get_meta(key) for key in expected}, expected)
+
+
+def policy(keep_last, max_age_days, account):
+    return {'keep_last': keep_last, 'max_age_days': max_age_days, 'account': account}
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import unittest
+
+from tests.helpers import VaultTestCase
+from src.audit.breaches import BreachCorpus, convert_corpus
+from src.exceptions import FileOperationError, ValidationError
+
+
+def dump_line(password, count=1):
+    return f"{hashlib.sha1(password.encode()).hexdigest().upper()}:{count}\n"
+
+
+class ConvertCorpusCleanupTest(VaultTestCase):
+
+    def write_dump(self, *lines):
+        with open('dump.txt', 'w') as f:
+            f.writelines(lines)
+
+    def test_bad_line_leaves_no_run_files(self):
+        self.write_dump(dump_line('one'), dump_line('two'), dump_line('three'), 'not-a-hash\n')
+        with self.assertRaises(ValidationError):
+            convert_corpus('dump.txt', 'corpus.bin', 'corpus.bloom', chunk_records=2)
+        self.assertEqual(sorted(os.listdir('.')), ['dump.txt'])
+
+    def test_write_failure_removes_partial_outputs(self):
+        self.write_dump(dump_line('one'), dump_line('two'))
+        os.mkdir('corpus.bin')
+        with self.assertRaises(FileOperationError):
+            convert_corpus('dump.txt', 'corpus.bin', 'corpus.bloom', chunk_records=1)
+        self.assertEqual(sorted(os.listdir('.')), ['corpus.bin', 'dump.txt'])
+
+class BreachCorpusOpenTest(VaultTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with open('dump.txt', 'w') as f:
+            f.writelines([dump_line('one'), dump_line('two')])
+        convert_corpus('dump.txt', 'corpus.bin', 'corpus.bloom')
+
+    def test_missing_bloom_filter(self):
+        with self.assertRaises(FileOperationError):
+            BreachCorpus('corpus.bin', 'missing.bloom')
+
+    def test_truncated_bloom_filter(self):
+        for size in (0, 4, 40):
+            with open('corpus.bloom', 'r+b') as f:
+                f.truncate(size)
+            with self.assertRaises((FileOperationError, ValidationError)):
+                BreachCorpus('corpus.bin', 'corpus.bloom')
+
+    def test_intact_bloom_filter(self):
+        with BreachCorpus('corpus.bin', 'corpus.bloom') as corpus:
+            self.assertEqual(corpus.lookup(hashlib.sha1(b'one').digest()), 1)
+            self.assertEqual(corpus.lookup(hashlib.sha1(b'three').digest()), 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+from tests.helpers import VaultTestCase
+
+
+class EntryCacheTest(VaultTestCase):
+
+    def test_change_from_another_process_is_not_served_from_cache(self):
+        cached = self.open_vault(cache_size=16).db_manager
+        cached.add_password('x.example', 'me', 'first-pass')
+        self.assertEqual(cached.get_password('x.example', 'me'), 'first-pass')
+        self.assertEqual(cached.get_password('x.example', 'me'), 'first-pass')
+
+        other = self.open_vault().db_manager
+        other.update_password('x.example', 'me', 'second-pass')
+        self.assertEqual(cached.get_password('x.example', 'me'), 'second-pass')
+        self.assertEqual(cached.get_password('x.example', 'me'), 'second-pass')
+        self.assertEqual(cached.cache_stats()['hits'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from src.encryption import Encryption, RecordCipher
+from src.exceptions import EncryptionError
+
+
+class RecordCipherTest(unittest.TestCase):
+
+    def setUp(self):
+        key = Encryption.generate_key()
+        self.suite = Encryption.get_cipher_suite(key)
+        self.record = RecordCipher(self.suite, key, 'aead').encrypt(b'secret', ('x.example', 'me'))
+
+    def test_rebind_without_key_raises_encryption_error(self):
+        cipher = RecordCipher(self.suite)
+        with self.assertRaises(EncryptionError):
+            cipher.rebind(self.record, ('x.example', 'me'), ('y.example', 'me'))
+        with self.assertRaises(EncryptionError):
+            cipher.decrypt(self.record, ('x.example', 'me'))
+
+    def test_rebind_leaves_fernet_tokens_alone(self):
+        token = self.suite.encrypt(b'secret')
+        self.assertEqual(RecordCipher(self.suite).rebind(token, ('x.example', 'me'),
+                                                         ('y.example', 'me')), token)
+
+
+if __name__ == '__main__':
+    unittest.main()
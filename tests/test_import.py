@@ -0,0 +1,37 @@
+import unittest
+
+from tests.helpers import VaultTestCase
+
+
+class BulkImportCountsTest(VaultTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db = self.open_vault().db_manager
+        self.db.add_password('old.example', 'me', 'existing')
+
+    def test_merge_counts_repeated_accounts_once(self):
+        counts = self.db.add_passwords_bulk([
+            ('new.example', 'me', 'first', ''),
+            ('new.example', 'me', 'second', ''),
+            ('old.example', 'me', 'replaced', ''),
+            ('new.example', 'me', 'third', ''),
+        ], on_duplicate='merge')
+        self.assertEqual(counts, {'added': 1, 'updated': 3, 'skipped': 0})
+        self.assertEqual(self.db.get_password('new.example', 'me'), 'third')
+        self.assertEqual(sorted(password for password, _ in
+                                self.db.get_password_history('new.example', 'me')),
+                         ['first', 'second'])
+
+    def test_skip_counts_repeated_accounts_once(self):
+        counts = self.db.add_passwords_bulk([
+            ('new.example', 'me', 'first', ''),
+            ('new.example', 'me', 'second', ''),
+            ('old.example', 'me', 'replaced', ''),
+        ])
+        self.assertEqual(counts, {'added': 1, 'updated': 0, 'skipped': 2})
+        self.assertEqual(self.db.get_password('new.example', 'me'), 'first')
+
+
+if __name__ == '__main__':
+    unittest.main()
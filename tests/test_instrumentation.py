@@ -0,0 +1,41 @@
+import os
+import unittest
+
+from tests.helpers import VaultTestCase
+from src import instrumentation
+from src.encryption import RecordCipher
+
+
+class InstrumentationTest(VaultTestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+        for handler in list(instrumentation.slow_log.handlers):
+            instrumentation.slow_log.removeHandler(handler)
+            handler.close()
+        super().tearDown()
+
+    def test_wraps_own_classes_and_logs_to_configured_path(self):
+        from cryptography.fernet import Fernet
+        fernet_encrypt = Fernet.encrypt
+        log_file = os.path.join('state', 'password-manager', 'slow.log')
+        profiler = instrumentation.enable(slow_ms=0, log_file=log_file)
+
+        pm = self.open_vault()
+        pm.db_manager.add_password('x.example', 'me', 'secret-password')
+        self.assertEqual(pm.db_manager.get_password('x.example', 'me'), 'secret-password')
+        pm.close()
+
+        self.assertIs(Fernet.encrypt, fernet_encrypt)
+        self.assertIn('RecordCipher.encrypt', profiler.stats)
+        self.assertIn('RecordCipher.decrypt', profiler.stats)
+        instrumentation.disable()
+        self.assertNotIn('__wrapped__', vars(RecordCipher.encrypt))
+        for handler in instrumentation.slow_log.handlers:
+            handler.flush()
+        self.assertGreater(os.path.getsize(log_file), 0)
+        self.assertFalse([name for name in os.listdir('.') if name.endswith('.log')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import unittest
+
+from tests.helpers import VaultTestCase
+from src.config import DATABASE_FILE, ENCRYPTION_KEY_FILE
+from src.encryption import Encryption
+
+
+class StorageFormatTest(VaultTestCase):
+
+    def test_new_vault_uses_compact_records(self):
+        db = self.open_vault().db_manager
+        self.assertEqual(db.get_meta('storage_format'), 'aead')
+
+    def test_unmigrated_vault_keeps_fernet(self):
+        self.open_vault().close()
+        with open(ENCRYPTION_KEY_FILE, 'rb') as f:
+            suite = Encryption.get_cipher_suite(f.read().strip())
+        os.remove(DATABASE_FILE)
+        # The schema vaults had before migrations were versioned
+        conn = sqlite3.connect(DATABASE_FILE)
+        conn.execute("""CREATE TABLE passwords (site TEXT, username TEXT, password TEXT,
+                                                description TEXT DEFAULT '')""")
+        conn.execute("""CREATE TABLE password_history (site TEXT, username TEXT,
+                                                       old_password TEXT, changed_date TEXT)""")
+        conn.execute("INSERT INTO passwords VALUES (?, ?, ?, '')",
+                     ('x.example', 'me', suite.encrypt(b'old-password')))
+        conn.commit()
+        conn.close()
+
+        db = self.open_vault().db_manager
+        self.assertIsNone(db.get_meta('storage_format'))
+        self.assertEqual(db.get_password('x.example', 'me'), 'old-password')
+        db.add_password('y.example', 'me', 'new-password')
+        stats = db.storage_stats()
+        self.assertEqual(stats['storage_format'], 'fernet')
+        self.assertEqual(list(stats['formats']), ['fernet'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import random
+import string
+import unittest
+
+from src.audit.strength import MAX_LENGTH, StrengthEstimator
+
+
+class LongPasswordTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.estimator = StrengthEstimator()
+
+    def test_long_repetitive_passwords_stay_weak(self):
+        for password in ('a' * 200, 'abc' * 100, 'password' * 20, '1234' * (MAX_LENGTH + 1)):
+            score, _, pattern = self.estimator.estimate(password)
+            self.assertLessEqual(score, 1, password)
+            self.assertEqual(pattern, 'repeat')
+
+    def test_repetitive_tail_adds_its_pattern_cost(self):
+        head = 'xK9#mQ2$vL7@pR4!'
+        _, short_log10, _ = self.estimator.estimate(head)
+        _, long_log10, _ = self.estimator.estimate(head + 'a' * 150)
+        # A digit per character would add 150; a repeat of 'a' adds a few
+        self.assertLess(long_log10 - short_log10, 10)
+
+    def test_long_random_password_is_strong(self):
+        rng = random.Random(0)
+        password = ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(150))
+        score, log10, _ = self.estimator.estimate(password)
+        self.assertEqual(score, 4)
+        self.assertGreater(log10, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import unittest
+
+from tests.helpers import MASTER_PASSWORD, VaultTestCase
+from src.backup import restore_backup
+from src.sync import export_delta, apply_delta, new_replica
+
+
+class SyncTestCase(VaultTestCase):
+    """Syncs the vaults opened as self.a and self.b"""
+
+    def exchange(self, source, target, source_name, target_name):
+        path = f'{source_name}-to-{target_name}.delta'
+        export_delta(source, path, MASTER_PASSWORD, peer=target_name)
+        return apply_delta(target, path, MASTER_PASSWORD, peer=source_name)
+
+    def sync_both(self):
+        self.exchange(self.a, self.b, 'a', 'b')
+        return self.exchange(self.b, self.a, 'b', 'a')
+
+    def history(self, db):
+        return sorted(password for password, _ in db.get_password_history('x.example', 'me'))
+
+
+class ConflictTest(SyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.mkdir('a')
+        os.mkdir('b')
+        self.a = self.open_vault('a').db_manager
+        self.b = self.open_vault('b').db_manager
+
+    def test_losing_single_edit_is_archived(self):
+        self.a.add_password('x.example', 'me', 'original')
+        self.sync_both()
+        # One edit on a, then two later ones on b: b wins with a higher version
+        self.a.update_password('x.example', 'me', 'edited-on-a')
+        self.b.update_password('x.example', 'me', 'first-on-b')
+        self.b.update_password('x.example', 'me', 'second-on-b')
+        self.sync_both()
+        self.sync_both()
+
+        for db in (self.a, self.b):
+            self.assertEqual(db.get_password('x.example', 'me'), 'second-on-b')
+            self.assertIn('edited-on-a', self.history(db))
+        self.assertEqual(self.history(self.a), self.history(self.b))
+
+    def test_later_edits_are_not_archived_again(self):
+        self.a.add_password('x.example', 'me', 'original')
+        self.sync_both()
+        self.a.update_password('x.example', 'me', 'edited-on-a')
+        self.b.update_password('x.example', 'me', 'edited-on-b')
+        self.sync_both()
+        self.sync_both()
+        conflicts = self.history(self.a)
+
+        # A plain edit after the conflict descends from both sides
+        self.b.update_password('x.example', 'me', 'after-conflict')
+        counts = self.sync_both()
+        self.assertEqual(counts['conflicts'], 0)
+        for db in (self.a, self.b):
+            self.assertEqual(db.get_password('x.example', 'me'), 'after-conflict')
+            self.assertEqual(len(self.history(db)), len(conflicts) + 1)
+
+
+class CopiedReplicaTest(SyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.mkdir('a')
+        pm = self.open_vault('a')
+        pm.db_manager.add_password('x.example', 'me', 'original')
+        pm.close()
+        shutil.copytree('a', 'b')
+        self.a = self.open_vault('a').db_manager
+        self.b = self.open_vault('b').db_manager
+
+    def test_copy_becomes_a_new_replica(self):
+        self.assertEqual(self.a.replica_id, self.b.replica_id)
+        new_replica(self.b)
+        self.assertNotEqual(self.a.replica_id, self.b.replica_id)
+        # Reopening reads the id back from the vault
+        self.b = self.open_vault('b').db_manager
+        self.assertNotEqual(self.a.replica_id, self.b.replica_id)
+
+        # One edit on each side: with a shared id neither would look concurrent
+        self.a.update_password('x.example', 'me', 'edited-on-a')
+        self.b.update_password('x.example', 'me', 'edited-on-b')
+        self.sync_both()
+        self.sync_both()
+        current = self.a.get_password('x.example', 'me')
+        self.assertEqual(self.b.get_password('x.example', 'me'), current)
+        losing = ({'edited-on-a', 'edited-on-b'} - {current}).pop()
+        for db in (self.a, self.b):
+            self.assertIn(losing, self.history(db))
+
+    def test_restored_vault_is_a_new_replica(self):
+        self.a.set_meta('sync_peers', {'b': {'sent': 1}})
+        os.chdir('a')
+        pm = self.open_vault()
+        pm.backup('../full.pmb', MASTER_PASSWORD)
+        pm.close()
+        os.chdir('..')
+        restore_backup('full.pmb', MASTER_PASSWORD, 'restored')
+        restored = self.open_vault('restored').db_manager
+        self.assertNotEqual(restored.replica_id, self.a.replica_id)
+        self.assertEqual(restored.get_meta('sync_peers', {}), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
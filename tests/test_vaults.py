@@ -0,0 +1,33 @@
+import json
+import os
+import unittest
+
+from tests.helpers import MASTER_PASSWORD, VaultTestCase
+from src import kdf
+from src.backup import restore_backup
+from src.config import KDF_SETTINGS_FILE, VAULT_DIR
+
+
+class VaultKdfSettingsTest(VaultTestCase):
+
+    def test_settings_are_kept_per_vault(self):
+        team_a = os.path.join(VAULT_DIR, 'team-a')
+        os.makedirs(team_a)
+        kdf.save_settings('pbkdf2-sha256', {'i': 1000},
+                          os.path.join(team_a, KDF_SETTINGS_FILE))
+        kdf.save_settings('pbkdf2-sha256', {'i': 2000}, KDF_SETTINGS_FILE)
+
+        a = self.open_vault(vault='team-a')
+        b = self.open_vault(vault='team-b')
+        self.assertEqual(a.password_hasher.params, {'i': 1000})
+        self.assertEqual(b.password_hasher.params, kdf.default_params('pbkdf2-sha256'))
+
+        a.backup('team-a.pmb', MASTER_PASSWORD)
+        a.close()
+        restore_backup('team-a.pmb', MASTER_PASSWORD, 'restored')
+        with open(os.path.join('restored', KDF_SETTINGS_FILE)) as f:
+            self.assertEqual(json.load(f)['params'], {'i': 1000})
+
+
+if __name__ == '__main__':
+    unittest.main()